@@ -110,6 +110,9 @@ superMysql="mysql --defaults-extra-file=${mySuperCredFile} -hlocalhost"
 currentEdition=$(${superMysql} -NB cyclestreets -e "select routingDb from map_config where id = 1;")
 currentApiV2Url=$(${superMysql} -NB cyclestreets -e "select apiV2Url from map_config where id = 1;")
 
+# Optionally sync the database incrementally, as read by sync-recent.sh and restore-recent.sh
+incrementalSync=${fallbackIncrementalSync}
+
 # Restore recent data
 . ${SCRIPTDIRECTORY}/../utility/sync-recent.sh
 echo "$(date --iso-8601=seconds)	Data files synced" >> ${setupLogFile}
@@ -0,0 +1,178 @@
+# Converts the geometry columns loaded by ogr2ogr to SRID 0, so they can take a spatial index and all the spatial functions.
+#
+# Replaces running convert_srid.sql, which takes each table in turn through one shared dev_geom_fixer table, writing every
+# geometry three times. Here each table is converted by a pool of connections into a staging table of its own, created
+# like the table but with its geometry column restricted to SRID 0 and no spatial index, and the staging table is then
+# renamed into place in one statement. The geometries pass through WKB, which is much more compact than the GeoJSON text
+# that large boundaries such as Shetland were converted through, in chunks of the table's key so no one statement
+# converts the whole table. Once every table is converted the spatial indexes are built, each in one alter table.
+#
+# The tables converted are those given, or else every table of the database with a geometry column not yet restricted
+# to SRID 0. A report gives the rows and the seconds spent converting and indexing each table.
+#
+# Synopsis
+#	convertSrid.py [--defaults-extra-file file] [--workers n] [--chunk-rows n] database [table ...]
+#
+# Example
+# user@machine:$
+# python3 convertSrid.py --defaults-extra-file ~/.mySuperUserCredentials.cnf osboundaryline
+
+# Dependencies
+import sys, os, time, threading, subprocess, argparse
+from concurrent.futures import ThreadPoolExecutor
+
+# Name of the converted column, and the suffix of the staging tables
+geometryColumn = 'geometry'
+stagingSuffix = '__srid0'
+
+# Large geometries are converted in a single value, which must fit within the packet size, so the maximum is allowed
+maxAllowedPacket = 1024 * 1024 * 1024
+
+class sridConverter ():
+    """
+    Converts the geometry columns of a database's tables to SRID 0 in parallel, indexing them at the end.
+    """
+
+    def __init__(self, database):
+
+        # Database whose tables are converted
+        self.database = database
+
+        # Options
+        self.defaultsExtraFile = None
+        self.workers = os.cpu_count() or 4
+        self.chunkRows = 500
+
+        # Timings per table, as dicts of rows, convertSeconds and indexSeconds, guarded by the lock as they are set from several threads
+        self.profile = {}
+        self.lock = threading.Lock()
+
+
+    def query (self, sql):
+        """
+        Runs statements on a new connection and returns the rows as lists of strings; the defaults-extra-file is a positional argument which must come first.
+        """
+        command = ['mysql']
+        if self.defaultsExtraFile:
+            command.append('--defaults-extra-file=' + self.defaultsExtraFile)
+        output = subprocess.run(command + ['-hlocalhost', '-N', '-B', self.database], input = sql, check = True, capture_output = True, text = True).stdout
+        return [line.split('\t') for line in output.splitlines()]
+
+
+    def tables (self):
+        """
+        Returns the tables with a geometry column that is not restricted to SRID 0, largest first.
+        """
+        rows = self.query("select c.table_name from information_schema.columns c join information_schema.tables t using (table_schema, table_name)"
+            " where c.table_schema = '{}' and c.column_name = '{}' and c.data_type = 'geometry' and coalesce(c.srs_id, -1) != 0 and t.table_type = 'BASE TABLE'"
+            " order by t.data_length desc;".format(self.database, geometryColumn))
+        return [row[0] for row in rows]
+
+
+    def columns (self, table):
+        """
+        Returns the columns of a table in order, and its single column key.
+        """
+        columns = [row[0] for row in self.query("select column_name from information_schema.columns where table_schema = '{}' and table_name = '{}'"
+            " order by ordinal_position;".format(self.database, table))]
+        keys = [row[0] for row in self.query("select column_name from information_schema.statistics where table_schema = '{}' and table_name = '{}'"
+            " and index_name = 'PRIMARY' order by seq_in_index;".format(self.database, table))]
+        if len(keys) != 1:
+            raise RuntimeError('The table {}.{} needs a single column primary key to be converted in chunks'.format(self.database, table))
+        return columns, keys[0]
+
+
+    def createStaging (self, table):
+        """
+        Creates the staging table of a table, with its geometry column restricted to SRID 0 and without a spatial index.
+        """
+        staging = table + stagingSuffix
+        spatial = [row[0] for row in self.query("select distinct index_name from information_schema.statistics where table_schema = '{}' and table_name = '{}'"
+            " and index_type = 'SPATIAL';".format(self.database, table))]
+        alterations = ['drop index `{}`'.format(name) for name in spatial] + ['modify `{0}` geometry not null srid 0'.format(geometryColumn)]
+        self.query('drop table if exists `{0}`;\ncreate table `{0}` like `{1}`;\nalter table `{0}` {2};'.format(staging, table, ', '.join(alterations)))
+        return staging
+
+
+    def convert (self, table):
+        """
+        Converts a table through its staging table, a chunk of its key at a time, and renames the staging table into place.
+        """
+        started = time.time()
+        columns, key = self.columns(table)
+        staging = self.createStaging(table)
+
+        # Geographic SRIDs are lat-long internally, so the WKB is asked for as long-lat to keep x as the longitude, as GeoJSON does
+        selected = ['st_geomfromwkb(st_aswkb(`{0}`, \'axis-order=long-lat\'), 0)'.format(column) if column == geometryColumn else '`{}`'.format(column) for column in columns]
+        insert = 'insert into `{}` ({}) select {} from `{}`'.format(staging, ', '.join('`{}`'.format(column) for column in columns), ', '.join(selected), table)
+
+        lowest, highest = self.query('select min(`{0}`), max(`{0}`) from `{1}`;'.format(key, table))[0]
+        if lowest != 'NULL':
+            for start in range(int(lowest), int(highest) + 1, self.chunkRows):
+                self.query('{} where `{}` >= {:d} and `{}` < {:d};'.format(insert, key, start, key, start + self.chunkRows))
+
+        # Every row must have come across before the original is replaced
+        rows, converted = self.query('select (select count(*) from `{}`), (select count(*) from `{}`);'.format(table, staging))[0]
+        if rows != converted:
+            raise RuntimeError('Only {} of the {} rows of {}.{} were converted'.format(converted, rows, self.database, table))
+        self.query('drop table if exists `{0}__old`;\nrename table `{0}` to `{0}__old`, `{1}` to `{0}`;\ndrop table `{0}__old`;'.format(table, staging))
+
+        with self.lock:
+            self.profile[table] = {'rows': int(rows), 'convertSeconds': round(time.time() - started, 1), 'indexSeconds': 0}
+
+
+    def index (self, table):
+        """
+        Builds the spatial index of a converted table.
+        """
+        started = time.time()
+        self.query('alter table `{0}` add spatial key `{1}` (`{1}`);'.format(table, geometryColumn))
+        with self.lock:
+            self.profile[table]['indexSeconds'] = round(time.time() - started, 1)
+
+
+    def run (self, tables = None):
+        """
+        Converts the tables, then indexes them.
+        """
+        tables = tables or self.tables()
+        self.query('set global max_allowed_packet := {:d};'.format(maxAllowedPacket))
+        with ThreadPoolExecutor(max_workers = self.workers) as executor:
+            for result in [executor.submit(self.convert, table) for table in tables]:
+                result.result()
+            for result in [executor.submit(self.index, table) for table in tables]:
+                result.result()
+
+
+    def report (self):
+        """
+        Prints the timings of each table, slowest first.
+        """
+        for table, entry in sorted(self.profile.items(), key = lambda item: item[1]['convertSeconds'] + item[1]['indexSeconds'], reverse = True):
+            print('#\t{:<40} {:10,d} rows  convert {:8.1f}s  index {:8.1f}s'.format(table, entry['rows'], entry['convertSeconds'], entry['indexSeconds']))
+
+
+# Main
+if __name__ == '__main__':
+
+    # Read args supplied to script
+    parser = argparse.ArgumentParser(description = 'Converts geometry columns to SRID 0 in parallel and indexes them.')
+    parser.add_argument('--defaults-extra-file', dest = 'defaultsExtraFile', help = 'MySQL super user credentials')
+    parser.add_argument('--workers', type = int, default = os.cpu_count(), help = 'Number of tables converted at once')
+    parser.add_argument('--chunk-rows', dest = 'chunkRows', type = int, default = 500, help = 'Range of keys converted in each statement')
+    parser.add_argument('-q', dest = 'quiet', action = 'store_true', help = 'Do not report timings')
+    parser.add_argument('database')
+    parser.add_argument('tables', nargs = '*')
+    args = parser.parse_args()
+
+    converter = sridConverter(args.database)
+    converter.defaultsExtraFile = args.defaultsExtraFile
+    converter.workers = args.workers
+    converter.chunkRows = args.chunkRows
+
+    converter.run(args.tables)
+    if not args.quiet:
+        converter.report()
+
+
+# End of file
@@ -142,9 +142,9 @@ ${superMysql} < $SCRIPTDIRECTORY/osboundaryline.sql
 echo "#	$(date)	Import GeoPackage into MySQL"
 ogr2ogr -progress -f MySQL MySQL:osboundaryline,user=root,password=$mysqlRootPassword $gpkgFile -t_srs EPSG:4326 -update -overwrite -lco ENGINE=InnoDB -lco GEOMETRY_NAME=geometry -lco ENGINE=InnoDB
 
-# Convert SRID
-echo "#	$(date)	Convert to SRID zero to use MySQL spatial index and all spatial functions (takes about an hour)"
-${superMysql} osboundaryline < $SCRIPTDIRECTORY/convert_srid.sql
+# Convert SRID, each table in parallel (see convert_srid.sql for the equivalent single-threaded queries)
+echo "#	$(date)	Convert to SRID zero to use MySQL spatial index and all spatial functions"
+python3 $SCRIPTDIRECTORY/convertSrid.py --defaults-extra-file ${mySuperCredFile} osboundaryline
 
 # Apply optimizations
 echo "#	$(date)	Boundary line optimizations"
@@ -178,7 +178,7 @@ ogr2ogr -progress -f MySQL "MySQL:csExternal,user=root,password=$mysqlRootPasswo
 
 # Convert SRID
 echo "#	$(date)	Convert to SRID zero to use MySQL spatial index and all spatial functions"
-${superMysql} csExternal < $SCRIPTDIRECTORY/ireland_convert_srid.sql
+python3 $SCRIPTDIRECTORY/convertSrid.py --defaults-extra-file ${mySuperCredFile} csExternal ireland_counties
 
 # Report completion
 echo "#	$(date) Ireland counties loaded"
@@ -200,7 +200,7 @@ ogr2ogr -progress -f MySQL "MySQL:csExternal,user=root,password=$mysqlRootPasswo
 
 # Convert SRID
 echo "#	$(date)	Convert to SRID zero to use MySQL spatial index and all spatial functions"
-${superMysql} csExternal < $SCRIPTDIRECTORY/northern_ireland_convert_srid.sql
+python3 $SCRIPTDIRECTORY/convertSrid.py --defaults-extra-file ${mySuperCredFile} csExternal northern_ireland
 
 # Report completion
 echo "#	$(date) Northern Ireland districts loaded"
@@ -0,0 +1,388 @@
+# Chunked, parallel loader for the ONS Postcode Directory, applying only the changes since the previous install.
+#
+# Used by run.sh in place of a mysqlimport of the whole of ONSdata.csv. The CSV is split into byte ranges aligned to
+# lines, as the directory has no line breaks within its fields, which a pool of processes parse at once. Each keeps only
+# the columns of the ONSdata table, or those given with --columns, converts their values by the table's column types,
+# and writes them as TSV together with a hash of each postcode's content. Columns are matched by position, as mysqlimport
+# does, or by name when every column loaded is named in the CSV header; when only some are, the load stops with an error.
+#
+# The hashes are loaded into a table of their own and compared in the database with those of the previous install,
+# kept in ONSdata_hash. Only new and changed postcodes are then loaded, in batches upserted into ONSdata, and postcodes
+# no longer in the directory are deleted from it, so a refresh costs time in proportion to the changes rather than to
+# the whole directory. When ONSdata is empty or there are no previous hashes, every postcode is loaded.
+# As with mysqlimport --ignore, the first of any duplicated postcodes is kept.
+#
+# The hashes only compare like with like, so a fingerprint of the table definitions and of the columns loaded, with
+# their types, is kept as the comment of ONSdata_hash. When it differs, the table definitions given with --definitions
+# are loaded again, replacing ONSdata, and every postcode is loaded.
+#
+# Synopsis
+#	postcodeLoader.py [--defaults-extra-file file] [--workers n] [--columns list] [--batch-rows n] [--folder folder] [--definitions file] database csvFile
+#
+# Example
+# cyclestreets@veebee:$
+# python3 install-postcode/postcodeLoader.py --defaults-extra-file ~/.mySuperUserCredentials.cnf --folder /var/lib/mysql-files --definitions tableDefinitions.sql csExternal /websites/www/content/import/ONSdata/ONSdata.csv
+
+# Dependencies
+import sys, os, csv, time, hashlib, subprocess, argparse
+from concurrent.futures import ProcessPoolExecutor
+
+# Tables: the directory, its content hashes, and where changes are staged
+table = 'ONSdata'
+hashTable = 'ONSdata_hash'
+stagingTable = 'ONSdata_changes'
+
+# Column types converted as numbers, by MySQL data type
+integerTypes = ('tinyint', 'smallint', 'mediumint', 'int', 'bigint')
+decimalTypes = ('decimal', 'float', 'double')
+
+def escape (value):
+    """
+    Escapes a value for a TSV read by load data infile.
+    """
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+
+def convert (value, kind, nullable):
+    """
+    Returns a value as written to the TSV, checked against its column's type; values that do not fit are null, or zero if the column is not nullable.
+    """
+    value = value.strip()
+    if kind == 'string':
+        return escape(value)
+    try:
+        if kind == 'integer':
+            return str(int(value))
+        float(value)
+        return value
+    except ValueError:
+        return '\\N' if nullable else '0'
+
+
+def parseChunk (csvFile, start, end, columns, keyIndex, output):
+    """
+    Parses the lines starting within a byte range of the CSV, writing the converted columns and the hash of each postcode.
+    Runs in a separate process; returns the number of rows.
+    """
+    rows = 0
+    with open(csvFile, 'rb') as f:
+
+        # A line belongs to the range in which it starts, so read on from the end of the line before, which for the first range is the header
+        f.seek(max(0, start - 1))
+        f.readline()
+
+        with open(output + '.tsv', 'w', encoding = 'utf-8', newline = '\n') as data, open(output + '.hash.tsv', 'w', encoding = 'utf-8', newline = '\n') as hashes:
+            while f.tell() <= end:
+                line = f.readline()
+                if not line:
+                    break
+                fields = next(csv.reader([line.decode('utf-8-sig', 'replace')]), None)
+                if not fields:
+                    continue
+                values = [convert(fields[index] if index < len(fields) else '', kind, nullable) for index, kind, nullable in columns]
+                row = '\t'.join(values)
+                data.write(row + '\n')
+                hashes.write('{}\t{}\n'.format(values[keyIndex], hashlib.blake2b(row.encode('utf-8'), digest_size = 8).hexdigest()))
+                rows += 1
+    os.chmod(output + '.tsv', 0o644)
+    os.chmod(output + '.hash.tsv', 0o644)
+    return rows
+
+
+class postcodeLoader ():
+    """
+    Loads the ONS Postcode Directory, applying only what has changed since it was last loaded.
+    """
+
+    def __init__(self, database, csvFile):
+
+        # Database and source
+        self.database = database
+        self.csvFile = csvFile
+
+        # Options
+        self.defaultsExtraFile = None
+        self.workers = os.cpu_count() or 4
+        self.columnNames = None
+        self.batchRows = 50000
+        self.folder = os.path.dirname(os.path.abspath(csvFile))
+        self.definitions = None
+
+        # Columns loaded, as (name, csv index, kind, nullable), the key, and the fingerprint of the definitions and columns
+        self.columns = []
+        self.key = None
+        self.fingerprint = None
+
+        # Counts of the changes applied, and timings in seconds as (stage, seconds)
+        self.counts = {}
+        self.timings = []
+
+
+    def query (self, sql):
+        """
+        Runs statements and returns the rows as lists of strings; the defaults-extra-file is a positional argument which must come first.
+        """
+        command = ['mysql']
+        if self.defaultsExtraFile:
+            command.append('--defaults-extra-file=' + self.defaultsExtraFile)
+        output = subprocess.run(command + ['-hlocalhost', '-N', '-B', self.database], input = sql, check = True, capture_output = True, text = True).stdout
+        return [line.split('\t') for line in output.splitlines()]
+
+
+    def record (self, stage, started):
+        self.timings.append((stage, time.time() - started))
+
+
+    def readColumns (self):
+        """
+        Matches the columns of the table to the CSV header, and finds the key.
+        """
+        with open(self.csvFile, newline = '', encoding = 'utf-8-sig') as f:
+            header = [name.strip().lower() for name in next(csv.reader(f))]
+
+        rows = self.query("select column_name, data_type, is_nullable, column_key from information_schema.columns where table_schema = '{}' and table_name = '{}'"
+            " order by ordinal_position;".format(self.database, table))
+        if not rows:
+            raise RuntimeError('There is no table {}.{} to load'.format(self.database, table))
+
+        # By position, as mysqlimport loads them, unless every column loaded is named in the header; a partial match is ambiguous
+        loaded = [name for name, dataType, nullable, key in rows if not self.columnNames or name in self.columnNames or key == 'PRI']
+        unmatched = [name for name in loaded if name.lower() not in header]
+        byName = not unmatched
+        if unmatched and len(unmatched) < len(loaded):
+            raise RuntimeError('Only some columns of {}.{} are named in the CSV header, so they cannot be matched by name; not in the header: {}'.format(self.database, table, ', '.join(unmatched)))
+
+        fingerprint = hashlib.md5()
+        for position, (name, dataType, nullable, key) in enumerate(rows):
+            index = header.index(name.lower()) if byName and name.lower() in header else (None if byName else position)
+            if key == 'PRI':
+                self.key = name
+            if index is None or index >= len(header) or name not in loaded:
+                continue
+            kind = 'integer' if dataType in integerTypes else 'decimal' if dataType in decimalTypes else 'string'
+            self.columns.append((name, index, kind, nullable == 'YES'))
+            fingerprint.update('{}\t{:d}\t{}\t{}\t{}\n'.format(name, index, dataType, nullable, key).encode('utf-8'))
+        self.fingerprint = self.definitionsDigest() + ':' + fingerprint.hexdigest()
+
+        if self.key not in [name for name, index, kind, nullable in self.columns]:
+            raise RuntimeError('The key of {}.{} must be loaded from the CSV'.format(self.database, table))
+
+
+    def definitionsDigest (self):
+        """
+        Returns the md5 of the table definitions, or nothing if they are not given.
+        """
+        if not self.definitions:
+            return ''
+        with open(self.definitions, 'rb') as f:
+            return hashlib.md5(f.read()).hexdigest()
+
+
+    def storedFingerprint (self):
+        """
+        Returns the fingerprint kept with the hashes of the previous install, or None.
+        """
+        rows = self.query("select table_comment from information_schema.tables where table_schema = '{}' and table_name = '{}';".format(self.database, hashTable))
+        return rows[0][0] if rows else None
+
+
+    def loadDefinitions (self):
+        """
+        Loads the table definitions, replacing the table.
+        """
+        started = time.time()
+        with open(self.definitions) as f:
+            self.query('drop table if exists `{}`;\n'.format(table) + f.read())
+        self.record('Table definitions', started)
+
+
+    def chunks (self):
+        """
+        Returns the byte ranges into which the CSV is split, several per worker so they finish together.
+        """
+        size = os.path.getsize(self.csvFile)
+        count = max(1, self.workers * 4)
+        step = max(1, size // count)
+        return [(start, min(size, start + step) - 1) for start in range(0, size, step)]
+
+
+    def parse (self):
+        """
+        Parses the CSV in parallel, returning the prefixes of the chunk files in order.
+        """
+        started = time.time()
+        columns = [(index, kind, nullable) for name, index, kind, nullable in self.columns]
+        keyIndex = [name for name, index, kind, nullable in self.columns].index(self.key)
+        outputs = [os.path.join(self.folder, '{}.{:04d}'.format(table, number)) for number, chunk in enumerate(self.chunks())]
+        with ProcessPoolExecutor(max_workers = self.workers) as executor:
+            results = [executor.submit(parseChunk, self.csvFile, start, end, columns, keyIndex, output) for (start, end), output in zip(self.chunks(), outputs)]
+            self.counts['rows'] = sum(result.result() for result in results)
+        self.record('Parse', started)
+        return outputs
+
+
+    def loadFile (self, tsv, into, columns):
+        """
+        Loads a TSV into a table, keeping the first of any duplicated keys.
+        """
+        self.query("load data infile '{}' ignore into table `{}` ({});".format(tsv.replace('\\', '\\\\').replace("'", "\\'"), into, ', '.join('`{}`'.format(column) for column in columns)))
+
+
+    def loadHashes (self, outputs):
+        """
+        Loads the hashes of the new directory into a table of their own.
+        """
+        started = time.time()
+        keyType = self.query("select column_type from information_schema.columns where table_schema = '{}' and table_name = '{}' and column_name = '{}';".format(self.database, table, self.key))[0][0]
+        self.query("drop table if exists `{0}_new`;\ncreate table `{0}_new` (postcode {1} not null primary key, contentHash char(16) not null) engine = InnoDB comment = '{2}';".format(hashTable, keyType, self.fingerprint))
+        for output in outputs:
+            self.loadFile(output + '.hash.tsv', hashTable + '_new', ['postcode', 'contentHash'])
+        self.record('Load hashes', started)
+
+
+    def previous (self):
+        """
+        Returns whether there is a previous install to compare with.
+        """
+        exists = self.query("select count(*) from information_schema.tables where table_schema = '{}' and table_name = '{}';".format(self.database, hashTable))[0][0] != '0'
+        return exists and self.query('select exists (select 1 from `{}`);'.format(table))[0][0] == '1'
+
+
+    def loadAll (self, outputs):
+        """
+        Loads every postcode, into an emptied table.
+        """
+        started = time.time()
+        self.query('truncate `{}`;'.format(table))
+        for output in outputs:
+            self.loadFile(output + '.tsv', table, [name for name, index, kind, nullable in self.columns])
+        self.counts['inserted'] = int(self.query('select count(*) from `{}`;'.format(table))[0][0])
+        self.record('Load all', started)
+
+
+    def applyChanges (self, outputs):
+        """
+        Upserts the new and changed postcodes in batches, and deletes those no longer present.
+        """
+        started = time.time()
+        names = [name for name, index, kind, nullable in self.columns]
+        changed = set(row[0] for row in self.query('select n.postcode from `{0}_new` n left join `{0}` o using (postcode) where o.contentHash is null or o.contentHash != n.contentHash;'.format(hashTable)))
+        removed = [row[0] for row in self.query('select o.postcode from `{0}` o left join `{0}_new` n using (postcode) where n.postcode is null;'.format(hashTable))]
+        self.counts['changed'] = len(changed)
+        self.counts['removed'] = len(removed)
+
+        # Stage the changed rows, batch by batch
+        self.query('drop table if exists `{0}`;\ncreate table `{0}` like `{1}`;'.format(stagingTable, table))
+        keyIndex = names.index(self.key)
+        upsert = 'insert into `{0}` ({1}) select {1} from `{2}` on duplicate key update {3};'.format(table, ', '.join('`{}`'.format(name) for name in names), stagingTable, ', '.join('`{0}` = values(`{0}`)'.format(name) for name in names if name != self.key))
+        batchFile = os.path.join(self.folder, stagingTable + '.tsv')
+        seen = set()
+        batch = []
+        for output in outputs:
+            with open(output + '.tsv', encoding = 'utf-8') as f:
+                for line in f:
+                    key = line.rstrip('\n').split('\t')[keyIndex]
+                    if key in changed and key not in seen:
+                        seen.add(key)
+                        batch.append(line)
+                    if len(batch) >= self.batchRows:
+                        self.upsertBatch(batch, batchFile, names, upsert)
+                        batch = []
+        if batch:
+            self.upsertBatch(batch, batchFile, names, upsert)
+
+        # Delete in batches of keys
+        for start in range(0, len(removed), 1000):
+            keys = ', '.join("'{}'".format(key.replace('\\', '\\\\').replace("'", "\\'")) for key in removed[start:start + 1000])
+            self.query('delete from `{}` where `{}` in ({});'.format(table, self.key, keys))
+
+        self.query('drop table `{}`;'.format(stagingTable))
+        self.record('Apply changes', started)
+
+
+    def upsertBatch (self, batch, batchFile, names, upsert):
+        """
+        Upserts a batch of rows through the staging table.
+        """
+        with open(batchFile, 'w', encoding = 'utf-8', newline = '\n') as f:
+            f.writelines(batch)
+        os.chmod(batchFile, 0o644)
+        self.query('truncate `{}`;'.format(stagingTable))
+        self.loadFile(batchFile, stagingTable, names)
+        self.query(upsert)
+        os.unlink(batchFile)
+
+
+    def load (self):
+        """
+        Loads the directory, as a whole or just its changes, then keeps its hashes for the next time.
+        """
+        started = time.time()
+
+        # Definitions that have changed, or whose table is missing, are loaded again, which empties the table
+        stored = self.storedFingerprint()
+        reloaded = False
+        if self.definitions:
+            tableExists = self.query("select count(*) from information_schema.tables where table_schema = '{}' and table_name = '{}';".format(self.database, table))[0][0] != '0'
+            if not tableExists or stored is None or stored.split(':')[0] != self.definitionsDigest():
+                self.loadDefinitions()
+                reloaded = True
+
+        self.readColumns()
+        outputs = self.parse()
+        try:
+            self.loadHashes(outputs)
+            if not reloaded and stored == self.fingerprint and self.previous():
+                self.applyChanges(outputs)
+            else:
+                self.loadAll(outputs)
+            self.query('drop table if exists `{0}`;\nrename table `{0}_new` to `{0}`;'.format(hashTable))
+        finally:
+            for output in outputs:
+                for path in (output + '.tsv', output + '.hash.tsv'):
+                    if os.path.exists(path):
+                        os.unlink(path)
+        self.record('Total', started)
+
+
+    def report (self):
+        """
+        Prints the counts and timings.
+        """
+        print('#\t' + ', '.join('{} {:,d}'.format(name, count) for name, count in self.counts.items()))
+        for stage, seconds in self.timings:
+            print('#\t{:<48} {:8.1f}s'.format(stage, seconds))
+
+
+# Main
+if __name__ == '__main__':
+
+    # Read args supplied to script
+    parser = argparse.ArgumentParser(description = 'Loads the ONS Postcode Directory in parallel, applying only the changes.')
+    parser.add_argument('--defaults-extra-file', dest = 'defaultsExtraFile', help = 'MySQL super user credentials')
+    parser.add_argument('--workers', type = int, default = os.cpu_count(), help = 'Number of processes parsing the CSV')
+    parser.add_argument('--columns', help = 'Comma separated columns to load, if not all those of the table')
+    parser.add_argument('--batch-rows', dest = 'batchRows', type = int, default = 50000, help = 'Changed rows upserted at a time')
+    parser.add_argument('--folder', help = 'Folder from which MySQL can read files, if not that of the CSV')
+    parser.add_argument('--definitions', help = 'Table definitions, loaded when they have changed since the previous install')
+    parser.add_argument('-q', dest = 'quiet', action = 'store_true', help = 'Do not report counts and timings')
+    parser.add_argument('database')
+    parser.add_argument('csvFile')
+    args = parser.parse_args()
+
+    loader = postcodeLoader(args.database, args.csvFile)
+    loader.defaultsExtraFile = args.defaultsExtraFile
+    loader.workers = args.workers
+    loader.batchRows = args.batchRows
+    if args.columns:
+        loader.columnNames = args.columns.split(',')
+    if args.folder:
+        loader.folder = args.folder
+    loader.definitions = args.definitions
+
+    loader.load()
+    if not args.quiet:
+        loader.report()
+
+
+# End of file
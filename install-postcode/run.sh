@@ -157,10 +157,6 @@ then
     exit 1;
 fi
 
-# Load the table definitions
-echo "#	Loading the table definitions"
-${superMysql} ${externalDb} < tableDefinitions.sql
-
 # Handle secure-file-priv, if set
 # Use of set from comment by dorsh:
 # https://stackoverflow.com/a/9558954/225876
@@ -168,39 +164,21 @@ ${superMysql} ${externalDb} < tableDefinitions.sql
 set $(${superMysql} --batch --skip-column-names --silent -e "show variables like 'secure_file_priv'")
 secureFilePriv=$2
 
-# If there's a secure folder then move the csv file there
-if [ -n "$secureFilePriv" ]; then
-
-	# Secure readable location
-	mysqlReadableFolder=${secureFilePriv}
-
-	# Ensure it exists
-	mkdir -p ${mysqlReadableFolder}
-
-	# Move csv file there
-	mv ${onsFolder}/ONSdata.csv ${mysqlReadableFolder}
-
-	# Set path
-	ONSdataFile=${mysqlReadableFolder}/ONSdata.csv
-
-else
-	# Set path
-	ONSdataFile=${onsFolder}/ONSdata.csv
-fi
+# Folder from where mysql can read the converted data
+mysqlReadableFolder=${secureFilePriv:-${onsFolder}}
+mkdir -p ${mysqlReadableFolder}
 
 # Narrative
 echo "#	Loading CSV file"
 
-# Load the CSV file. Need to use root as website doesn't have LOAD DATA privilege.
-# -ignore is needed as the Aug 2025 contained duplicates for e.g KY7 5TA
-mysqlimport --defaults-extra-file=${mySuperCredFile} -hlocalhost --fields-optionally-enclosed-by='"' --fields-terminated-by=',' --lines-terminated-by="\n" --ignore-lines=1 --ignore  ${externalDb} ${ONSdataFile}
-
-# NB Mysql equivalent is:
-## load data infile '/websites/www/content/import/ONSdata/ONSdata.csv' ignore into table csExternal.ONSdata fields terminated by ',' optionally enclosed by '"' lines terminated by '\n' ignore 1 lines;
-## SHOW WARNINGS;
+# Parse the CSV in parallel and load the postcodes that are new or changed since the previous install, or all of them the first time.
+# The table definitions are loaded the first time and whenever they change, when every postcode is loaded again.
+# This uses the super user, as the website user does not have the LOAD DATA privilege.
+# Duplicates, such as KY7 5TA in the Aug 2025 data, are ignored as mysqlimport --ignore did.
+python3 ${ScriptHome}/install-postcode/postcodeLoader.py --defaults-extra-file ${mySuperCredFile} --folder ${mysqlReadableFolder} --definitions tableDefinitions.sql ${externalDb} ${onsFolder}/ONSdata.csv
 
 # Remove the data file
-rm -f ${ONSdataFile}
+rm -f ${onsFolder}/ONSdata.csv
 
 # Tidy extracted data into postcode table
 echo "#	Creating new postcode table"
@@ -916,8 +916,32 @@ fi
 # Restore abandon-on-error
 set -e
 
-# Add the service to the system initialization, so that it will start on reboot
-systemctl enable cyclestreets@9000
+# Dispatcher for a pool of routing workers, started in place of the single service by routingPool.py
+dispatcherService=/etc/systemd/system/cyclestreets-dispatcher@.service
+if [ -n "${routingWorkers}" ]; then
+    cp ${ScriptHome}/live-deployment/cyclestreets-dispatcher@.service ${dispatcherService}
+    sed -i "s|%ScriptHome|${ScriptHome}|g" ${dispatcherService}
+    sed -i "s|%username|${username}|g" ${dispatcherService}
+    sed -i "s|%routingWorkers|${routingWorkers}|g" ${dispatcherService}
+    sed -i "s|%websitesLogsFolder|${websitesLogsFolder}|g" ${dispatcherService}
+    chown root:root ${dispatcherService}
+    systemctl daemon-reload
+elif [ -f ${dispatcherService} ]; then
+    rm -f ${dispatcherService}
+    systemctl daemon-reload
+fi
+
+# Add the services to the system initialization, so that they will start on reboot
+if [ -n "${routingWorkers}" ]; then
+    # The pool's dispatcher listens on the edition port in place of the single service
+    systemctl disable cyclestreets@9000
+    systemctl enable cyclestreets-dispatcher@9000
+    for workerPort in $(python3 -c "import sys; sys.path.insert(0, '${ScriptHome}/utility'); from routingDispatcher import workerPorts; print(*workerPorts(9000, ${routingWorkers}))"); do
+        systemctl enable cyclestreets@${workerPort}
+    done
+else
+    systemctl enable cyclestreets@9000
+fi
 
 # Advise setting up
 if [ -n "${usingLocalhost}" ]; then
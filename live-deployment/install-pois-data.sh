@@ -323,45 +323,51 @@ routingFolder=${websitesContentFolder}/data/routing
 neTarball=${resolvedEdition}.tar.zst
 neTarballMd5=${neTarball}.md5
 
-# Avoid the download for localhost
-if [ "${importHostname}" = 'localhost' ]; then
-	vecho "No need to download for ${importHostname}, instead copying the local tarball."
-	cp ${websitesContentFolder}/import/output/${neTarballMd5} $routingFolder
-	cp ${websitesContentFolder}/import/output/${neTarball} $routingFolder
-	else
-
-		# Begin the file transfer
-		vecho "Transferring the routing files from the import machine ${importHostname}"
-
-		#	Copy md5 file
-		scp ${portScp} ${username}@${importHostname}:${importMachineEditions}/${neTarballMd5} $routingFolder > /dev/null 2>&1
-		if [ $? -ne 0 ]; then
-			# Avoid echo if possible as this generates cron emails
-			vecho "The import machine file could not be retrieved from:\n#\t${portScp} ${username}@${importHostname}:${importMachineEditions}/${neTarballMd5}\n#\tCopying to: ${routingFolder}."
-			exit 1
-		fi
-		#	Copy tarball file
-		scp ${portScp} ${username}@${importHostname}:${importMachineEditions}/${neTarball} $routingFolder > /dev/null 2>&1
-		if [ $? -ne 0 ]; then
-			# Avoid echo if possible as this generates cron emails
-			vecho "The import machine file could not be retrieved from:\n#\t${portScp} ${username}@${importHostname}:${importMachineEditions}/${neTarball}\n#\tCopying to: ${routingFolder}."
-			exit 1
-		fi
-		#	Note that all files are downloaded
-		vecho "File transfer stage complete"
-fi
+# The parallel installer streams the tarball later, checking it as it arrives, so skips this download and check
+if [ -z "${parallelRoutingInstall}" ]; then
+
+	# Avoid the download for localhost
+	if [ "${importHostname}" = 'localhost' ]; then
+		vecho "No need to download for ${importHostname}, instead copying the local tarball."
+		cp ${websitesContentFolder}/import/output/${neTarballMd5} $routingFolder
+		cp ${websitesContentFolder}/import/output/${neTarball} $routingFolder
+		else
+
+			# Begin the file transfer
+			vecho "Transferring the routing files from the import machine ${importHostname}"
+
+			#	Copy md5 file
+			scp ${portScp} ${username}@${importHostname}:${importMachineEditions}/${neTarballMd5} $routingFolder > /dev/null 2>&1
+			if [ $? -ne 0 ]; then
+				# Avoid echo if possible as this generates cron emails
+				vecho "The import machine file could not be retrieved from:\n#\t${portScp} ${username}@${importHostname}:${importMachineEditions}/${neTarballMd5}\n#\tCopying to: ${routingFolder}."
+				exit 1
+			fi
+			#	Copy tarball file
+			scp ${portScp} ${username}@${importHostname}:${importMachineEditions}/${neTarball} $routingFolder > /dev/null 2>&1
+			if [ $? -ne 0 ]; then
+				# Avoid echo if possible as this generates cron emails
+				vecho "The import machine file could not be retrieved from:\n#\t${portScp} ${username}@${importHostname}:${importMachineEditions}/${neTarball}\n#\tCopying to: ${routingFolder}."
+				exit 1
+			fi
+			#	Note that all files are downloaded
+			vecho "File transfer stage complete"
+	fi
 
 
 
-### Stage 3 - check data integrity
+	### Stage 3 - check data integrity
 
-# MD5 check
-cd $routingFolder
-md5sum ${quietLongOption} -c ${neTarballMd5}
-if [ $? -ne 0 ]; then
-	# Avoid echo if possible as this generates cron emails
-	vecho "Failed md5 check: md5sum -c $routingFolder/${neTarballMd5}"
-	exit 1
+	# MD5 check
+	cd $routingFolder
+	md5sum ${quietLongOption} -c ${neTarballMd5}
+	if [ $? -ne 0 ]; then
+		# Avoid echo if possible as this generates cron emails
+		vecho "Failed md5 check: md5sum -c $routingFolder/${neTarballMd5}"
+		exit 1
+	fi
+
+# End of download and check
 fi
 
 # Stop on errors
@@ -376,7 +382,44 @@ fi
 mkdir -p ${newEditionFolder}
 
 
+# Handle secure-file-priv, if set
+# Use of set from comment by dorsh:
+# https://stackoverflow.com/a/9558954/225876
+# This puts the values of the two columns in $1 and $2
+set $(${superMysql} --batch --skip-column-names --silent -e "show variables like 'secure_file_priv'")
+secureFilePriv=$2
+
 ### Stage 4 - unpack and install the TSV files
+if [ -n "${parallelRoutingInstall}" ]; then
+
+	# Locally the tarball is read from where it is copied from otherwise
+	if [ "${importHostname}" = 'localhost' ]; then
+		importMachineEditions=${websitesContentFolder}/import/output
+	fi
+
+	# Stream the tarball from the import machine, loading the tables into the external database in parallel as they arrive and checking them against its manifest
+	vecho "Streaming and installing the POIs into the external database: ${externalDb}"
+	if ! python3 ${ScriptHome}/utility/routingEditionInstaller.py ${quietOption} ${sshPort:+--ssh-port ${sshPort}} --username ${username} --defaults-extra-file ${mySuperCredFile} --secure-file-priv "${secureFilePriv}" --database ${externalDb} ${importHostname} ${importMachineEditions} ${resolvedEdition} ${routingFolder}
+	then
+		# The live POI tables are untouched, as the new ones are only renamed into place below
+		vecho "The POIs edition ${resolvedEdition} could not be installed from ${importHostname}"
+		rm -r ${newEditionFolder}
+		exit 1
+	fi
+
+	# Go to the edition folder
+	cd ${newEditionFolder}
+
+	#	Rename the tables, swapping them all into place at once
+	${superMysql} ${externalDb} < installPoiTables.sql
+
+	#	Clean up
+	if [ -n "$secureFilePriv" ]; then
+		rm -rf ${secureFilePriv}/${resolvedEdition}
+	fi
+
+else
+
 vecho "Unpack the tarball"
 tar xf ${neTarball}
 
@@ -397,13 +440,6 @@ ${superMysql} ${externalDb} < table/tableDefinitions.sql
 # Folder from where mysql can read the data
 mysqlReadableFolder=${newEditionFolder}/table
 
-# Handle secure-file-priv, if set
-# Use of set from comment by dorsh:
-# https://stackoverflow.com/a/9558954/225876
-# This puts the values of the two columns in $1 and $2
-set $(${superMysql} --batch --skip-column-names --silent -e "show variables like 'secure_file_priv'")
-secureFilePriv=$2
-
 # If there's a secure folder then move the tsv files there
 if [ -n "$secureFilePriv" ]; then
 
@@ -429,6 +465,9 @@ ${superMysql} ${externalDb} < installPoiTables.sql
 #	Clean up
 rm -r ${mysqlReadableFolder}
 
+# End of parallel or serial install
+fi
+
 
 ### Stage 7 - Finish
 
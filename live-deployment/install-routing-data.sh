@@ -275,6 +275,7 @@ if [ -n "${testargs}" ]; then
 	echo "#	importHostname=${importHostname}";
 	echo "#	importMachineEditions=${importMachineEditions}";
 	echo "#	keepRoutingDuringUpdate=${keepRoutingDuringUpdate}";
+	echo "#	parallelRoutingInstall=${parallelRoutingInstall}";
 	echo "#	notifyEmail=${notifyEmail}";
 	echo "#	portScp=${portScp}";
 	echo "#	portSsh=${portSsh}";
@@ -449,38 +450,44 @@ routingFolder=${websitesContentFolder}/data/routing
 neTarball=${resolvedEdition}.tar.zst
 neTarballMd5=${neTarball}.md5
 
-# Begin the file transfer
-vecho "Transferring the routing files from the import machine ${importHostname}"
+# The parallel installer streams the tarball later, checking it as it arrives, so skips this download and check
+if [ -z "${parallelRoutingInstall}" ]; then
 
-#	Copy md5 file
-scp ${portScp} ${username}@${importHostname}:${importMachineEditions}/${neTarballMd5} $routingFolder > /dev/null 2>&1
-if [ $? -ne 0 ]; then
-	# Avoid echo if possible as this generates cron emails
-	vecho "The import machine file could not be retrieved from:\n#\t${portScp} ${username}@${importHostname}:${importMachineEditions}/${neTarballMd5}\n#\tCopying to: ${routingFolder}."
-	exit 1
-fi
-#	Copy tarball file
-scp ${portScp} ${username}@${importHostname}:${importMachineEditions}/${neTarball} $routingFolder > /dev/null 2>&1
-if [ $? -ne 0 ]; then
-	# Avoid echo if possible as this generates cron emails
-	vecho "The import machine file could not be retrieved from:\n#\t${portScp} ${username}@${importHostname}:${importMachineEditions}/${neTarball}\n#\tCopying to: ${routingFolder}."
-	exit 1
-fi
+	# Begin the file transfer
+	vecho "Transferring the routing files from the import machine ${importHostname}"
+
+	#	Copy md5 file
+	scp ${portScp} ${username}@${importHostname}:${importMachineEditions}/${neTarballMd5} $routingFolder > /dev/null 2>&1
+	if [ $? -ne 0 ]; then
+		# Avoid echo if possible as this generates cron emails
+		vecho "The import machine file could not be retrieved from:\n#\t${portScp} ${username}@${importHostname}:${importMachineEditions}/${neTarballMd5}\n#\tCopying to: ${routingFolder}."
+		exit 1
+	fi
+	#	Copy tarball file
+	scp ${portScp} ${username}@${importHostname}:${importMachineEditions}/${neTarball} $routingFolder > /dev/null 2>&1
+	if [ $? -ne 0 ]; then
+		# Avoid echo if possible as this generates cron emails
+		vecho "The import machine file could not be retrieved from:\n#\t${portScp} ${username}@${importHostname}:${importMachineEditions}/${neTarball}\n#\tCopying to: ${routingFolder}."
+		exit 1
+	fi
 
-#	Note that all files are downloaded
-vecho "File transfer stage complete"
+	#	Note that all files are downloaded
+	vecho "File transfer stage complete"
 
 
 
-### Stage 3 - check data integrity
+	### Stage 3 - check data integrity
 
-# MD5 check
-cd $routingFolder
-md5sum ${quietLongOption} -c ${neTarballMd5}
-if [ $? -ne 0 ]; then
-	# Avoid echo if possible as this generates cron emails
-	vecho "Failed md5 check: md5sum -c $routingFolder/${neTarballMd5}"
-	exit 1
+	# MD5 check
+	cd $routingFolder
+	md5sum ${quietLongOption} -c ${neTarballMd5}
+	if [ $? -ne 0 ]; then
+		# Avoid echo if possible as this generates cron emails
+		vecho "Failed md5 check: md5sum -c $routingFolder/${neTarballMd5}"
+		exit 1
+	fi
+
+# End of download and check
 fi
 
 # Stop on errors
@@ -519,31 +526,55 @@ if [ -z "${keepRoutingDuringUpdate}" ]; then
 	sudo ${routingServiceStop}
 fi
 
+# Handle secure-file-priv, if set
+# Use of set from comment by dorsh:
+# https://stackoverflow.com/a/9558954/225876
+# This puts the values of the two columns in $1 and $2
+set $(${superMysql} --batch --skip-column-names --silent -e "show variables like 'secure_file_priv'")
+secureFilePriv=$2
+
 ### Stage 4 - unpack and install the TSV files
-vecho "Unpack the tarball"
-tar xf ${neTarball}
+if [ -n "${parallelRoutingInstall}" ]; then
 
-#	Clean up the compressed TSV data
-rm -f ${neTarball} ${neTarballMd5}
+	# Stream the tarball from the import machine, loading the routing database tables in parallel as they arrive
+	vecho "Streaming and installing the routing edition from the import machine ${importHostname}"
+	if ! python3 ${ScriptHome}/utility/routingEditionInstaller.py ${quietOption} ${sshPort:+--ssh-port ${sshPort}} --username ${username} --defaults-extra-file ${mySuperCredFile} --secure-file-priv "${secureFilePriv}" ${skipRoutingDb:+--skip-routing-db} ${importHostname} ${importMachineEditions} ${resolvedEdition} ${routingFolder}
+	then
+		# Avoid echo if possible as this generates cron emails
+		vecho "The routing edition ${resolvedEdition} could not be installed from ${importHostname}"
+		rm -r ${newEditionFolder}
+		exit 1
+	fi
+else
+	vecho "Unpack the tarball"
+	tar xf ${neTarball}
+
+	#	Clean up the compressed TSV data
+	rm -f ${neTarball} ${neTarballMd5}
+fi
 
 ### Stage 5 - create the routing database
 
 # Go to the edition folder
 cd ${newEditionFolder}
 
-# Handle secure-file-priv, if set
-# Use of set from comment by dorsh:
-# https://stackoverflow.com/a/9558954/225876
-# This puts the values of the two columns in $1 and $2
-set $(${superMysql} --batch --skip-column-names --silent -e "show variables like 'secure_file_priv'")
-secureFilePriv=$2
-
 # Optionally skip routingDb installation
 if [ -n "${skipRoutingDb}" ]; then
 
 	# Narrate
 	vecho "Skipping install of the routing database: ${resolvedEdition}"
 
+# The parallel installer has already created and loaded the routing database
+elif [ -n "${parallelRoutingInstall}" ]; then
+
+	#	Load nearest point stored procedures
+	vecho "Loading nearestPoint technology"
+	${superMysql} ${resolvedEdition} < ${websitesContentFolder}/documentation/schema/nearestPoint.sql
+
+	# Build the photo index
+	vecho "Building the photosEnRoute tables"
+	${superMysql} ${resolvedEdition} < ${websitesContentFolder}/documentation/schema/photosEnRoute.sql
+
 else
 
 	# Narrate
@@ -577,34 +608,8 @@ else
 	# Ensure readable
 	chmod a+r ${mysqlReadableFolder}/*.tsv
 
-	# Special sequence of commands to fast load these sometimes very large tables from
-	# https://dev.mysql.com/doc/refman/8.4/en/optimizing-myisam-bulk-data-loading.html
-	# Passwordless sudo allows these to run
-
-	# Flush each table
-	# Apply specifically rather than a general flush tables, which can be costly on a busy server
-	# The basename removes the .tsv from the filenames to get the table name through the complex string escaping.
-	find ${mysqlReadableFolder} -type f -name '*.tsv' -exec sh -c "${superMysql} ${resolvedEdition} -e \"flush table ${resolvedEdition}.\$(basename \"\$1\" \".tsv\")\"" sh {} \;
-
-	# Helpful bindings
-	mysqlFolder=/var/lib/mysql/
-	# Use nice to make the process less favourable to the scheduler, keeping other processes more favourable on the live site
-	# Requires passwordless sudo
-	sudoMyisamchk="sudo nice myisamchk --defaults-extra-file=/home/cyclestreets/.mySuperUserCredentials.cnf"
-	biggerBuffers="--myisam_sort_buffer_size=1G --key_buffer_size=12G --read_buffer_size=1G --write_buffer_size=1G"
-
-	# Turn off all indexes on the tables
-	# The sed removes the file extension.
-	find ${mysqlReadableFolder} -name '*.tsv' -type f -printf "${mysqlFolder}${resolvedEdition}/%f\n" | sed 's/\.[^.]*$//' | sort | xargs ${sudoMyisamchk} --keys-used=0
-
-	#	Import the data in alphabetical order
-	find ${mysqlReadableFolder} -name '*.tsv' -type f | sort | xargs ${superMysqlImport} ${resolvedEdition}
-
-	# Restore indexes on the tables, the quick option modifies only the index not the data
-	find ${mysqlReadableFolder} -name '*.tsv' -type f -printf "${mysqlFolder}${resolvedEdition}/%f\n" | sed 's/\.[^.]*$//' | sort | xargs ${sudoMyisamchk} ${biggerBuffers} --recover --quick
-
-	# Flush again
-	find ${mysqlReadableFolder} -type f -name '*.tsv' -exec sh -c "${superMysql} ${resolvedEdition} -e \"flush table ${resolvedEdition}.\$(basename \"\$1\" \".tsv\")\"" sh {} \;
+	# Load the tables largest first in parallel, deferring their indexes, and write the load profile
+	python3 ${ScriptHome}/utility/bulkLoader.py ${quietOption} --defaults-extra-file ${mySuperCredFile} --profile ${newEditionFolder}/loadProfile.${resolvedEdition}.json ${resolvedEdition} ${mysqlReadableFolder}/*.tsv
 
 	#	Clean up
 	rm -r ${mysqlReadableFolder}
@@ -670,8 +675,8 @@ if [ -d ${newEditionFolder}/planet ]; then
 	# Ensure readable
 	chmod a+r ${mysqlReadableFolder}/*.tsv
 
-	#	Load the data in alphabetical order
-	find ${mysqlReadableFolder} -name '*.tsv' -type f | sort | xargs ${superMysqlImport} ${planetDb}
+	#	Load the data, deferring the indexes as for the routing database
+	python3 ${ScriptHome}/utility/bulkLoader.py ${quietOption} --defaults-extra-file ${mySuperCredFile} --profile ${newEditionFolder}/loadProfile.${planetDb}.json ${planetDb} ${mysqlReadableFolder}/*.tsv
 
 	#	Clean up
 	rm -r ${mysqlReadableFolder}
@@ -723,8 +728,8 @@ if [ -d ${newEditionFolder}/external ]; then
 	# Ensure readable
 	chmod a+r ${mysqlReadableFolder}/*.tsv
 
-	#	Load the data in alphabetical order
-	find ${mysqlReadableFolder} -name '*.tsv' -type f | sort | xargs ${superMysqlImport} ${externalDb}
+	#	Load the data, deferring the indexes as for the routing database
+	python3 ${ScriptHome}/utility/bulkLoader.py ${quietOption} --defaults-extra-file ${mySuperCredFile} --profile ${newEditionFolder}/loadProfile.${externalDb}.json ${externalDb} ${mysqlReadableFolder}/*.tsv
 
 	#	Clean up
 	rm -r ${mysqlReadableFolder}
@@ -763,9 +768,14 @@ if [ -z "${skipSwitch}" ]; then
 	vecho "Switching to the new edition"
 	${ScriptHome}/live-deployment/switch-routing-edition.sh ${resolvedEdition}
 
-	# Run the tests, writing this summary
+	# Run the tests, writing this summary, and compare them with the previous edition
 	summaryFile=${websitesLogsFolder}/install_test_results_${resolvedEdition}.txt
+	testEdition=${resolvedEdition}
 	. /opt/cyclestreets-setup/utility/runTests.sh
+	if [ "${testsStatus}" != 0 ]; then
+		echo "#	$(date)	The tests of ${resolvedEdition} found regressions, see: ${summaryFile}"
+		exit 1
+	fi
 else
 	vecho "Switch to the new edition using: ${ScriptHome}/live-deployment/switch-routing-edition.sh ${resolvedEdition}"
 fi
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+#
+#	CycleStreets monitoring data for munin
+#
+# SYNOPSIS
+# 	munin-run apilinger [config]
+#
+# DESCRIPTION
+# 	If the optional argument config is supplied (as the plain string: config), this script
+#	returns a summary of the parameters provided by this munin plugin.
+#	Without that argument the values of those parameters are returned.
+#
+#	This is a multigraph plugin: one scan of the access log gives the call counts, linger and
+#	HTTP status breakdown for each of the API endpoints listed in utility/accessLogEndpointStats.py.
+#
+# Dependencies
+#	munin-node
+#
+# Create a link to this script from the munin configuration:
+# sudo ln -s /opt/cyclestreets-setup/live-deployment/munin-apilinger.py /etc/munin/plugins/apilinger
+#
+# Then restart munin node
+# sudo systemctl restart munin-node
+#
+# Example calls
+# sudo munin-run apilinger config
+# sudo munin-run apilinger
+#
+# Remove
+# sudo rm /etc/munin/plugins/apilinger
+
+import sys, os
+
+# Placeholders
+journeysLog = "%journeysLog"
+scriptHome = "%ScriptHome"
+
+# Make the utility available to the module search
+sys.path.append(scriptHome + '/utility/')
+from accessLogEndpointStats import accessLogEndpointStats, defaultEndpoints, statusClasses
+from muninCollector import askCollector
+
+def print_config():
+
+    # Calls per endpoint
+    print("multigraph cyclestreets_api_requests")
+    print("graph_title CycleStreets API calls")
+    # Category groups must be lower cased (not explicit in munin documentation) so that warning/critical indicators appear on overview page
+    print("graph_category cyclestreets")
+    print("graph_vlabel Calls per 5 mins")
+    print("graph_info Number of calls to each CycleStreets API endpoint according to the apache access log.")
+    print("graph_args -l 0")
+    for name, pattern in defaultEndpoints:
+        print("{}.label {}".format(name, name))
+
+    # Linger at the 90th percentile per endpoint
+    print("multigraph cyclestreets_api_linger")
+    print("graph_title CycleStreets API Linger")
+    print("graph_category cyclestreets")
+    print("graph_vlabel Milliseconds")
+    print("graph_info Linger at the 90th percentile for each CycleStreets API endpoint according to the apache access log.")
+    print("graph_args -l 0 --upper-limit 4000 --rigid")
+    for name, pattern in defaultEndpoints:
+        print("{}.label {}".format(name, name))
+
+    # Detail for each endpoint
+    for name, pattern in defaultEndpoints:
+        print("multigraph cyclestreets_api_linger.{}".format(name))
+        print("graph_title {} linger".format(name))
+        print("graph_category cyclestreets")
+        print("graph_vlabel Milliseconds")
+        print("graph_args -l 0")
+        print("mean.label Average ms")
+        print("mean.colour CCAAEE")
+        print("top90.label 90th percentile ms")
+        print("top90.colour 3366DD")
+        print("slowest.label Slowest ms")
+        print("slowest.colour EECCCC")
+
+        print("multigraph cyclestreets_api_requests.{}".format(name))
+        print("graph_title {} HTTP status".format(name))
+        print("graph_category cyclestreets")
+        print("graph_vlabel Calls per 5 mins")
+        print("graph_args -l 0")
+        for statusClass in statusClasses:
+            print("status{}.label {}".format(statusClass, statusClass))
+            print("status{}.draw AREASTACK".format(statusClass))
+
+def getData():
+
+	# Use the resident collector if it is running
+	values = askCollector('apilinger')
+	if values:
+		print(values, end='')
+		return
+
+	# Munin provides a writable folder for plugin state; when present the log is read incrementally so every call since the last poll is counted
+	stateFile = None
+	if os.environ.get('MUNIN_PLUGSTATE'):
+		stateFile = os.path.join(os.environ['MUNIN_PLUGSTATE'], 'apilinger.state')
+
+	# Read args supplied to script
+	aes = accessLogEndpointStats(journeysLog, stateFile)
+
+	# Get the stats, failing if the log is not in the expected format
+	if not aes.generateStatistics():
+		sys.exit(1)
+
+## Main
+
+# Parse arguments
+if len(sys.argv) > 1:
+    if sys.argv[1] == "config":
+        print_config()
+        sys.exit(0)
+else:
+	getData();
+
+# End of file
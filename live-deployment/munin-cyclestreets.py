@@ -25,6 +25,12 @@ import urllib.request, urllib.parse, urllib.error, json, sys
 # Placeholders
 apiV2Url = "%apiV2Url"
 apiKey = "%apiKey"
+scriptHome = "%ScriptHome"
+
+# Make the utility available to the module search
+sys.path.append(scriptHome + '/utility/')
+from muninCollector import askCollector
+from statusCache import fetchStatus
 
 def print_config():
 	print("graph_title CycleStreets usage")
@@ -42,10 +48,13 @@ def print_config():
 
 
 def getData():
-	# Needs server and api key as config
-	url = apiV2Url + "status?key=" + apiKey + "&fields=usage"
-	response = urllib.request.urlopen(url)
-	return json.loads(response.read())
+	# Use the status kept by the resident collector if it is running
+	status = askCollector('status')
+	if status:
+		return json.loads(status)
+
+	# Needs server and api key as config; the response is shared with the other plugins through a short-lived cache
+	return fetchStatus(apiV2Url, apiKey)
 
 ## Main
 
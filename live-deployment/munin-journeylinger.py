@@ -26,7 +26,7 @@
 # Remove
 # sudo rm /etc/munin/plugins/journeylinger
 
-import urllib.request, urllib.parse, urllib.error, json, sys
+import urllib.request, urllib.parse, urllib.error, json, sys, os
 
 # Placeholders
 journeysLog = "%journeysLog"
@@ -36,6 +36,7 @@ scriptHome = "%ScriptHome"
 # Make the utility available to the module search
 sys.path.append(scriptHome + '/utility/')
 from accessLogLingerStats import accessLogLingerStats	# Import module as the function name
+from muninCollector import askCollector
 
 def print_config():
     print("graph_title CycleStreets Journey Linger")
@@ -68,11 +69,27 @@ def print_config():
 
 def getData():
 
+	# Use the resident collector if it is running
+	values = askCollector('journeylinger')
+	if values:
+		print(values, end='')
+		return
+
+	# Munin provides a writable folder for plugin state; when present the log is read incrementally so every journey since the last poll is counted,
+	# and the sketch of the poll is kept there, so that it can be merged with those of other servers by lingerSketch.py
+	stateFile = None
+	sketchFile = None
+	if os.environ.get('MUNIN_PLUGSTATE'):
+		stateFile = os.path.join(os.environ['MUNIN_PLUGSTATE'], 'journeylinger.state')
+		sketchFile = os.path.join(os.environ['MUNIN_PLUGSTATE'], 'journeylinger.sketch')
+
 	# Read args supplied to script
-	alls = accessLogLingerStats(journeysLog)
+	alls = accessLogLingerStats(journeysLog, stateFile)
+	alls.sketchFile = sketchFile
 
-	# Get the stats
-	alls.generateStatistics()
+	# Get the stats, failing if the log is not in the expected format
+	if not alls.generateStatistics():
+		sys.exit(1)
 
 ## Main
 
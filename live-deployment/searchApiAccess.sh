@@ -5,15 +5,19 @@ usage()
 	cat << EOF
 SYNOPSIS
 	$0 -h -s searchString
+	$0 -b -s
 
 OPTIONS
+	-b Update the index of unique_ids rather than search; typically run every minute from cron, as the cyclestreets user:
+	   * * * * *  cyclestreets  /opt/cyclestreets-setup/live-deployment/searchApiAccess.sh -b; /opt/cyclestreets-setup/live-deployment/searchApiAccess.sh -b -s
 	-h Show this message
 	-s If set searches log defined by the secure, i.e. SSL virtual host.
 
 DESCRIPTION
 	Searches backwards through access log defined by the Apache cyclestreets API virtual host.
-    The search looks for the exact string match, with a timeout of one second.
+	The search looks for the exact string match, reading the log backwards in large blocks and continuing into the rotated logs, with a timeout of ten seconds.
 	The searchString is typically a unique_id which is an option used by Apache to mark requests in an access log with a unique reference.
+	When the index is kept up to date using the -b option, indexed unique_ids are found immediately.
 
 EOF
 }
@@ -21,10 +25,14 @@ EOF
 # Used to identify the secure log variant with a prefix, if needed
 secureLog=
 
+# Whether to build the index rather than search
+buildIndex=
+
 # http://wiki.bash-hackers.org/howto/getopts_tutorial
 # See install-routing-data for best example of using this
-while getopts "hs" option ; do
+while getopts "bhs" option ; do
 	case ${option} in
+		b) buildIndex=1 ;;
 		h) usage; exit ;;
 		s)
 		# Set read from secure log
@@ -46,7 +54,7 @@ if [ "$(id -u)" = "0" ]; then
 fi
 
 # Check required argument
-if [ $# -ne 1 ]; then
+if [ -z "${buildIndex}" -a $# -ne 1 ]; then
 	# Report and abandon
 	echo -e "#\t	There must be exactly one argument." 1>&2
 	exit 1
@@ -89,11 +97,22 @@ if [ "${apiHostname}" = "api.cyclestreets.net" ]; then
 	mainName=api
 fi
 
+# Log and the base name of its unique_id index files
+accessLog=${websitesLogsFolder}/${mainName}${secureLog}-access.log
+indexBase=${websitesLogsFolder}/.index/${mainName}${secureLog}-access
+
+# Update the index
+if [ -n "${buildIndex}" ]; then
+	mkdir -p $(dirname ${indexBase})
+	python3 ${SCRIPTDIRECTORY}/../utility/searchAccessLog.py --build-index ${indexBase} ${accessLog}
+	exit
+fi
+
 # Debug
-#echo "(timeout 1 tac ${websitesLogsFolder}/${mainName}${secureLog}-access.log || : ) | grep -F -m1 ${searchString}"
+#echo "timeout 10 python3 ${SCRIPTDIRECTORY}/../utility/searchAccessLog.py --index ${indexBase} ${accessLog} ${searchString}"
 
 # Search
-# Limit search time to one second, while searching backwards (using tac) through the access log, return the first match with the unique id
-(timeout 1 tac ${websitesLogsFolder}/${mainName}${secureLog}-access.log || : ) | grep -F -m1 ${searchString}
+# Limit search time to ten seconds, while searching backwards through the access log and its rotations, return the first match with the unique id
+timeout 10 python3 ${SCRIPTDIRECTORY}/../utility/searchAccessLog.py --index ${indexBase} ${accessLog} ${searchString} || :
 
 # End of file
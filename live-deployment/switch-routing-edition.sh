@@ -113,6 +113,12 @@ if [ ! -d ${websitesContentFolder}/data/routing -o ! -d $websitesBackupsFolder ]
 	exit 1
 fi
 
+# The warm-up needs the routing service method that plans a journey
+if [ -n "${routingWarmup}" -a -z "${routingWarmupMethod}" ]; then
+	echo "#	The routingWarmupMethod setting is required when routingWarmup is enabled"
+	exit 1
+fi
+
 # Useful binding
 # The defaults-extra-file is a positional argument which must come first.
 superMysql="mysql --defaults-extra-file=${mySuperCredFile} -hlocalhost"
@@ -301,8 +307,9 @@ fi
 
 ## Configure the routing engine to use the new edition
 
-# Remove any old JSON configuration
+# Remove any old JSON configuration, noting it in case the switch is abandoned
 jsonConfig=${websitesContentFolder}/routingengine/.config.${editionPort}.json
+oldJsonRoutingConfig=$(readlink -f $jsonConfig || true)
 rm -f $jsonConfig
 
 # Configure the routing engine to use the new edition
@@ -321,29 +328,39 @@ rm -f ${websitesContentFolder}/data/tempgenerated/*.ridingSurfaceCache.php
 rm -f ${websitesContentFolder}/data/tempgenerated/*.routingFactorCache.php
 
 # Cycle routing restart command (should match passwordless sudo entry)
-routingServiceRestart="/bin/systemctl restart cyclestreets@${editionPort}"
+routingServiceRestart="sudo /bin/systemctl restart cyclestreets@${editionPort}"
 
-# Restart the routing service
-sudo ${routingServiceRestart}
+# With a pool of routing workers behind a dispatcher, restart them one at a time
+if [ -n "${routingWorkers}" ]; then
+    routingServiceRestart="python3 ${ScriptHome}/utility/routingPool.py --workers ${routingWorkers} --content-folder ${websitesContentFolder} --logs-folder ${websitesLogsFolder} restart ${editionPort}"
+fi
 
-# Check the local routing service is currently serving (if it is not it will generate an error forcing this script to stop)
-localRoutingStatus=$(cat ${websitesLogsFolder}/pythonAstarPort${editionPort}_status.log)
+# Wait until the restarted routing service is serving
+waitUntilServing()
+{
+    # Check the local routing service is currently serving (if it is not it will generate an error forcing this script to stop)
+    localRoutingStatus=$(cat ${websitesLogsFolder}/pythonAstarPort${editionPort}_status.log)
 
-echo "#	Initial status: ${localRoutingStatus}"
+    echo "#	Initial status: ${localRoutingStatus}"
+
+    # Wait until it has restarted
+    sleeptime=1
+    timewaited=0
+    # !! This can loop forever - perhaps because in some situations (e.g a small test dataset) the start has been very quick.
+    while [[ ! "$localRoutingStatus" =~ serving ]]; do
+	sleep $sleeptime
+	localRoutingStatus=$(cat ${websitesLogsFolder}/pythonAstarPort${editionPort}_status.log)
+	(( timewaited += sleeptime ))		# Increment https://tldp.org/LDP/abs/html/arithexp.html
+	echo "#	Status: ${localRoutingStatus}	Seconds waited: ${timewaited}"
+	if [ $sleeptime -lt 60 ]; then		# Keep less than 60
+	    (( sleeptime += 1 ))			# Increment
+	fi
+    done
+}
 
-# Wait until it has restarted
-sleeptime=1
-timewaited=0
-# !! This can loop forever - perhaps because in some situations (e.g a small test dataset) the start has been very quick.
-while [[ ! "$localRoutingStatus" =~ serving ]]; do
-    sleep $sleeptime
-    localRoutingStatus=$(cat ${websitesLogsFolder}/pythonAstarPort${editionPort}_status.log)
-    (( timewaited += sleeptime ))		# Increment https://tldp.org/LDP/abs/html/arithexp.html
-    echo "#	Status: ${localRoutingStatus}	Seconds waited: ${timewaited}"
-    if [ $sleeptime -lt 60 ]; then		# Keep less than 60
-	(( sleeptime += 1 ))			# Increment
-    fi
-done
+# Restart the routing service
+${routingServiceRestart}
+waitUntilServing
 
 # Get the locally running service
 locallyRunningEdition=$(curl -s -X POST -d "${getRoutingEditionXML}" ${localRoutingUrl} | xpath -q -e '/methodResponse/params/param/value/string/text()')
@@ -354,6 +371,30 @@ if [ "${locallyRunningEdition}" != "${newEdition}" ]; then
 	exit 1
 fi
 
+# Warm the new edition with recent journeys, and check it is not slower than the edition it replaces, before traffic moves over
+if [ -n "${routingWarmup}" ]; then
+    echo "#	$(date)	Warming the new edition with recent journeys"
+    if ! python3 ${ScriptHome}/utility/routingWarmup.py --baseline ${websitesLogsFolder}/routingWarmup${editionPort}.json --edition ${newEdition} ${currentRoutingEdition:+--previous-edition ${currentRoutingEdition}} --method ${routingWarmupMethod} ${websitesLogsFolder}/${journeysLog} ${localRoutingUrl}; then
+	echo "#	The new edition ${newEdition} is too slow or failing, so the switch has been abandoned."
+
+	if [ "${multipleEditions}" = 1 ]; then
+	    echo "#	Routing continues from the fallback server at: ${fallbackRoutingUrl}"
+	elif [ -n "${oldJsonRoutingConfig}" -a -r "${oldJsonRoutingConfig}" ]; then
+
+	    # Restore the previous edition, which the website is still set to use, and re-open the journey planner
+	    rm -f $jsonConfig
+	    ln -s ${oldJsonRoutingConfig} $jsonConfig
+	    ${routingServiceRestart}
+	    waitUntilServing
+	    ${superMysql} cyclestreets -e "call openJourneyPlanner();";
+	    echo "#	The previous routing configuration has been restored: ${oldJsonRoutingConfig}"
+	else
+	    echo "#	There is no previous routing configuration to restore, so the journey planner remains closed."
+	fi
+	exit 1
+    fi
+fi
+
 if [ "${multipleEditions}" = 1 ]; then
 
     # Use newly started local routing service
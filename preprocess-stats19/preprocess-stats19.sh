@@ -1,7 +1,7 @@
 #!/usr/bin/env bash
 
 
-# This script takes about 5-10 minutes to run.
+# This script takes about 5-10 minutes to run, mostly downloading.
 
 
 # To compare CSV headers, use e.g.
@@ -30,60 +30,30 @@ rm -f collisions.zip
 # ------------------------------------------------------------------------------------------------------------------------
 
 
+# Location of the preprocessor
+scriptDirectory=$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)
+
 # Create a fresh downloads directory, to deal with any updates
 today=`date +%Y-%m-%d`
 dataDirectory=rawdata-asof-$today
 mkdir -p $dataDirectory
 cd $dataDirectory
 
-# 1979 - 2023 (released 27th September 2024)
-wget -O collisions.csv https://data.dft.gov.uk/road-accidents-safety-data/dft-road-casualty-statistics-collision-1979-latest-published-year.csv
-wget -O casualties.csv https://data.dft.gov.uk/road-accidents-safety-data/dft-road-casualty-statistics-casualty-1979-latest-published-year.csv
-wget -O vehicles.csv https://data.dft.gov.uk/road-accidents-safety-data/dft-road-casualty-statistics-vehicle-1979-latest-published-year.csv
-
-# Codings - obtain, convert to CSV, and amend headings
+# Codings - obtain and convert to CSV; its title line is replaced by a header as it is zipped
 wget -O codings.xlsx https://data.dft.gov.uk/road-accidents-safety-data/dft-road-casualty-statistics-road-safety-open-dataset-data-guide-2024.xlsx
 ssconvert codings.xlsx codings.csv
 rm codings.xlsx
-sed -i.bak 1d codings.csv
-sed -i.bak '1s/^/sheet,field,code,label,note\n/' codings.csv
-rm codings.csv.bak
-
-
-# ------------------------------------------------------------------------------------------------------------------------
-# FIX TECHNICAL FORMAT ISSUES
-# ------------------------------------------------------------------------------------------------------------------------
-
-# Remove BOM at start of files
-perl -e 's/^\xef\xbb\xbf//;' *.csv
-
-# Convert \r\n to \n
-dos2unix *.csv
-
-
-
-# ------------------------------------------------------------------------------------------------------------------------
-# COMBINE FILES and SHOW COUNTS
-# ------------------------------------------------------------------------------------------------------------------------
-
-# Show counts of original files
-wc -l collisions.csv
-echo -e "\n"
-wc -l casualties.csv
-echo -e "\n"
-wc -l vehicles.csv
-echo -e "\n"
-wc -l codings.csv
-echo -e "\n"
 
 
 
 # ------------------------------------------------------------------------------------------------------------------------
-# ZIP AS SINGLE DISTRIBUTION
+# STREAM, CHECK AND ZIP AS SINGLE DISTRIBUTION
 # ------------------------------------------------------------------------------------------------------------------------
 
-# Zip files into a single distribution
-zip collisions.zip collisions.csv casualties.csv vehicles.csv codings.csv
+# 1979 - latest published year, streamed straight from the DfT into the zip, removing the BOM and converting \r\n to \n,
+# and checking the joins between the tables; the counts of each are shown
+# Add --parquet . to also write typed columnar copies of the tables
+python3 "${scriptDirectory}/preprocessStats19.py" codings.csv collisions.zip
 
 echo "Please now SFTP the file to the server, e.g. to https://www.cyclestreets.net/collisions.zip temporarily, then use that URL in the import UI. That takes around 30-40 minutes to run."
 
@@ -93,5 +63,5 @@ echo "Please now SFTP the file to the server, e.g. to https://www.cyclestreets.n
 # CLEAN UP
 # ------------------------------------------------------------------------------------------------------------------------
 
-rm -f collisions.csv casualties.csv vehicles.csv codings.csv
+rm -f codings.csv
 
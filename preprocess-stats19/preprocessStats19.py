@@ -0,0 +1,369 @@
+# Streaming preprocessor for the DfT STATS19 road casualty data.
+#
+# Each of the collisions, vehicles and casualties CSVs is read once, straight from the DfT download in large blocks,
+# with the byte order mark and CRLF line endings removed on the fly, and written into collisions.zip as clean CSV for
+# the import UI. Nothing is held but the current batch of rows, so memory stays constant however many years are included.
+#
+# The joins are validated as the files pass: the keys of the collisions, and of the vehicles, are added to fixed size
+# filters of hashed keys, against which each vehicle's collision and each casualty's collision and vehicle are checked.
+# The filters can give a false match, about once in a thousand for the full dataset, but never miss one, so every
+# orphan reported is real.
+#
+# Optionally, typed columnar copies are written as Parquet, one file per table, in row groups of one batch. Fields coded
+# in the data guide (see codings.csv) are stored as integer codes with their labels alongside as a dictionary column,
+# decoded a whole column of a batch at a time, and other columns take the type of their values in the first batch; those
+# with no values in the first batch are stored as text, which any later value fits.
+#
+# The downloads time out if the server stops responding, and a download that fails part way is resumed from the byte
+# reached, a few times, so one dropped connection does not restart the whole run.
+#
+# Synopsis
+#	preprocessStats19.py [--parquet folder] [--batch-rows n] codings.csv collisions.zip
+#
+# Result
+#	Counts of the rows of each table, values that did not fit their column type, and orphaned rows.
+#
+# Example
+# user@machine:$
+# python3 preprocessStats19.py --parquet . codings.csv collisions.zip
+
+# Dependencies
+import sys, io, os, csv, time, hashlib, zipfile, itertools, http.client, urllib.request, argparse
+
+# Downloads, as (table, URL), in the order the joins are checked
+sources = [
+    ('collisions', 'https://data.dft.gov.uk/road-accidents-safety-data/dft-road-casualty-statistics-collision-1979-latest-published-year.csv'),
+    ('vehicles', 'https://data.dft.gov.uk/road-accidents-safety-data/dft-road-casualty-statistics-vehicle-1979-latest-published-year.csv'),
+    ('casualties', 'https://data.dft.gov.uk/road-accidents-safety-data/dft-road-casualty-statistics-casualty-1979-latest-published-year.csv'),
+]
+
+# Seconds to wait for the server, and the attempts made at each connection and each read of a download
+downloadTimeout = 60
+downloadAttempts = 5
+
+# Header given to codings.csv, whose first line from the data guide is a title
+codingsHeader = ['sheet', 'field', 'code', 'label', 'note']
+
+# Key of a collision, as named in recent and earlier releases
+collisionKeys = ('collision_index', 'accident_index')
+
+class keyFilter ():
+    """
+    Fixed size filter of hashed keys, which may give a false match but never misses a key that was added.
+    """
+
+    def __init__(self, bits = 2 ** 29, hashes = 4):
+        self.bits = bits
+        self.hashes = hashes
+        self.array = bytearray(bits // 8)
+
+
+    def positions (self, key):
+        """
+        Returns the bit positions of a key, by double hashing.
+        """
+        digest = hashlib.blake2b(key.encode('utf8'), digest_size = 16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + index * second) % self.bits for index in range(self.hashes)]
+
+
+    def add (self, key):
+        for position in self.positions(key):
+            self.array[position >> 3] |= 1 << (position & 7)
+
+
+    def __contains__ (self, key):
+        return all(self.array[position >> 3] & (1 << (position & 7)) for position in self.positions(key))
+
+
+def readCodings (path):
+    """
+    Returns the rows of the codings, with the title line replaced by the header, and the labels of each coded field.
+    """
+    with open(path, newline = '', encoding = 'utf-8-sig') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        rows = [row for row in reader if row]
+
+    # Only fields whose codes are all integers are coded; those with text codes, such as ONS district codes, stay text
+    codes = {}
+    for row in rows:
+        sheet, field, code, label = (row + [''] * 4)[:4]
+        codes.setdefault(field, {})[code] = label
+    labels = {}
+    for field, fieldCodes in codes.items():
+        try:
+            labels[field] = {int(code): label for code, label in fieldCodes.items()}
+        except ValueError:
+            pass
+    return rows, labels
+
+
+class resumableDownload (io.RawIOBase):
+    """
+    Download read as a raw stream, which reconnects and resumes from the byte reached when a read fails.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.offset = 0
+        self.response = self.connect()
+
+
+    def connect (self):
+        """
+        Opens the download from the byte reached, retrying with increasing waits.
+        """
+        headers = {'Range': 'bytes={:d}-'.format(self.offset)} if self.offset else {}
+        for attempt in range(1, downloadAttempts + 1):
+            try:
+                response = urllib.request.urlopen(urllib.request.Request(self.url, headers = headers), timeout = downloadTimeout)
+                break
+            except OSError:
+                if attempt == downloadAttempts:
+                    raise
+                time.sleep(10 * attempt)
+
+        # A server that ignores the range would start again from the beginning
+        if self.offset and response.status != 206:
+            response.close()
+            raise RuntimeError('The download of {} failed at byte {:d} and the server cannot resume it'.format(self.url, self.offset))
+        return response
+
+
+    def readable (self):
+        return True
+
+
+    def readinto (self, buffer):
+        for attempt in range(1, downloadAttempts + 1):
+            try:
+                count = self.response.readinto(buffer)
+
+                # The connection closing before the length given is an end of data only to readinto
+                if not count and len(buffer) and self.response.length:
+                    raise http.client.IncompleteRead(b'', self.response.length)
+                break
+            except (OSError, http.client.HTTPException):
+                self.response.close()
+                if attempt == downloadAttempts:
+                    raise
+                time.sleep(10 * attempt)
+                self.response = self.connect()
+        self.offset += count
+        return count
+
+
+    def close (self):
+        self.response.close()
+        super().close()
+
+
+def openDownload (url):
+    """
+    Opens a download as a text stream read in large blocks, without its byte order mark; CRLF is handled by the csv reader.
+    """
+    return io.TextIOWrapper(io.BufferedReader(resumableDownload(url), buffer_size = 8 * 1024 * 1024), encoding = 'utf-8-sig', newline = '')
+
+
+class stats19Preprocessor ():
+    """
+    Streams the STATS19 tables into the zip for the import, checking their joins and optionally writing typed columns.
+    """
+
+    def __init__(self, codingsFile, zipFile):
+
+        # Inputs and outputs
+        self.codingsFile = codingsFile
+        self.zipFile = zipFile
+        self.parquetFolder = None
+        self.batchRows = 100000
+
+        # Labels of the coded fields
+        self.labels = {}
+
+        # Keys seen
+        self.collisions = keyFilter()
+        self.vehicles = keyFilter()
+
+        # Counts per table
+        self.rows = {}
+        self.unfitting = {}
+        self.orphans = {}
+
+
+    def columnTypes (self, header, batch):
+        """
+        Returns the type of each column: code for coded fields, otherwise int, float or str according to the values in the batch,
+        or str when the batch has none.
+        """
+        types = []
+        for index, name in enumerate(header):
+            if name in self.labels:
+                types.append('code')
+                continue
+            values = [row[index] for row in batch if index < len(row) and row[index] not in ('', 'NULL')]
+            if not values:
+                types.append('str')
+                continue
+            for candidate in (int, float):
+                try:
+                    for value in values:
+                        candidate(value)
+                except ValueError:
+                    continue
+                types.append(candidate.__name__)
+                break
+            else:
+                types.append('str')
+        return types
+
+
+    def columns (self, table, header, types, batch):
+        """
+        Returns a batch of rows as typed columns for Parquet, with the labels of coded fields decoded alongside.
+        """
+        import pyarrow
+        converters = {'code': int, 'int': int, 'float': float, 'str': str}
+        pyarrowTypes = {'code': pyarrow.int32(), 'int': pyarrow.int64(), 'float': pyarrow.float64(), 'str': pyarrow.string()}
+
+        columns = {}
+        for index, (name, kind) in enumerate(zip(header, types)):
+            convert = converters[kind]
+            values = []
+            for row in batch:
+                value = row[index] if index < len(row) else ''
+                if value in ('', 'NULL'):
+                    values.append(None)
+                    continue
+                try:
+                    values.append(convert(value))
+                except ValueError:
+                    values.append(None)
+                    self.unfitting[table] = self.unfitting.get(table, 0) + 1
+            columns[name] = pyarrow.array(values, type = pyarrowTypes[kind])
+
+            # Decode the whole column at once, as a dictionary of the few labels
+            if kind == 'code':
+                labels = self.labels[name]
+                columns[name + '_label'] = pyarrow.array([labels.get(code) for code in values], type = pyarrow.string()).dictionary_encode()
+        return pyarrow.table(columns)
+
+
+    def checkJoins (self, table, header, batch):
+        """
+        Records the keys of a batch, and counts the rows whose collision or vehicle is missing.
+        """
+        collisionIndex = next(header.index(name) for name in collisionKeys if name in header)
+        vehicleIndex = header.index('vehicle_reference') if 'vehicle_reference' in header else None
+        orphans = 0
+        for row in batch:
+            collision = row[collisionIndex]
+            if table == 'collisions':
+                self.collisions.add(collision)
+                continue
+            if collision not in self.collisions:
+                orphans += 1
+                continue
+            vehicle = collision + '\t' + row[vehicleIndex] if vehicleIndex is not None else None
+            if table == 'vehicles':
+                self.vehicles.add(vehicle)
+            elif vehicle is not None and row[vehicleIndex] not in ('', '0', '-1') and vehicle not in self.vehicles:
+                orphans += 1
+        self.orphans[table] = self.orphans.get(table, 0) + orphans
+
+
+    def processTable (self, table, url, archive):
+        """
+        Streams one table from its download into the zip, in batches.
+        """
+        parquet = None
+        with openDownload(url) as source, archive.open(table + '.csv', 'w', force_zip64 = True) as member:
+            output = io.TextIOWrapper(member, encoding = 'utf-8', newline = '')
+            writer = csv.writer(output, lineterminator = '\n')
+            reader = csv.reader(source)
+            header = next(reader)
+            writer.writerow(header)
+            types = None
+
+            self.rows[table] = 0
+            while True:
+                batch = list(itertools.islice(reader, self.batchRows))
+                if not batch:
+                    break
+                writer.writerows(batch)
+                self.rows[table] += len(batch)
+                self.checkJoins(table, header, batch)
+
+                if self.parquetFolder:
+                    import pyarrow.parquet
+                    if types is None:
+                        types = self.columnTypes(header, batch)
+                    columns = self.columns(table, header, types, batch)
+                    if parquet is None:
+                        parquet = pyarrow.parquet.ParquetWriter(os.path.join(self.parquetFolder, table + '.parquet'), columns.schema)
+                    parquet.write_table(columns)
+
+            output.flush()
+            output.detach()
+
+        if parquet is not None:
+            parquet.close()
+
+
+    def process (self):
+        """
+        Writes the zip of the tables and codings, and the Parquet files if wanted.
+        """
+        codings, self.labels = readCodings(self.codingsFile)
+        temporary = self.zipFile + '.tmp'
+        with zipfile.ZipFile(temporary, 'w', zipfile.ZIP_DEFLATED, allowZip64 = True) as archive:
+            for table, url in sources:
+                self.processTable(table, url, archive)
+
+            # Codings, with their header
+            output = io.StringIO()
+            writer = csv.writer(output, lineterminator = '\n')
+            writer.writerow(codingsHeader)
+            writer.writerows(codings)
+            archive.writestr('codings.csv', output.getvalue())
+            self.rows['codings'] = len(codings)
+        os.replace(temporary, self.zipFile)
+
+
+    def report (self):
+        """
+        Prints the counts of each table.
+        """
+        for table, rows in self.rows.items():
+            print('{}\t{:,d} rows\t{:,d} values not fitting their column\t{:,d} orphans'.format(table, rows, self.unfitting.get(table, 0), self.orphans.get(table, 0)))
+
+
+# Main
+if __name__ == '__main__':
+
+    # Read args supplied to script
+    parser = argparse.ArgumentParser(description = 'Streams the STATS19 data into a zip for import, checking the joins.')
+    parser.add_argument('--parquet', dest = 'parquetFolder', help = 'Also write typed columnar copies of the tables as Parquet into this folder')
+    parser.add_argument('--batch-rows', dest = 'batchRows', type = int, default = 100000, help = 'Rows processed at a time')
+    parser.add_argument('codingsFile')
+    parser.add_argument('zipFile')
+    args = parser.parse_args()
+
+    # Check optional dependencies before the long run rather than after it
+    try:
+        if args.parquetFolder:
+            import pyarrow
+    except ImportError as e:
+        parser.error('{} is needed for that output; install it with: sudo apt install python3-{}'.format(e.name, e.name))
+
+    preprocessor = stats19Preprocessor(args.codingsFile, args.zipFile)
+    preprocessor.parquetFolder = args.parquetFolder
+    preprocessor.batchRows = args.batchRows
+
+    preprocessor.process()
+    preprocessor.report()
+
+
+# End of file
@@ -9,18 +9,36 @@ class doCheck
 	# Class properties
 	private $debugging	= false;
 	private $enableSms	= true;
-	private $serverUrl	= '';
-	private $apiV2Url	= '';
 	private $serverUrlMain	= 'http://www.cyclestreets.net';
 	private $apiV2UrlMain	= 'https://api.cyclestreets.net/v2';
 	private $apiVersions	= array (
 		'http://%s.cyclestreets.net',
 		'https://%s.cyclestreets.net/v2'
 	);
-	private $retryInterval	= 20;	// Time to wait before retrying a test
-	private $additionalParameter = '';	// Extra parameter used in journey testing on some services
+	private $retryInterval	= 20;	// Time to wait before retrying the tests that failed
 	private $errorLogFile	= '/websites/www/logs/tests.log';
 
+	# Latency monitoring: the latest probes of each test on each server are compared with the time series of earlier probes
+	private $latencyLogFile		= '/websites/www/logs/apiLatency.tsv';	// Time series, as lines of: unixtime, probe, seconds, 1 or 0 for success
+	private $latencyWindowHours	= 24;	// Period of the time series kept, and compared with
+	private $latencyRecentProbes	= 3;	// Number of latest probes whose median is compared, so that a single slow response does not alert
+	private $latencyPercentile	= 95;	// Percentile of the earlier probes in the window used as the baseline
+	private $latencyFactor		= 1.5;	// Ratio to the baseline above which latency is a problem
+	private $latencyMinimumSeconds	= 2;	// Latency below which there is never a problem
+	private $latencyMinimumSamples	= 20;	// Number of earlier probes needed before latency is compared
+
+	# URL of each test, in which {serverUrl}, {apiV2Url}, {key} and {additionalParameter} are substituted (the split is to avoid bots traversing a repository)
+	private $testUrls = array (
+		'test_journey_new'		=> '{serverUrl}/api/journey.json?key={key}&archive=none&plan=quietest&itinerarypoints=-0.14009,51.50202,Buckingham+Palace|-0.12920,51.50435,Horse+Guards+Parade|-0.12939,51.49950,Westminster+Abbey{additionalParameter}',
+		'xxxtedddst_journey_existing'	=> '{serverUrl}/api/journey.json?key={key}&plan=fastest&itinerary=345529',
+		'test_nearestpoint'		=> '{apiV2Url}/nearestpoint?key={key}&lonlat=0.117950,52.205302',
+		'test_geocoder'			=> '{serverUrl}/api/geocoder.json?key={key}&w=0.113937&s=52.201937&e=0.121963&n=52.208669&zoom=16&street=thoday%20street',
+		'test_photo'			=> '{apiV2Url}/photomap.location?key={key}&id=80&fields=id,latitude,longitude,caption&format=flat',
+	);
+
+	# Tests whose response is checked even with an HTTP error status, equivalent to wget's --content-on-error when dealing with 503s
+	private $ignoreErrors = array ('test_journey_new');
+
 	# Constructor
 	public function __construct ()
 	{
@@ -51,8 +69,11 @@ class doCheck
 		}
 		$this->smsNumbers		= $smsNumbers;
 		if (isSet ($retryInterval)) {$this->retryInterval = $retryInterval;}
+		if (isSet ($latencyLogFile)) {$this->latencyLogFile = $latencyLogFile;}
+		if (isSet ($latencyFactor)) {$this->latencyFactor = $latencyFactor;}
+		if (isSet ($latencyMinimumSeconds)) {$this->latencyMinimumSeconds = $latencyMinimumSeconds;}
 
-		# Set the timeout for URL requests
+		# Set the timeout for URL requests other than the probes, which set their own
 		ini_set ('default_socket_timeout', $this->timeoutSeconds);
 		
 		# Set the user-agent string
@@ -75,114 +96,265 @@ class doCheck
 			}
 		}
 
-		// Apply the test to each of the apiKeys
+		// Compile a probe of each test for each of the apiKeys, and each of their URLs
 		// $testSpec is false to skip all tests, true to apply all test, or an array of only those tests to apply
-		// !! Note the tests abandon at the first failure so later tests are not tried - risking masking of other problems.
+		$probes = array ();
 		foreach ($testApiKeys as $testApiKey => $testSpec) {
 
 			// Skip tests for this apiKey if required
 			if (!$testSpec) {continue;}
 
-			// Bind
-			$this->testApiKey = $testApiKey;
-
-			# Use the standard API URLs by default for this key
-			$this->serverUrl	= $this->serverUrlMain;
-			$this->apiV2Url		= $this->apiV2UrlMain;
+			# Use the standard API URLs by default for this key, with no additional parameter
+			$urls = array (array ($this->serverUrlMain, $this->apiV2UrlMain));
+			$additionalParameter = '';
 
-			# Reset this each time
-			$this->additionalParameter = '';
-			
-			# When key-specific API URLs are defined for this key
+			# When key-specific API URLs are defined for this key, test with each URL (for both V1 and V2)
 			if (isSet ($keySpecificApiUrls[$testApiKey])) {
+				$urls = array ();
+				foreach ($keySpecificApiUrls[$testApiKey] as $url) {
+					$urls[] = array ($url, $url);
+				}
 
 				// Set any additional parameter for this key
 				if (isSet ($keySpecificAdditonalParameter[$testApiKey])) {
-					$this->additionalParameter = $keySpecificAdditonalParameter[$testApiKey];
+					$additionalParameter = '&' . $keySpecificAdditonalParameter[$testApiKey];
 				}
+			}
 
-				// Test with each URL (for both V1 and V2)
-				foreach ($keySpecificApiUrls[$testApiKey] as $url) {
+			// Add the probes
+			foreach ($urls as $url) {
+				foreach ($tests as $test) {
 
-					$this->serverUrl	= $url;
-					$this->apiV2Url		= $url;
+					// Skip tests not specified for this api key
+					if (is_array ($testSpec) && !in_array ($test, $testSpec)) {continue;}
 
-					// Run the tests
-					if (!$this->runtests ($tests, $testSpec)) {return;}
+					$probes[] = array (
+						'test'	=> $test,
+						'key'	=> $testApiKey,
+						'url'	=> str_replace (array ('{serverUrl}', '{apiV2Url}', '{key}', '{additionalParameter}'), array ($url[0], $url[1], $testApiKey, $additionalParameter), $this->testUrls[$test]),
+					);
 				}
-				// Done this apiKey
-				continue;
 			}
-
-			// Run the tests
-			if (!$this->runtests ($tests, $testSpec)) {return;}
 		}
 
+		// Run the probes, and report any failures and slow responses together
+		$failures = $this->runProbes ($probes, $breaches);
+		$this->reportProblems ($failures, $breaches);
+
 		// No return value
 	}
 
 	/**
-	 * Run each test; if it fails, wait a short while then try again before reporting a problem
-	 * @return bool
+	 * Run every probe at once; those that fail are retried together after a short while before reporting a problem
+	 * All probes are run, so one failure does not mask others, and a slow server does not delay the others.
+	 * @return array Failures, indexed by probe
+	 */
+	private function runProbes ($probes, &$breaches)
+	{
+		// Probe, and check the responses
+		$probes = $this->probe ($probes);
+		$failures = $this->check ($probes);
+
+		// Retry
+		if ($failures && $this->retryInterval) {
+
+			// Tests failed: wait before retrying
+			sleep ($this->retryInterval);
+
+			// Retry those that failed
+			$retried = $this->probe (array_intersect_key ($probes, $failures));
+			$probes = array_replace ($probes, $retried);
+			$failures = $this->check ($retried);
+		}
+
+		// Record the latencies and check them against the time series
+		$breaches = $this->checkLatencies ($probes, $failures);
+
+		// Return the failures
+		return $failures;
+	}
+
+
+	/**
+	 * Fetch the URLs of the probes concurrently, each with its own timeout
+	 * @return array The probes, each with its response, as json, or false if there was no response, and its latency in seconds
 	 */
-	private function runtests ($tests, $testSpec)
+	private function probe ($probes)
 	{
-		foreach ($tests as $test) {
+		# Add a request for each probe
+		$multi = curl_multi_init ();
+		$handles = array ();
+		foreach ($probes as $index => $probe) {
+			$handle = curl_init ($probe['url']);
+			curl_setopt_array ($handle, array (
+				CURLOPT_RETURNTRANSFER	=> true,
+				CURLOPT_FOLLOWLOCATION	=> true,
+				CURLOPT_CONNECTTIMEOUT	=> $this->timeoutSeconds,
+				CURLOPT_TIMEOUT		=> $this->timeoutSeconds,
+				CURLOPT_USERAGENT	=> 'CycleStreets API monitor',
+			));
+			curl_multi_add_handle ($multi, $handle);
+			$handles[$index] = $handle;
+		}
 
-			// Skip tests not specified for this api key
-			if (is_array ($testSpec) && !in_array ($test, $testSpec)) {continue;}
+		# Run them until all have finished or timed out
+		do {
+			$status = curl_multi_exec ($multi, $running);
+			if ($running) {curl_multi_select ($multi, 1);}
+		} while ($running && $status == CURLM_OK);
+
+		# Collect the responses; as with file_get_contents, an HTTP error status gives no response unless the test checks its content
+		foreach ($handles as $index => $handle) {
+			$body = curl_multi_getcontent ($handle);
+			$httpStatus = curl_getinfo ($handle, CURLINFO_HTTP_CODE);
+			$noResponse = (curl_errno ($handle) || !$body || ($httpStatus >= 400 && !in_array ($probes[$index]['test'], $this->ignoreErrors)));
+			$probes[$index]['json'] = ($noResponse ? false : $body);
+			$probes[$index]['seconds'] = curl_getinfo ($handle, CURLINFO_TOTAL_TIME);
+			curl_multi_remove_handle ($multi, $handle);
+			curl_close ($handle);
+		}
+		curl_multi_close ($multi);
+
+		# Return the probes
+		return $probes;
+	}
+
+
+	/**
+	 * Check the responses of the probes
+	 * @return array Failures, indexed by probe, as arrays of test, errorMessage and result
+	 */
+	private function check ($probes)
+	{
+		$failures = array ();
+		foreach ($probes as $index => $probe) {
 
 			// Reset the test result
+			$errorMessage = false;
 			$result = false;
 
 			// Run the test
-			if ($this->{$test} ($errorMessage, $result)) {continue;}
+			if ($this->{$probe['test']} ($probe['json'], $probe['url'], $errorMessage, $result)) {continue;}
 
-			// Retry
-			if ($this->retryInterval) {
+			// Record the failure
+			$failures[$index] = array ('test' => $probe['test'], 'errorMessage' => $errorMessage, 'result' => $result);
+		}
 
-				// Test failed: wait before retrying
-				sleep ($this->retryInterval);
+		// Return the failures
+		return $failures;
+	}
 
-				// Reset the test result
-				$result = false;
 
-				// Retry
-				if ($this->{$test} ($errorMessage, $result)) {continue;}
+	/**
+	 * Add the latencies of the probes to the time series, and compare the latest probes of each with those earlier in the window
+	 * @return array Messages describing each probe whose latency has risen
+	 */
+	private function checkLatencies ($probes, $failures)
+	{
+		# Start of the window
+		$now = time ();
+		$cutoff = $now - ($this->latencyWindowHours * 60 * 60);
+
+		# Read the time series within the window, with the latencies of successful probes by probe name
+		$lines = array ();
+		$series = array ();
+		if (is_readable ($this->latencyLogFile)) {
+			foreach (file ($this->latencyLogFile, FILE_IGNORE_NEW_LINES | FILE_SKIP_EMPTY_LINES) as $line) {
+				$fields = explode ("\t", $line);
+				if ((count ($fields) != 4) || ($fields[0] < $cutoff)) {continue;}
+				$lines[] = $line;
+				if ($fields[3]) {$series[$fields[1]][] = (float) $fields[2];}
 			}
+		}
 
-			// Report
-			$this->reportProblem ($test, $errorMessage, $result);
+		# Add the probes of this run
+		$current = array ();
+		foreach ($probes as $index => $probe) {
+			$name = preg_replace ('/^test_/', '', $probe['test']) . '@' . parse_url ($probe['url'], PHP_URL_HOST) . '/' . $probe['key'];
+			$success = !isSet ($failures[$index]);
+			$lines[] = implode ("\t", array ($now, $name, sprintf ('%.3f', $probe['seconds']), ($success ? 1 : 0)));
+			if ($success) {
+				$series[$name][] = $probe['seconds'];
+				$current[$name] = true;
+			}
+		}
 
-			// Abandon
-			return false;
+		# Rewrite the time series, dropping what has left the window
+		$temporaryFile = $this->latencyLogFile . '.tmp';
+		file_put_contents ($temporaryFile, implode ("\n", $lines) . "\n");
+		rename ($temporaryFile, $this->latencyLogFile);
+
+		# Compare the median of the latest probes with a percentile of the earlier ones, so the threshold adapts to what is usual for each
+		$breaches = array ();
+		foreach (array_keys ($current) as $name) {
+			$recent = array_slice ($series[$name], -$this->latencyRecentProbes);
+			$earlier = array_slice ($series[$name], 0, -$this->latencyRecentProbes);
+			if ((count ($recent) < $this->latencyRecentProbes) || (count ($earlier) < $this->latencyMinimumSamples)) {continue;}
+			$baseline = $this->percentile ($earlier, $this->latencyPercentile);
+			$threshold = max ($this->latencyMinimumSeconds, $this->latencyFactor * $baseline);
+			$median = $this->percentile ($recent, 50);
+			if ($median > $threshold) {
+				$breaches[] = sprintf ('%s is slow: %.1fs median of the last %d probes, against %.1fs, the %dth percentile of the last %d hours', $name, $median, count ($recent), $baseline, $this->latencyPercentile, $this->latencyWindowHours);
+			}
 		}
 
-		// All passed
-		return true;
+		# Return the breaches
+		return $breaches;
+	}
+
+
+	# Function to return a percentile of a list of values
+	private function percentile ($values, $percentile)
+	{
+		sort ($values);
+		$index = max (0, (int) ceil (($percentile / 100) * count ($values)) - 1);
+		return $values[$index];
 	}
 	
 	
-	# Function to report a problem
-	private function reportProblem ($test, $errorMessage, $result)
+	# Function to report the problems of a run, as one e-mail and one SMS to each number
+	private function reportProblems ($failures, $breaches)
 	{
+		# End if there are none
+		if (!$failures && !$breaches) {return;}
+
+		# Compile the messages, with the tests they are from and the details for the e-mail
+		$messages = array ();
+		$details = array ();
+		$tests = array ();
+		foreach ($failures as $failure) {
+			$messages[] = $failure['errorMessage'];
+			$tests[$failure['test']] = true;
+			$detail = $failure['errorMessage'];
+			if ($failure['result']) {
+				$detail .= "\n\nThe HTTP response body was:\n" . print_r ($failure['result'], true);
+			}
+			$details[] = $detail;
+		}
+		foreach ($breaches as $breach) {
+			$messages[] = $breach;
+			$tests['latency'] = true;
+			$details[] = $breach;
+		}
+		
 		# Echo (debugging)
 		if ($this->debugging) {
-			echo $errorMessage;
+			echo implode ("\n", $messages) . "\n";
 		}
 		
 		# Prepend the date
 		$date = date ('Y-m-d H:i:s');
-		$errorMessage = $date . ': ' . $errorMessage;
 		
-		// Log, the 3 means append to the destination, not automatically with a new line
-		error_log ($errorMessage . PHP_EOL, 3, $this->errorLogFile);
+		// Log each, the 3 means append to the destination, not automatically with a new line
+		foreach ($messages as $message) {
+			error_log ($date . ': ' . $message . PHP_EOL, 3, $this->errorLogFile);
+		}
 
 		# Send e-mail
-		$this->email ($test, $errorMessage, $result);
+		$this->email (implode (', ', array_keys ($tests)), $date . ': ' . implode ("\n\n", $details));
 		
-		# Send SMS
-		$this->sendSms ($errorMessage);
+		# Send SMS, leading with the number of problems when there are several
+		$this->sendSms ($date . ': ' . ((count ($messages) > 1) ? count ($messages) . ' problems, first: ' : '') . $messages[0]);
 	}
 	
 	
@@ -234,26 +406,11 @@ class doCheck
 	/* Tests */
 	
 	
-	# Route-planning test
-	private function test_journey_new (&$errorMessage = false, &$result = false)
+	# Route-planning test, of the response from the URL, whose content is received even when there are errors (see $ignoreErrors)
+	private function test_journey_new ($json, $apiUrl, &$errorMessage = false, &$result = false)
 	{
-		# Plan a route (the split is to avoid bots traversing a repository)
-		$apiUrl = $this->serverUrl . "/api/journey.json?key={$this->testApiKey}&archive=none&plan=quietest&itinerarypoints=-0.14009,51.50202,Buckingham+Palace|-0.12920,51.50435,Horse+Guards+Parade|-0.12939,51.49950,Westminster+Abbey";
-
-		// Include any additonalParameter
-		if ($this->additionalParameter) {$apiUrl .= '&' . $this->additionalParameter;}
-
-		// Create a stream context for file_get_contents setup to receive content even when there are errors
-		$opts = array (
-			'http'	=> array (
-				'method'	=> 'GET',
-				'ignore_errors'	=> '1',		// Equivalent to wget's --content-on-error when dealing with 503s
-			));
-		$context = stream_context_create ($opts);
-
-		// Fetch the result
-		// The @ is an Error Control Operator which ignores any errors generated by the subsequent expression.
-		if (!$json = @file_get_contents ($apiUrl, false, $context)) {
+		# Check there was a response
+		if (!$json) {
 			$errorMessage = "The /api/journey call (new journey) did not respond within {$this->timeoutSeconds} seconds. URL: {$apiUrl}";
 			return false;
 		}
@@ -303,11 +460,10 @@ class doCheck
 	
 	
 	# Route-retrieval test
-	private function xxxtedddst_journey_existing (&$errorMessage = false, &$result = false)
+	private function xxxtedddst_journey_existing ($json, $apiUrl, &$errorMessage = false, &$result = false)
 	{
-		# Plan a route (the split is to avoid bots traversing a repository)
-		$apiUrl = $this->serverUrl . "/api/journey.json?key={$this->testApiKey}&plan=fastest&itinerary=345529";
-		if (!$json = @file_get_contents ($apiUrl)) {
+		# Check there was a response
+		if (!$json) {
 			$errorMessage = "The /api/journey call (retrieve journey) did not respond within {$this->timeoutSeconds} seconds. URL: {$apiUrl}";
 			return false;
 		}
@@ -350,11 +506,10 @@ class doCheck
 	
 	
 	# Nearestpoint test
-	private function test_nearestpoint (&$errorMessage = false, &$result = false)
+	private function test_nearestpoint ($json, $apiUrl, &$errorMessage = false, &$result = false)
 	{
-		# Obtain a photo (the split is to avoid bots traversing a repository)
-		$apiUrl = $this->apiV2Url . "/nearestpoint?key={$this->testApiKey}&lonlat=0.117950,52.205302";
-		if (!$json = @file_get_contents ($apiUrl)) {
+		# Check there was a response
+		if (!$json) {
 			$errorMessage = "The /v2/nearestpoint call did not respond within {$this->timeoutSeconds} seconds. URL: {$apiUrl}";
 			return false;
 		}
@@ -391,11 +546,10 @@ class doCheck
 	
 	
 	# Geocoder test
-	private function test_geocoder (&$errorMessage = false, &$result = false)
+	private function test_geocoder ($json, $apiUrl, &$errorMessage = false, &$result = false)
 	{
-		# Plan a route (the split is to avoid bots traversing a repository)
-		$apiUrl = $this->serverUrl . "/api/geocoder.json?key={$this->testApiKey}&w=0.113937&s=52.201937&e=0.121963&n=52.208669&zoom=16&street=thoday%20street";
-		if (!$json = @file_get_contents ($apiUrl)) {
+		# Check there was a response
+		if (!$json) {
 			$errorMessage = "The /api/geocoder call did not respond within {$this->timeoutSeconds} seconds. URL: {$apiUrl}";
 			return false;
 		}
@@ -445,11 +599,10 @@ class doCheck
 
 
 	# Photo (retrieval) test
-	private function test_photo (&$errorMessage = false, &$result = false)
+	private function test_photo ($json, $apiUrl, &$errorMessage = false, &$result = false)
 	{
-		# Obtain a photo (the split is to avoid bots traversing a repository)
-		$apiUrl = $this->apiV2Url . "/photomap.location?key={$this->testApiKey}&id=80&fields=id,latitude,longitude,caption&format=flat";
-		if (!$json = @file_get_contents ($apiUrl)) {
+		# Check there was a response
+		if (!$json) {
 			$errorMessage = "The /v2/photomap.location call did not respond within {$this->timeoutSeconds} seconds. URL: {$apiUrl}";
 			return false;
 		}
@@ -0,0 +1,158 @@
+# A helper script for generating per-endpoint API performance data for munin.
+#
+# This extends accessLogLingerStats so that a single pass over the Apache access log classifies each
+# request into one of a table of API endpoints, using one combined pattern rather than a test per endpoint.
+# For each endpoint it calculates the number of calls, the average, 90th percentile and slowest response
+# times and a breakdown of the HTTP status classes.
+#
+# Synopsis
+#	accessLogEndpointStats.py logFile [stateFile]
+#
+# Result
+#	Values for the munin multigraph plugin munin-apilinger.py, times in milliseconds, eg:
+#	multigraph cyclestreets_api_requests
+#	journey_v2.value 310
+#	...
+#	multigraph cyclestreets_api_linger.journey_v2
+#	mean.value 22
+#	top90.value 39
+#	slowest.value 140
+#
+# Example
+# user@veebee:$
+# python3 utility/accessLogEndpointStats.py /websites/www/logs/veebee-access.log /tmp/apilinger.state
+
+# Dependencies
+import sys, re, math
+from accessLogLingerStats import accessLogLingerStats
+
+# Endpoints, as munin field name and a regular expression matched against the request line, in order of precedence
+defaultEndpoints = [
+    ('journey_v1',     r'/api/journey\.'),
+    ('journey_v2',     r'/v2/journey\.'),
+    ('nearestpoint',   r'/nearestpoint\.'),
+    ('elevation',      r'/elevation\.values'),
+    ('photomap',       r'/photomap\.'),
+    ('geocoder',       r'/geocoder\.'),
+]
+
+# HTTP status classes reported
+statusClasses = ('2xx', '3xx', '4xx', '5xx')
+
+class accessLogEndpointStats (accessLogLingerStats):
+    """
+    Functions for getting per-endpoint API statistics from an apache access log file in one pass.
+    """
+
+    def __init__(self, logfile, stateFile = None, endpoints = defaultEndpoints):
+
+        # Common setup
+        accessLogLingerStats.__init__(self, logfile, stateFile)
+
+        # Table of endpoints
+        self.endpoints = endpoints
+
+        # One matcher for all the endpoints; the name of the group that matched identifies the endpoint
+        self.endpointMatcher = re.compile('|'.join('(?P<{}>{})'.format(name, pattern) for name, pattern in endpoints).encode('utf8'))
+
+        # Results for each endpoint
+        self.reset()
+
+
+    def reset (self):
+        """
+        Clears the results for each endpoint.
+        """
+        self.sketches = {name: self.newSummary() for name, pattern in self.endpoints}
+        self.statusCounts = {name: dict.fromkeys(statusClasses, 0) for name, pattern in self.endpoints}
+
+
+    def scan (self, lines, recentOnly = False):
+        """
+        Scan the lines of the log file, supplied as bytes, classifying each by endpoint.
+        """
+        self.reset()
+        self.consideredLines = 0
+        self.unmatchedLines = 0
+
+        # Bind locally for speed
+        endpointSearch = self.endpointMatcher.search
+        lineFormat = self.lineFormat
+
+        for line in lines:
+
+            # Skip lines that mention none of the endpoints without parsing them
+            if not endpointSearch(line):
+                continue
+
+            self.consideredLines += 1
+            match = lineFormat.search(line)
+            if not match:
+                self.unmatchedLines += 1
+                continue
+            if recentOnly and not self.recentlyLoggedTime(match.group('time')):
+                continue
+
+            # Classify on the request itself, as an endpoint may also appear in the referer
+            endpoint = endpointSearch(match.group('request'))
+            if not endpoint:
+                continue
+            name = endpoint.lastgroup
+
+            self.sketches[name].add(int(match.group('micro')))
+
+            statusClass = match.group('status')[:1].decode('ascii') + 'xx'
+            if statusClass in self.statusCounts[name]:
+                self.statusCounts[name][statusClass] += 1
+
+
+    def endpointResults (self, name):
+        """
+        Returns the count, average, 90th percentile and slowest times in milliseconds for an endpoint.
+        Times are zero if there are too few calls to be meaningful.
+        """
+        sketch = self.sketches[name]
+        if sketch.count < self.minimumDataLines:
+            return sketch.count, 0, 0, 0
+        return sketch.count, round(sketch.mean() / 1000), math.ceil(sketch.quantile(0.9) / 1000), math.ceil(sketch.maximum / 1000)
+
+
+    def formatResults (self):
+        """
+        Returns the statistics as text in the multigraph format expected by munin.
+        """
+        results = {name: self.endpointResults(name) for name, pattern in self.endpoints}
+        lines = []
+
+        lines.append('multigraph cyclestreets_api_requests')
+        for name, (count, mean, top90, slowest) in results.items():
+            lines.append('{}.value {:d}'.format(name, count))
+
+        lines.append('multigraph cyclestreets_api_linger')
+        for name, (count, mean, top90, slowest) in results.items():
+            lines.append('{}.value {:d}'.format(name, top90))
+
+        for name, (count, mean, top90, slowest) in results.items():
+            lines.append('multigraph cyclestreets_api_linger.{}'.format(name))
+            lines.append('mean.value {:d}'.format(mean))
+            lines.append('top90.value {:d}'.format(top90))
+            lines.append('slowest.value {:d}'.format(slowest))
+
+            lines.append('multigraph cyclestreets_api_requests.{}'.format(name))
+            for statusClass, count in self.statusCounts[name].items():
+                lines.append('status{}.value {:d}'.format(statusClass, count))
+
+        return '\n'.join(lines) + '\n'
+
+
+# Main
+if __name__ == '__main__':
+
+    # Read args supplied to script
+    aes = accessLogEndpointStats(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
+
+    # Get the stats
+    sys.exit(0 if aes.generateStatistics() else 1)
+
+
+# End of file
@@ -1,13 +1,27 @@
 # A helper script for generating journey planner API performance data for munin.
 #
-# This script fetches the last few lines of an Apache access log that contains
+# This script reads the last five minutes of an Apache access log that contains
 # server response times in microseconds at the end of each line.
+# The start of that window is found by a binary search on the byte offset, so the cost depends on the
+# window rather than on the size of the log; the same search serves ad-hoc queries with --between.
 # It filters for the journey API calls and calculates several statistics
 # that characterize how long the server has been taking to respond - ie how long
 # the caller must linger for a result.
 #
 # Synopsis
-#	accessLogLingerStats.py logFile
+#	accessLogLingerStats.py [--exact] [--sketch-file file] logFile [stateFile]
+#	accessLogLingerStats.py --benchmark [numberOfLines]
+#	accessLogLingerStats.py --between 'YYYY-mm-dd HH:MM[:SS]' 'YYYY-mm-dd HH:MM[:SS]' logFile
+#
+# If the optional stateFile is given the log is read incrementally: the inode and byte offset reached
+# are saved in that file and the next run reads only the bytes appended since then, so the statistics
+# cover every request in the interval between runs rather than just the tail of the log.
+# A log rotation (inode change or truncation) is detected and the rotated file (logFile.1) is finished first.
+#
+# Lines are parsed as bytes with one pattern compiled from the LogFormat (see compileLogFormat), and only lines
+# containing the api call are matched. The --benchmark option compares this with the former str parsing on a synthetic log.
+# If most of those lines do not match the LogFormat, the log is in some other format, so a warning is given and the
+# script exits with status 1 rather than report zeros.
 #
 # Result
 #	Serveral results, in milisconds, are generated each on a new line:
@@ -15,6 +29,10 @@
 #	* Average response time
 #	* Response time at the 90th percentile when ordered by ascending time
 #
+# Percentiles are estimated to within 1% by a streaming sketch (see lingerSketch.py) rather than by sorting every time.
+# With --exact every timing is kept in a compact buffer (see lingerTimings.py) and the percentiles are exact.
+# Otherwise --sketch-file saves the sketch of each scan, so it can be merged with others by lingerSketch.py.
+#
 # Example
 # user@veebee:$
 # python3 utility/accessLogLingerStats.py /websites/www/logs/veebee-access.log
@@ -26,19 +44,64 @@
 # The relevant log file needs to include timings at the end of the line.
 # That can be done in the virtual host CustomLog or by redfining these formats in the general config using the LogFormat directive.
 # Include time (%T) and microtime (%D) in logs; see: http://blog.keul.it/2011/10/debugging-slow-site-using-apache.html
-# LogFormat "%h %l %u %t \"%r\" %>s %O \"%{Referer}i\" \"%{User-Agent}i\" %T/%D" combined
-# LogFormat "%v:%p %h %l %u %t \"%r\" %>s %O \"%{Referer}i\" \"%{User-Agent}i\" %T/%D" vhost_combined
+# The formats set up by install-website/zcsglobal.conf are:
+# LogFormat "%h %l %u %t \"%r\" %>s %O \"%{Referer}i\" \"%{User-Agent}i\" %{Host}i %{UNIQUE_ID}e %T/%D" combined
+# LogFormat "%v:%p %h %l %u %t \"%r\" %>s %O \"%{Referer}i\" \"%{User-Agent}i\" %{Host}i %{UNIQUE_ID}e %T/%D" vhost_combined
 
 # Dependencies
-import subprocess, re, sys, math
-from datetime import datetime
+import subprocess, re, sys, math, os, json, time, tempfile, mmap
+from datetime import datetime, timedelta
+from lingerSketch import lingerSketch
+from lingerTimings import lingerTimings
+
+# The LogFormat of the logs, as above
+defaultLogFormat = r'%h %l %u %t \"%r\" %>s %O \"%{Referer}i\" \"%{User-Agent}i\" %{Host}i %{UNIQUE_ID}e %T/%D'
+
+# Regular expressions for the LogFormat directives that are captured; other directives match a field without capturing it
+logFormatDirectives = {
+    '%t':  rb'\[(?P<time>[^\]]+)\]',
+    '%r':  rb'(?P<request>[^"\\]*(?:\\.[^"\\]*)*)',
+    '%>s': rb'(?P<status>[0-9]{3})',
+    '%D':  rb'(?P<micro>[0-9]+)',
+    '%{UNIQUE_ID}e': rb'(?P<uniqueid>[^ ]+)',
+}
+
+def compileLogFormat (logFormat = defaultLogFormat):
+    """
+    Compiles an Apache LogFormat string into a single regular expression over the raw bytes of a log line, for use with search().
+    The named groups are time, request, status, uniqueid and micro where the format includes them.
+    """
+    pattern = b''
+    quoted = False
+    for token in re.findall(r'%\{[^}]*\}[a-zA-Z]|%>?[a-zA-Z]|\\"|.', logFormat, re.DOTALL):
+
+        # Whatever precedes the time is not needed, so the search starts at its opening bracket
+        if not pattern and token != '%t':
+            continue
+
+        if token == '\\"':
+            pattern += b'"'
+            quoted = not quoted
+        elif token in logFormatDirectives:
+            pattern += logFormatDirectives[token]
+        elif token.startswith('%'):
+            # Quoted fields such as the user agent may contain spaces and escaped quotes
+            pattern += rb'[^"\\]*(?:\\.[^"\\]*)*' if quoted else rb'[^ ]*'
+        else:
+            pattern += re.escape(token.encode('utf8'))
+    return re.compile(pattern + rb'\s*$')
+
+
+# Just the logged time, for probing lines during a binary search
+loggedTimePattern = re.compile(rb'\[([0-9]{2}/[A-Za-z]{3}/[0-9]{4}:[0-9]{2}:[0-9]{2}:[0-9]{2})')
+
 
 class accessLogLingerStats ():
     """
     Functions for getting journey API linger statistics from an apache access log file.
     """
 
-    def __init__(self, logfile):
+    def __init__(self, logfile, stateFile = None):
 
         # Trace
         # print ("#\tStarting")
@@ -48,16 +111,44 @@ class accessLogLingerStats ():
         self.top90percentLingerMs = 0
         self.slowestLingerMs = 0
 
+        # Linger at each of the sketch's standard percentiles, keyed by quantile, eg 0.99
+        self.percentileLingerMs = {}
+
+        # Relative accuracy of the percentiles
+        self.relativeAccuracy = 0.01
+
+        # Whether to keep every timing for exact percentiles (see lingerTimings) rather than estimate them in bounded memory
+        self.exact = False
+
+        # File to which the sketch of the scanned response times is saved, or None; not used when exact
+        self.sketchFile = None
+
         # Log file
         self.logfile = logfile
 
-        # Number of lines of the log file to scan
-        self.numberOfLines = 1000
+        # State file for incremental reading, or None to scan the tail of the log
+        self.stateFile = stateFile
+
+        # Name of the file logrotate moves the log to
+        self.rotatedLogfile = logfile + '.1'
+
+        # Size of the blocks read in incremental mode
+        self.readChunkBytes = 1024 * 1024
+
+        # Length of the window of recent lines analysed, when not reading incrementally
+        self.windowSeconds = 300
+
+        # Lines are logged when the request completes but show when it started, so they are only almost in order
+        self.disorderSeconds = 120
 
         # Minimum number of input data lines
         # If less than this amount of data is available all results are zero.
         self.minimumDataLines = 10
 
+        # Lines of the last scan that contained the api call, and those of them not matching the LogFormat
+        self.consideredLines = 0
+        self.unmatchedLines = 0
+
         # Api call pattern
         # v1
         # self.apiCall = 'api/journey.'
@@ -69,6 +160,12 @@ class accessLogLingerStats ():
         # Current time
         self.now = datetime.now()
 
+        # Compiled pattern matching the whole line
+        self.lineFormat = compileLogFormat()
+
+        # Logged times, which only change once a second, parsed already
+        self.loggedTimes = {}
+
 
     def checkLastEntryIsRecent (self):
         """
@@ -80,9 +177,6 @@ class accessLogLingerStats ():
         # Get the first line
         line = p.stdout.readline()
 
-        # Convert from bytes to str
-        line = line.decode('utf8')
-
         # Close
         p.kill()
 
@@ -90,70 +184,98 @@ class accessLogLingerStats ():
         return self.recentlyLoggedLine(line)
 
 
+    # Helper function
+    def loggedTime (self, stamp):
+        """
+        Parses the date time component of a logged line, given as bytes such as: 01/Jun/2020:00:01:08 +0100
+        """
+        # The time zone offset is ignored; lines are compared with local time
+        stamp = stamp[:20]
+
+        # Cached, as busy logs have many lines per second
+        if stamp not in self.loggedTimes:
+
+            # Keep the cache bounded when scanning long logs
+            if len(self.loggedTimes) > 100000:
+                self.loggedTimes.clear()
+            self.loggedTimes[stamp] = datetime.strptime(stamp.decode('ascii'), '%d/%b/%Y:%H:%M:%S')
+
+        return self.loggedTimes[stamp]
+
+
     # Helper function
     def recentlyLoggedLine (self, line):
         """
-        Determines if the line was logged within the last five minutes.
+        Determines if the line, given as bytes, was logged within the last five minutes.
         """
         # Extract the date time component
         # The access log lines having the combined format begin:
         # 127.0.0.1 - - [01/Jun/2020:00:01:08 +0100] "GET ..."
-        loggedTime = re.compile(r"\[([^\s]+)").search(line)
-        if not loggedTime:
+        # Only the time is matched, so that a line in another format is still found to be recent and reported by the scan
+        match = loggedTimePattern.search(line)
+        if not match:
             return False
 
-        # Bind
-        loggedDateTime  = loggedTime.group(1)
-
-        # In future examine the time zone offset
-        if False:
-            loggedUTCoffset = loggedTime.group(2)
-            utcOffset = re.compile(r"([+-])([0-9]{2})([0-9]{2})").search(loggedUTCoffset)
-            utcOffsetSeconds = 1 if utcOffset.group(1) == '+' else -1
-            utcOffsetSeconds = utcOffsetSeconds * (int(utcOffset.group(2)) * 3600) 
-            utcOffsetSeconds += int(utcOffset.group(3)) * 60
+        return self.recentlyLoggedTime(match.group(1))
 
-        # Parse into an object
-        datetime_object = datetime.strptime(loggedDateTime, '%d/%b/%Y:%H:%M:%S')
-        if not datetime_object:
-            return False
 
+    # Helper function
+    def recentlyLoggedTime (self, stamp):
+        """
+        Determines if the logged time, given as bytes, is within the last five minutes.
+        """
         # Difference
-        age = self.now - datetime_object
+        try:
+            age = self.now - self.loggedTime(stamp)
+        except ValueError:
+            return False
 
         # Trace
-        # print (age.seconds)
+        # print (age.total_seconds())
 
         # Result
-        return age.seconds <= 300
+        return age.total_seconds() <= self.windowSeconds
 
 
     # Helper functions
+    def formatResults (self):
+        """
+        Returns the statistics as text in the format expected by munin.
+        """
+        return ('journey_slowest.value {:d}\n'.format(int(self.slowestLingerMs)) +
+                'journey_linger.value {:d}\n'.format(int(self.averageLingerMs)) +
+                'journey_top90linger.value {:d}\n'.format(int(self.top90percentLingerMs)))
+
+
     def printResults (self):
         """
         Produce statistics in the format expected by munin.
         """
-        print('journey_slowest.value {:d}'.format(int(self.slowestLingerMs)))
-        print('journey_linger.value {:d}'.format(int(self.averageLingerMs)))
-        print('journey_top90linger.value {:d}'.format(int(self.top90percentLingerMs)))
+        print(self.formatResults(), end = '')
 
 
-    def considerLine (self, line):
+    def formatMatches (self):
         """
-        Determines whether to include the line in the analysis.
-        It needs to:
-        1. Contain the api call
-        2. Have been logged within the last five minutes
+        Returns whether most of the lines considered by the last scan matched the LogFormat, warning if not.
         """
-        if self.apiCall not in line:
-            return False
-        return self.recentlyLoggedLine(line)
+        if self.consideredLines < self.minimumDataLines or self.unmatchedLines * 2 <= self.consideredLines:
+            return True
+        print('#\t{:d} of {:d} lines considered in {} do not match the LogFormat: {}'.format(self.unmatchedLines, self.consideredLines, self.logfile, defaultLogFormat), file = sys.stderr)
+        return False
 
 
     def generateStatistics (self):
         """
-        Main procedure for reading the log and getting the stats.
+        Main procedure for reading the log and getting the stats. Returns False if the log is not in the expected format.
         """
+        # Incremental mode covers exactly the lines added since the last run
+        if self.stateFile:
+            self.scan(self.newLines())
+            if not self.formatMatches():
+                return False
+            self.printResults()
+            return True
+
         # If the log file hasn't been updated in the last five minutes
         if not self.checkLastEntryIsRecent():
 
@@ -164,95 +286,356 @@ class accessLogLingerStats ():
             self.printResults()
 
             # Abandon
-            return
+            return True
 
-        # Scan the file
-        self.scan()
+        # Scan the recent part of the file
+        self.scan(self.linesBetween(self.now - timedelta(seconds = self.windowSeconds), self.now))
+        if not self.formatMatches():
+            return False
 
         # Print results
         self.printResults()
+        return True
 
 
-    def scan (self):
+    def probeTime (self, buffer, offset):
         """
-        Scan the log file.
+        Returns the logged time, start and end offsets of the first parsable line starting at or after the offset, or None.
         """
-        # Trace
-        # print ("#\tScanning log file: {}, API: {}".format(str(self.logfile), self.apiCall))
+        # Move to the start of a line
+        if offset > 0 and buffer[offset - 1] != 10:
+            offset = buffer.find(b'\n', offset) + 1
+            if offset == 0:
+                return None
+
+        while offset < len(buffer):
+            end = buffer.find(b'\n', offset)
+            if end == -1:
+                return None
+            match = loggedTimePattern.search(buffer, offset, end)
+            if match:
+                try:
+                    return self.loggedTime(match.group(1)), offset, end
+                except ValueError:
+                    pass
+            offset = end + 1
+
+        return None
+
+
+    def lowerBound (self, buffer, earliest):
+        """
+        Returns the offset of the first line logged at or after the earliest time, by a binary search over byte offsets.
+        """
+        low, high = 0, len(buffer)
+        while low < high:
+            middle = (low + high) // 2
+            probe = self.probeTime(buffer, middle)
+            if probe is None or probe[0] >= earliest:
+                high = middle
+            else:
+                low = probe[2] + 1
 
-        # Get the last few lines of the log file
-        p = subprocess.Popen(["tail", "--lines=" + str(self.numberOfLines), self.logfile], stdout=subprocess.PIPE)
+        # Align to the start of a line
+        probe = self.probeTime(buffer, low)
+        return probe[1] if probe else len(buffer)
 
-        # Get the first line, arrives as bytes
-        line = p.stdout.readline()
 
-        # Count matching lines
-        count = 0
+    def linesBetween (self, start, end, paths = None):
+        """
+        Generates the lines, as bytes, logged from start until before end, searching the rotated log and then the current one.
+        """
+        slack = timedelta(seconds = self.disorderSeconds)
+
+        for path in paths or (self.rotatedLogfile, self.logfile):
+            try:
+                f = open(path, 'rb')
+            except OSError:
+                continue
+
+            with f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    continue
+                with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as buffer:
+
+                    # Allow for lines logged slightly out of order
+                    offset = self.lowerBound(buffer, start - slack)
+
+                    while offset < len(buffer):
+                        lineEnd = buffer.find(b'\n', offset)
+                        if lineEnd == -1:
+                            break
+                        line = buffer[offset:lineEnd]
+                        offset = lineEnd + 1
+
+                        match = loggedTimePattern.search(line)
+                        if not match:
+                            continue
+                        try:
+                            logged = self.loggedTime(match.group(1))
+                        except ValueError:
+                            continue
+
+                        # Stop once safely past the window
+                        if logged >= end + slack:
+                            break
+                        if start <= logged < end:
+                            yield line
+
+
+    def readState (self):
+        """
+        Reads the inode and byte offset saved by the previous incremental run, or None if there is none.
+        """
+        try:
+            with open(self.stateFile) as f:
+                state = json.load(f)
+            return int(state['inode']), int(state['offset'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
 
-        # Total time
-        microSeconds = 0
 
-        # Array of response times
-        lingerTimes = []
+    def writeState (self, inode, offset):
+        """
+        Saves the inode and byte offset reached, replacing the state file atomically.
+        """
+        temporary = self.stateFile + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump({'inode': inode, 'offset': offset}, f)
+        os.replace(temporary, self.stateFile)
 
-        # Scan
-        while line:
 
-            # Convert from bytes to str
-            line = line.decode('utf8')
+    def readFrom (self, path, offset):
+        """
+        Generates the complete lines of a file beyond the offset, reading in large blocks.
+        While generating, readInode and lineOffset locate the current line; on completion readOffset is the offset just after the last complete line.
+        """
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            self.readInode = os.fstat(f.fileno()).st_ino
+
+            # Any incomplete line carried over from the previous block
+            remainder = b''
+
+            while True:
+                block = f.read(self.readChunkBytes)
+                if not block:
+                    break
+
+                lines = (remainder + block).split(b'\n')
+
+                # The last piece is incomplete (or empty when the block ends with a newline)
+                remainder = lines.pop()
+                for line in lines:
+                    self.lineOffset = offset
+                    offset += len(line) + 1
+                    yield line
+
+        # An unterminated last line is left for the next run, when Apache will have finished writing it
+        self.readOffset = offset
+
+
+    def newLines (self):
+        """
+        Generates the lines, as bytes, appended to the log file since the last incremental run and records the new position.
+        """
+        try:
+            current = os.stat(self.logfile)
+        except OSError:
+            return
+
+        state = self.readState()
+
+        # First run: start from the end so that later runs cover one interval each
+        if state is None:
+            self.writeState(current.st_ino, current.st_size)
+            return
+
+        inode, offset = state
+
+        if inode != current.st_ino:
+
+            # Rotated: finish reading the old file, if it is still there, then start the new one from the beginning
+            try:
+                if os.stat(self.rotatedLogfile).st_ino == inode:
+                    yield from self.readFrom(self.rotatedLogfile, offset)
+            except OSError:
+                pass
+            offset = 0
+
+        elif current.st_size < offset:
+
+            # Truncated (copytruncate): start again from the beginning
+            offset = 0
+
+        # Read the new part of the current file
+        yield from self.readFrom(self.logfile, offset)
+
+        # Save the position reached
+        self.writeState(current.st_ino, self.readOffset)
+
+
+    def newSummary (self):
+        """
+        Returns an empty summary of response times: exact timings or a sketch.
+        """
+        if self.exact:
+            return lingerTimings()
+        return lingerSketch(self.relativeAccuracy)
+
+
+    def scan (self, lines, recentOnly = False):
+        """
+        Scan the lines of the log file, supplied as bytes.
+        A line is included in the analysis if it:
+        1. Contains the api call
+        2. Has been logged within the last five minutes, when recentOnly is set
+        """
+        # Trace
+        # print ("#\tScanning log file: {}, API: {}".format(str(self.logfile), self.apiCall))
+
+        # Response times in microseconds are summarised by a streaming sketch, so memory does not grow with the window
+        self.sketch = self.newSummary()
+
+        # Lines are scanned as bytes, so avoiding decoding them
+        needle = self.apiCall.encode('utf8')
+        lineFormat = self.lineFormat
+        self.consideredLines = 0
+        self.unmatchedLines = 0
+
+        # Scan
+        for line in lines:
 
             # Check if the line contains call to the journey api
-            if self.considerLine(line):
+            if needle in line:
 
                 # Trace
-                # print ("#\tConsidering ... " + str(count))
+                # print ("#\tConsidering ... " + str(self.sketch.count))
+                self.consideredLines += 1
 
-                # Find the number at the end of the line after a solidus
-                match = re.match('.+?/([0-9]+)$', line)
-                if match:
-                    count += 1
-                    microSeconds += int(match.group(1))
-                    lingerTimes.append(int(match.group(1)))
+                # The response time in microseconds is at the end of the line after a solidus
+                match = lineFormat.search(line)
+                if not match:
+                    self.unmatchedLines += 1
+                elif not recentOnly or self.recentlyLoggedTime(match.group('time')):
+                    self.sketch.add(int(match.group('micro')))
+
+        # Save the sketch so that it can be merged with others
+        if self.sketchFile and not self.exact:
+            self.sketch.save(self.sketchFile)
+
+        # Summarise
+        self.calculateStatistics()
 
-            # Read next line
-            line = p.stdout.readline()
 
+    def calculateStatistics (self):
+        """
+        Sets the statistics from the sketch of response times.
+        """
         # Insufficient input data?
-        if count < self.minimumDataLines:
+        if not self.sketch.count or self.sketch.count < self.minimumDataLines:
             # Trace
-            # print ("#\tStopping, counted: " + str(count))
+            # print ("#\tStopping, counted: " + str(self.sketch.count))
             return
 
         # Calculate the average
-        # float()  ensures the / avoids truncating
-        self.averageLingerMs = round(float(microSeconds) / (count * 1000))
+        self.averageLingerMs = round(self.sketch.mean() / 1000)
 
-        # 90% target
-        # Sort the list ascending times
-        ascending = sorted(lingerTimes)
+        # Percentiles
+        self.percentileLingerMs = {q: math.ceil(value / 1000) for q, value in self.sketch.quantiles().items()}
 
-        # Consider the first 90%
-        top90startIndex = int(math.ceil(0.9 * len(lingerTimes)))
-        self.top90percentLingerMs = math.ceil(float(ascending[top90startIndex]) / 1000)
+        # 90% target
+        self.top90percentLingerMs = self.percentileLingerMs[0.9]
 
-        # Slowest
-        self.slowestLingerMs = math.ceil(float(ascending[-1]) / 1000)
+        # Slowest, which the sketch keeps exactly
+        self.slowestLingerMs = math.ceil(self.sketch.maximum / 1000)
 
         # Trace
-        # print ("#\tTop 90% index: " + str(top90startIndex) + ", time: " + str(self.top90percentLingerMs) + " ms")
+        # print ("#\tStopping, counted: " + str(self.sketch.count) + " time: " + str(self.averageLingerMs) + "ms")
 
-        # Trace
-        # print ("#\tStopping, counted: " + str(count) + " time: " + str(self.averageLingerMs) + "ms, " + str(microSeconds) + " microseconds.")
+
+def benchmark (numberOfLines = 1000000):
+    """
+    Times the line-by-line str parsing this script used to do against the compiled bytes parser, over a synthetic log.
+    """
+    # Synthetic log, about half journey calls, with a few lines logged each second
+    now = int(time.time())
+    with tempfile.NamedTemporaryFile('wb', suffix = '.log', delete = False) as f:
+        path = f.name
+        for i in range(numberOfLines):
+            stamp = datetime.fromtimestamp(now - 300 + (i * 300) // numberOfLines).strftime('%d/%b/%Y:%H:%M:%S')
+            call = '/v2/journey.plan?itinerarypoints=0.1,52.2|0.12,52.21' if i % 2 else '/v2/photomap.locations?bbox=0,52,1,53'
+            f.write('10.0.0.{} - - [{} +0100] "GET {} HTTP/1.1" 200 {} "-" "Mozilla/5.0 (X11; Linux x86_64)" api.cyclestreets.net ZC{:022d} 0/{}\n'.format(i % 250, stamp, call, 1000 + i % 5000, i, 1000 + (i * 7919) % 900000).encode('ascii'))
+
+    try:
+        # Legacy: decode every line, compile and search for the time, strptime each one, then regex for the response time
+        started = time.perf_counter()
+        legacy = []
+        reference = datetime.now()
+        with open(path, 'rb') as f:
+            for line in f:
+                line = line.decode('utf8')
+                if '/journey.' not in line:
+                    continue
+                loggedTime = re.compile(r"\[([^\s]+)").search(line)
+                if (reference - datetime.strptime(loggedTime.group(1), '%d/%b/%Y:%H:%M:%S')).seconds > 300:
+                    continue
+                match = re.match('.+?/([0-9]+)$', line)
+                if match:
+                    legacy.append(int(match.group(1)))
+        sorted(legacy)
+        legacySeconds = time.perf_counter() - started
+
+        # Compiled: bytes throughout, one pattern, cached times
+        started = time.perf_counter()
+        alls = accessLogLingerStats(path)
+        alls.minimumDataLines = 0
+        alls.scan(alls.readFrom(path, 0), True)
+        compiledSeconds = time.perf_counter() - started
+
+    finally:
+        os.unlink(path)
+
+    print('# Lines: {:d}, journey calls: {:d}'.format(numberOfLines, alls.sketch.count))
+    print('# Legacy parser:   {:.2f}s'.format(legacySeconds))
+    print('# Compiled parser: {:.2f}s ({:.1f}x faster)'.format(compiledSeconds, legacySeconds / compiledSeconds))
 
 
 # Main
 if __name__ == '__main__':
 
+    # Micro-benchmark, optionally with a number of lines
+    if len(sys.argv) > 1 and sys.argv[1] == '--benchmark':
+        benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 1000000)
+        sys.exit(0)
+
+    # Print the lines logged in a time window, eg: --between '2020-06-01 14:00' '2020-06-01 14:05' logFile
+    if len(sys.argv) > 4 and sys.argv[1] == '--between':
+        times = [datetime.fromisoformat(argument) for argument in sys.argv[2:4]]
+        alls = accessLogLingerStats(sys.argv[4])
+        for line in alls.linesBetween(*times):
+            sys.stdout.buffer.write(line + b'\n')
+        sys.exit(0)
+
+    # Options come before the log file
+    arguments = sys.argv[1:]
+    exact = False
+    sketchFile = None
+    while arguments and arguments[0] in ('--exact', '--sketch-file'):
+        if arguments[0] == '--exact':
+            exact = True
+            arguments = arguments[1:]
+        else:
+            sketchFile = arguments[1]
+            arguments = arguments[2:]
+
     # Read args supplied to script
-    alls = accessLogLingerStats(sys.argv[1])
+    alls = accessLogLingerStats(arguments[0], arguments[1] if len(arguments) > 1 else None)
+    alls.exact = exact
+    alls.sketchFile = sketchFile
 
     # Get the stats
-    alls.generateStatistics()
+    sys.exit(0 if alls.generateStatistics() else 1)
 
 
 # End of file
@@ -0,0 +1,224 @@
+# Replays historical Apache access logs to produce a linger report for capacity planning.
+#
+# Streams through a set of access logs, including the .gz files produced by logrotate, decompressing as it goes,
+# and buckets the response times by minute or hour, by API endpoint (see accessLogEndpointStats) and by routing edition.
+# Files are processed in parallel by a pool of processes and their results merged, so a month of logs takes minutes.
+#
+# The access log does not record which routing edition served a request, so the edition is taken from an
+# edition= parameter in the request if there is one, otherwise from an optional timeline file listing when each
+# edition went live, one per line as: 2020-06-01 04:30 routing200601
+#
+# Synopsis
+#	accessLogReplay.py [--bucket minute|hour] [--editions timelineFile] [--exact] [--processes n] [--npy file] [--parquet file] output.csv logFile [logFile ...]
+#
+# Result
+#	A CSV file with one row per bucket, endpoint and edition giving: count, mean, p50, p90, p99 and slowest in milliseconds,
+#	and counts of each HTTP status class. The same columns can also be written as a NumPy structured array or a Parquet file.
+#
+# Example
+# user@veebee:$
+# python3 utility/accessLogReplay.py --bucket hour report.csv /websites/www/logs/api-access.log*
+
+# Dependencies
+import sys, os, re, csv, gzip, math, bisect, argparse
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from accessLogEndpointStats import accessLogEndpointStats, statusClasses
+
+# Length of the logged time, such as 01/Jun/2020:00:01, that identifies each size of bucket
+bucketStampLengths = {'minute': 17, 'hour': 14}
+bucketFormats = {'minute': '%d/%b/%Y:%H:%M', 'hour': '%d/%b/%Y:%H'}
+
+# Length of the logged time to the second, such as 01/Jun/2020:00:01:02
+secondStampLength = 20
+
+# Edition named in a request
+editionParameter = re.compile(rb'[?&]edition=([A-Za-z0-9_]+)')
+
+# Columns of the report
+columns = ['bucket', 'endpoint', 'edition', 'count', 'mean', 'p50', 'p90', 'p99', 'slowest'] + ['status' + statusClass for statusClass in statusClasses]
+
+def readEditionTimeline (path):
+    """
+    Returns the edition timeline as a sorted list of (datetime, edition).
+    """
+    timeline = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            day, clock, edition = line.split()
+            timeline.append((datetime.strptime(day + ' ' + clock, '%Y-%m-%d %H:%M'), edition))
+    return sorted(timeline)
+
+
+def openLog (path):
+    """
+    Opens a log for reading as bytes, decompressing as a stream if it is gzipped.
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb', buffering = 1024 * 1024)
+
+
+def summariseFile (path, bucket, timeline, exact = False):
+    """
+    Returns the sketches, or exact timings, and status counts of one log, keyed by (bucket stamp, endpoint, edition).
+    Runs in a worker process.
+    """
+    aes = accessLogEndpointStats(path)
+    aes.exact = exact
+    endpointSearch = aes.endpointMatcher.search
+    lineFormat = aes.lineFormat
+    stampLength = bucketStampLengths[bucket]
+    timelineTimes = [when for when, edition in timeline]
+
+    # Edition found from the timeline for each second logged, as an edition can go live part way through a bucket
+    secondEditions = {}
+
+    summary = {}
+    with openLog(path) as f:
+        for line in f:
+
+            # Skip lines that mention none of the endpoints without parsing them
+            if not endpointSearch(line):
+                continue
+            match = lineFormat.search(line)
+            if not match:
+                continue
+            endpoint = endpointSearch(match.group('request'))
+            if not endpoint:
+                continue
+
+            stamp = match.group('time')[:stampLength]
+
+            # Edition
+            named = editionParameter.search(match.group('request'))
+            if named:
+                edition = named.group(1).decode('ascii')
+            elif timeline:
+                second = match.group('time')[:secondStampLength]
+                if second not in secondEditions:
+                    index = bisect.bisect_right(timelineTimes, aes.loggedTime(match.group('time'))) - 1
+                    secondEditions[second] = timeline[index][1] if index >= 0 else ''
+                edition = secondEditions[second]
+            else:
+                edition = ''
+
+            key = (stamp, endpoint.lastgroup, edition)
+            if key not in summary:
+                summary[key] = (aes.newSummary(), dict.fromkeys(statusClasses, 0))
+            sketch, statusCounts = summary[key]
+
+            sketch.add(int(match.group('micro')))
+            statusClass = match.group('status')[:1].decode('ascii') + 'xx'
+            if statusClass in statusCounts:
+                statusCounts[statusClass] += 1
+
+    return summary
+
+
+def replay (paths, bucket = 'hour', timeline = None, processes = None, exact = False):
+    """
+    Summarises the logs in parallel and returns the merged rows of the report, sorted by time.
+    """
+    merged = {}
+    with ProcessPoolExecutor(max_workers = processes) as executor:
+        for summary in executor.map(summariseFile, paths, [bucket] * len(paths), [timeline or []] * len(paths), [exact] * len(paths)):
+            for key, (sketch, statusCounts) in summary.items():
+                if key in merged:
+                    merged[key][0].merge(sketch)
+                    for statusClass, count in statusCounts.items():
+                        merged[key][1][statusClass] += count
+                else:
+                    merged[key] = (sketch, statusCounts)
+
+    # Convert the bucket stamps once each
+    bucketTimes = {stamp: datetime.strptime(stamp.decode('ascii'), bucketFormats[bucket]) for stamp, endpoint, edition in merged}
+
+    rows = []
+    for (stamp, endpoint, edition), (sketch, statusCounts) in merged.items():
+        quantiles = sketch.quantiles((0.5, 0.9, 0.99))
+        rows.append([
+            bucketTimes[stamp].strftime('%Y-%m-%d %H:%M'),
+            endpoint,
+            edition,
+            sketch.count,
+            round(sketch.mean() / 1000),
+            math.ceil(quantiles[0.5] / 1000),
+            math.ceil(quantiles[0.9] / 1000),
+            math.ceil(quantiles[0.99] / 1000),
+            math.ceil(sketch.maximum / 1000),
+        ] + [statusCounts[statusClass] for statusClass in statusClasses])
+    rows.sort()
+    return rows
+
+
+def writeCsv (path, rows):
+    """
+    Writes the report as CSV.
+    """
+    with open(path, 'w', newline = '') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        writer.writerows(rows)
+
+
+def writeNpy (path, rows):
+    """
+    Writes the report as a NumPy structured array.
+    """
+    import numpy as np
+    dtype = [('bucket', 'datetime64[m]'), ('endpoint', 'U16'), ('edition', 'U32')] + [(column, 'i8') for column in columns[3:]]
+    np.save(path, np.array([(row[0].replace(' ', 'T'),) + tuple(row[1:]) for row in rows], dtype = dtype))
+
+
+def writeParquet (path, rows):
+    """
+    Writes the report as a Parquet file.
+    """
+    import pyarrow, pyarrow.parquet
+    table = pyarrow.table({column: [row[index] for row in rows] for index, column in enumerate(columns)})
+    pyarrow.parquet.write_table(table, path)
+
+
+# Main
+if __name__ == '__main__':
+
+    # Read args supplied to script
+    parser = argparse.ArgumentParser(description = 'Summarises API linger over historical access logs.')
+    parser.add_argument('--bucket', choices = sorted(bucketStampLengths), default = 'hour', help = 'Size of the time buckets')
+    parser.add_argument('--editions', help = 'Timeline of routing editions')
+    parser.add_argument('--exact', action = 'store_true', help = 'Keep every timing for exact percentiles, rather than estimates to within 1%%')
+    parser.add_argument('--processes', type = int, default = os.cpu_count(), help = 'Number of logs to process at once')
+    parser.add_argument('--npy', help = 'Also write a NumPy file')
+    parser.add_argument('--parquet', help = 'Also write a Parquet file')
+    parser.add_argument('output', help = 'CSV file to write')
+    parser.add_argument('logFiles', nargs = '+')
+    args = parser.parse_args()
+
+    # Check optional dependencies before the long run rather than after it
+    try:
+        if args.npy:
+            import numpy
+        if args.parquet:
+            import pyarrow
+    except ImportError as e:
+        parser.error('{} is needed for that output; install it with: sudo apt install python3-{}'.format(e.name, e.name))
+
+    timeline = readEditionTimeline(args.editions) if args.editions else None
+
+    rows = replay(args.logFiles, args.bucket, timeline, args.processes, args.exact)
+
+    writeCsv(args.output, rows)
+    if args.npy:
+        writeNpy(args.npy, rows)
+    if args.parquet:
+        writeParquet(args.parquet, rows)
+
+    # Trace
+    print('#\tWrote {:d} rows from {:d} logs'.format(len(rows), len(args.logFiles)))
+
+
+# End of file
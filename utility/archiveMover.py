@@ -0,0 +1,235 @@
+# Online mover of journeys from the cyclestreets database into the csArchive database.
+#
+# An alternative to closing the journey planner while repartitionIJS() moves the day's itineraries, journeys,
+# waypoints, streets, journey POIs and errors into their archive tables. The ids present when the mover starts set a
+# cutoff; routes planned after that stay where they are until the next run, so the planner stays live throughout.
+# Rows up to the cutoff are moved in small chunks of itinerary ids: each chunk is copied into the archive tables with
+# insert ignore, and then only those rows whose primary key is in the archive are deleted from the live tables, children
+# before their itinerary, so every route can be found in one place or the other at all times, and an interrupted run can
+# simply be repeated. A row added to the chunk between its copy and delete, such as another plan of an itinerary, is left
+# in place, and so is its itinerary, so both are moved by the next run.
+#
+# Between chunks the mover waits while replication lag or the load average is too high, and pauses in proportion
+# to the time each chunk took, to leave the live site room. Progress through the ids, rows moved per second and time
+# spent throttled are written to a JSON file after each chunk, and summarised on standard error, to help tune the chunk size.
+#
+# Synopsis
+#	archiveMover.py [--defaults-extra-file file] [--chunk-rows n] [--max-lag seconds] [--max-load n] [--duty fraction] [--progress file]
+#
+# Result
+#	Prints the lowest itinerary and error ids moved, as: minItineraryId minErrorId (NULL when there were none).
+#
+# Example
+# cyclestreets@veebee:$
+# python3 utility/archiveMover.py --defaults-extra-file ~/.mySuperUserCredentials.cnf --progress /tmp/archiveMover.json
+
+# Dependencies
+import sys, os, json, time, subprocess, argparse
+
+# Tables moved, as (live table, archive table, column relating it to the chunk), with the parent first
+itineraryTables = [
+    ('map_itinerary', 'map_itinerary_archive', 'id'),
+    ('map_waypoint', 'map_waypoint_archive', 'itineraryId'),
+    ('map_street', 'map_street_archive', 'itineraryId'),
+    ('map_jny_poi', 'map_jny_poi_archive', 'itineraryId'),
+    ('map_journey', 'map_journey_archive', 'itineraryId'),
+]
+errorTables = [
+    ('map_error', 'map_error_archive', 'id'),
+]
+
+class archiveMover ():
+    """
+    Moves rows into the archive in throttled chunks while the journey planner stays live.
+    """
+
+    def __init__(self):
+
+        # Databases
+        self.liveDatabase = 'cyclestreets'
+        self.archiveDatabase = 'csArchive'
+        self.defaultsExtraFile = None
+
+        # Ids per chunk
+        self.chunkRows = 2000
+
+        # Throttling: replication lag in seconds, load average per cpu, and the fraction of the time spent moving
+        self.maximumLag = 10
+        self.maximumLoad = 1.5
+        self.duty = 0.5
+
+        # Progress
+        self.progressFile = None
+        self.progress = {'table': None, 'ids': 0, 'totalIds': 0, 'moved': 0, 'rowsPerSecond': 0, 'throttledSeconds': 0, 'chunkRows': self.chunkRows}
+        self.started = time.time()
+
+        # Column lists shared by each live and archive table, and the primary key columns of each live table
+        self.columns = {}
+        self.keys = {}
+
+
+    def query (self, sql, vertical = False):
+        """
+        Runs statements and returns the rows as lists of strings.
+        """
+        command = ['mysql']
+        if self.defaultsExtraFile:
+            command.append('--defaults-extra-file=' + self.defaultsExtraFile)
+        command += ['-hlocalhost', '-N', '-B']
+        if vertical:
+            command.append('-E')
+        output = subprocess.run(command + [self.liveDatabase], input = sql, check = True, capture_output = True, text = True).stdout
+        if vertical:
+            return output
+        return [line.split('\t') for line in output.splitlines()]
+
+
+    def value (self, sql):
+        """
+        Returns a single value, as an int or None.
+        """
+        rows = self.query(sql)
+        return None if not rows or rows[0][0] == 'NULL' else int(rows[0][0])
+
+
+    def sharedColumns (self, live, archive):
+        """
+        Returns the quoted column list common to a live table and its archive.
+        """
+        sql = "select table_schema, column_name from information_schema.columns where (table_schema = '{}' and table_name = '{}') or (table_schema = '{}' and table_name = '{}') order by ordinal_position"
+        rows = self.query(sql.format(self.liveDatabase, live, self.archiveDatabase, archive))
+        archived = set(column for schema, column in rows if schema == self.archiveDatabase)
+        return ', '.join('`{}`'.format(column) for schema, column in rows if schema == self.liveDatabase and column in archived)
+
+
+    def primaryKey (self, live):
+        """
+        Returns the primary key columns of a live table.
+        """
+        rows = self.query("select column_name from information_schema.statistics where table_schema = '{}' and table_name = '{}' and index_name = 'PRIMARY' order by seq_in_index".format(self.liveDatabase, live))
+        if not rows:
+            raise RuntimeError('The table {}.{} has no primary key by which to match its archived rows'.format(self.liveDatabase, live))
+        return [row[0] for row in rows]
+
+
+    def replicationLag (self):
+        """
+        Returns the replication lag in seconds, or zero when this server is not a replica.
+        """
+        try:
+            output = self.query('show replica status;', vertical = True)
+        except subprocess.CalledProcessError:
+            output = self.query('show slave status;', vertical = True)
+        for line in output.splitlines():
+            name, separator, value = line.strip().partition(': ')
+            if name in ('Seconds_Behind_Source', 'Seconds_Behind_Master'):
+                return int(value) if value.isdigit() else 0
+        return 0
+
+
+    def throttle (self, chunkSeconds):
+        """
+        Pauses in proportion to the chunk's time, then while the server is lagging or busy.
+        """
+        started = time.time()
+        time.sleep(chunkSeconds * (1 - self.duty) / self.duty)
+        while self.replicationLag() > self.maximumLag or os.getloadavg()[0] > self.maximumLoad * (os.cpu_count() or 1):
+            time.sleep(1)
+        self.progress['throttledSeconds'] = round(self.progress['throttledSeconds'] + time.time() - started, 1)
+
+
+    def report (self):
+        """
+        Writes the progress file.
+        """
+        elapsed = time.time() - self.started - self.progress['throttledSeconds']
+        self.progress['rowsPerSecond'] = round(self.progress['moved'] / elapsed) if elapsed > 0 else 0
+        if self.progressFile:
+            temporary = self.progressFile + '.tmp'
+            with open(temporary, 'w') as f:
+                json.dump(self.progress, f)
+            os.replace(temporary, self.progressFile)
+
+
+    def moveChunk (self, tables, start, end):
+        """
+        Copies the rows of one chunk of ids into the archive, then removes them from the live tables; returns the rows moved.
+        """
+        where = '`{0}` >= {1:d} and `{0}` < {2:d}'
+        statements = []
+        for live, archive, column in tables:
+            columns = self.columns[live]
+            statements.append('insert ignore into `{}`.`{}` ({}) select {} from `{}` where {};'.format(self.archiveDatabase, archive, columns, columns, live, where.format(column, start, end)))
+            statements.append('select row_count();')
+
+        # Remove only rows now in the archive, children before their parent, and a parent only once it has no children left
+        parent, parentArchive, parentColumn = tables[0]
+        for live, archive, column in reversed(tables):
+            matched = ' and '.join('a.`{0}` = l.`{0}`'.format(key) for key in self.keys[live])
+            orphaned = ''.join(' and not exists (select 1 from `{}` c where c.`{}` = l.`{}`)'.format(child, childColumn, parentColumn) for child, childArchive, childColumn in tables[1:]) if live == parent else ''
+            inChunk = 'l.`{0}` >= {1:d} and l.`{0}` < {2:d}'.format(column, start, end)
+            statements.append('delete l from `{}` l join `{}`.`{}` a on {} where {}{};'.format(live, self.archiveDatabase, archive, matched, inChunk, orphaned))
+
+        # Rows copied by each insert; rows already archived by an interrupted run are not counted again
+        return sum(max(0, int(row[0])) for row in self.query('\n'.join(statements)))
+
+
+    def move (self, tables):
+        """
+        Moves the rows of a group of tables up to the cutoff taken now; returns the lowest id moved, or None.
+        """
+        parent, parentArchive, column = tables[0]
+        for live, archived, related in tables:
+            self.columns[live] = self.sharedColumns(live, archived)
+            self.keys[live] = self.primaryKey(live)
+
+        # Cutoff: rows added from now on wait for the next run
+        minimum = self.value('select min(`{}`) from `{}`;'.format(column, parent))
+        cutoff = self.value('select max(`{}`) from `{}`;'.format(column, parent))
+        if minimum is None:
+            return None
+
+        self.progress.update({'table': parent, 'totalIds': self.progress['totalIds'] + cutoff - minimum + 1, 'chunkRows': self.chunkRows})
+        start = minimum
+        while start <= cutoff:
+            end = min(start + self.chunkRows, cutoff + 1)
+            chunkStarted = time.time()
+            self.progress['moved'] += self.moveChunk(tables, start, end)
+            self.progress['ids'] += end - start
+            self.report()
+            self.throttle(time.time() - chunkStarted)
+            start = end
+        return minimum
+
+
+# Main
+if __name__ == '__main__':
+
+    # Read args supplied to script
+    parser = argparse.ArgumentParser(description = 'Moves journeys into the archive while the journey planner stays live.')
+    parser.add_argument('--defaults-extra-file', dest = 'defaultsExtraFile', help = 'MySQL super user credentials')
+    parser.add_argument('--chunk-rows', dest = 'chunkRows', type = int, default = 2000, help = 'Itinerary ids moved per chunk')
+    parser.add_argument('--max-lag', dest = 'maximumLag', type = int, default = 10, help = 'Replication lag in seconds above which to wait')
+    parser.add_argument('--max-load', dest = 'maximumLoad', type = float, default = 1.5, help = 'Load average per cpu above which to wait')
+    parser.add_argument('--duty', type = float, default = 0.5, help = 'Fraction of the time spent moving rather than pausing')
+    parser.add_argument('--progress', dest = 'progressFile', help = 'JSON file of progress and rows per second')
+    args = parser.parse_args()
+
+    mover = archiveMover()
+    mover.defaultsExtraFile = args.defaultsExtraFile
+    mover.chunkRows = args.chunkRows
+    mover.maximumLag = args.maximumLag
+    mover.maximumLoad = args.maximumLoad
+    mover.duty = min(1, max(0.05, args.duty))
+    mover.progressFile = args.progressFile
+
+    minItineraryId = mover.move(itineraryTables)
+    minErrorId = mover.move(errorTables)
+    mover.report()
+
+    # Summary for the log on standard error, the ids for the caller on standard output
+    print('#\tMoved {:d} rows in {:.0f}s, {:d} rows per second, throttled for {:.0f}s'.format(mover.progress['moved'], time.time() - mover.started, mover.progress['rowsPerSecond'], mover.progress['throttledSeconds']), file = sys.stderr)
+    print('{} {}'.format('NULL' if minItineraryId is None else minItineraryId, 'NULL' if minErrorId is None else minErrorId))
+
+
+# End of file
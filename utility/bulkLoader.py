@@ -0,0 +1,272 @@
+# Bulk loader for the TSV tables of the routing, planet and external databases.
+#
+# Loads a set of TSV files, each into the table of the same name, with the indexes deferred until the data is in:
+# MyISAM tables have their indexes turned off by myisamchk and rebuilt by sorting after the load, as in the sequence at
+# https://dev.mysql.com/doc/refman/8.4/en/optimizing-myisam-bulk-data-loading.html
+# while other engines have their secondary indexes dropped and added back in one alter table after the load. Indexes
+# that could not be added back as they were, being needed by a foreign key or having descending or functional key
+# parts, are left in place and maintained during the load.
+# The data is loaded in one statement per table with unique and foreign key checks off.
+#
+# Tables are loaded by a pool of workers, largest first so the longest loads are not left until last. The memory for the
+# index rebuilds, including the read and write buffers, is shared between the workers, and each table's sort buffer is
+# sized to the table rather than the maximum.
+# A load profile giving the rows, bytes and seconds of each table is reported, and optionally written as JSON.
+#
+# The files are removed as each is loaded, unless --keep is given.
+#
+# Synopsis
+#	bulkLoader.py [--defaults-extra-file file] [--workers n] [--mysql-folder folder] [--profile file] [--keep] database tsvFile [tsvFile ...]
+#
+# Example
+# cyclestreets@veebee:$
+# python3 utility/bulkLoader.py --defaults-extra-file ~/.mySuperUserCredentials.cnf --profile /websites/www/content/data/routing/routing241010/loadProfile.planet241010.json planet241010 /var/lib/mysql-files/routing241010/planet/*.tsv
+
+# Dependencies
+import sys, os, json, time, threading, subprocess, argparse
+from concurrent.futures import ThreadPoolExecutor
+
+# Bounds of the buffers for each myisamchk index rebuild
+minimumBufferBytes = 64 * 1024 * 1024
+maximumSortBufferBytes = 1024 * 1024 * 1024
+minimumReadWriteBufferBytes = 8 * 1024 * 1024
+
+class bulkLoader ():
+    """
+    Loads TSV files into the tables of a database, deferring the indexes until after the data.
+    """
+
+    def __init__(self, database):
+
+        # Database loaded into
+        self.database = database
+
+        # Options, as the shell scripts use them
+        self.defaultsExtraFile = None
+        self.mysqlFolder = '/var/lib/mysql/'
+        self.keep = False
+
+        # One table per worker; a table's load and index rebuild are sequential but tables proceed in parallel
+        self.workers = os.cpu_count() or 4
+
+        # Total memory for the myisamchk index rebuilds, shared between the workers
+        self.keyBufferBytes = 12 * 1024 * 1024 * 1024
+        self.sortBufferBytes = 4 * 1024 * 1024 * 1024
+        self.readWriteBufferBytes = 1024 * 1024 * 1024
+
+        # Load profile, as a dict per table in the order they finished, guarded by the lock as they are added from several threads
+        self.profile = []
+        self.lock = threading.Lock()
+
+
+    def mysql (self):
+        """
+        Returns the start of a mysql command on the database; the defaults-extra-file is a positional argument which must come first.
+        """
+        command = ['mysql']
+        if self.defaultsExtraFile:
+            command.append('--defaults-extra-file=' + self.defaultsExtraFile)
+        return command + ['-hlocalhost', '-N', '-B', self.database]
+
+
+    def query (self, sql):
+        """
+        Runs statements and returns the rows as lists of strings.
+        """
+        output = subprocess.run(self.mysql(), input = sql, check = True, capture_output = True, text = True).stdout
+        return [line.split('\t') for line in output.splitlines()]
+
+
+    def engine (self, table):
+        """
+        Returns the storage engine of a table.
+        """
+        rows = self.query("select engine from information_schema.tables where table_schema = '{}' and table_name = '{}';".format(self.database, table))
+        if not rows:
+            raise RuntimeError('There is no table {}.{} to load'.format(self.database, table))
+        return rows[0][0]
+
+
+    def flushTable (self, table):
+        """
+        Flushes one table; a general flush tables can be costly on a busy server.
+        """
+        self.query('flush table `{}`.`{}`;'.format(self.database, table))
+
+
+    def myisamchk (self, table, options):
+        """
+        Runs myisamchk on a table, niced to favour other processes on the live site; requires passwordless sudo.
+        """
+        command = ['sudo', 'nice', 'myisamchk']
+        if self.defaultsExtraFile:
+            command.append('--defaults-extra-file=' + self.defaultsExtraFile)
+        subprocess.run(command + options + [self.mysqlFolder + self.database + '/' + table], check = True, stdout = subprocess.DEVNULL)
+
+
+    def buffers (self, size):
+        """
+        Returns the key, sort, and read and write buffer sizes for rebuilding the indexes of a table loaded from size bytes of data.
+        """
+        keyBuffer = max(minimumBufferBytes, self.keyBufferBytes // self.workers)
+        sortBuffer = min(maximumSortBufferBytes, self.sortBufferBytes // self.workers)
+        readWriteBuffer = max(minimumReadWriteBufferBytes, self.readWriteBufferBytes // self.workers)
+
+        # The keys sorted are smaller than the data, so a small table needs no more than its size
+        sortBuffer = max(minimumBufferBytes, min(sortBuffer, size))
+        return keyBuffer, sortBuffer, readWriteBuffer
+
+
+    def foreignKeyColumns (self, table):
+        """
+        Returns the column lists of the foreign keys of a table and of those referencing it, each of which needs an index.
+        """
+        rows = self.query("select constraint_schema, constraint_name, table_schema = '{0}' and table_name = '{1}', column_name,"
+            " referenced_table_schema = '{0}' and referenced_table_name = '{1}', referenced_column_name from information_schema.key_column_usage"
+            " where referenced_table_name is not null and ((table_schema = '{0}' and table_name = '{1}') or (referenced_table_schema = '{0}' and referenced_table_name = '{1}'))"
+            " order by constraint_schema, constraint_name, ordinal_position;".format(self.database, table))
+        keys = {}
+        for schema, constraint, referencing, column, referenced, referencedColumn in rows:
+            if referencing == '1':
+                keys.setdefault((schema, constraint, 'referencing'), []).append(column)
+            if referenced == '1':
+                keys.setdefault((schema, constraint, 'referenced'), []).append(referencedColumn)
+        return list(keys.values())
+
+
+    def secondaryIndexes (self, table):
+        """
+        Returns the definitions of a table's secondary indexes that can be dropped and added back as they were, as used by alter table add.
+        """
+        rows = self.query("select index_name, non_unique, index_type, column_name, sub_part, collation, expression from information_schema.statistics"
+            " where table_schema = '{}' and table_name = '{}' and index_name != 'PRIMARY' order by index_name, seq_in_index;".format(self.database, table))
+
+        indexes = {}
+        unfaithful = set()
+        for name, nonUnique, indexType, column, subPart, collation, expression in rows:
+            kind = 'unique index' if nonUnique == '0' else 'index'
+            if indexType in ('FULLTEXT', 'SPATIAL'):
+                kind = indexType.lower() + ' index'
+            definition = indexes.setdefault(name, {'kind': kind, 'columns': [], 'names': []})
+            definition['columns'].append('`{}`'.format(column) + ('' if subPart == 'NULL' else '({})'.format(subPart)))
+            definition['names'].append(column)
+
+            # Descending and functional key parts are not recreated by this definition
+            if collation == 'D' or expression != 'NULL':
+                unfaithful.add(name)
+
+        # An index that a foreign key relies on cannot be dropped
+        for columns in self.foreignKeyColumns(table):
+            unfaithful.update(name for name, index in indexes.items() if index['names'][:len(columns)] == columns)
+
+        return {name: '{} `{}` ({})'.format(index['kind'], name, ', '.join(index['columns'])) for name, index in indexes.items() if name not in unfaithful}
+
+
+    def loadData (self, table, tsv):
+        """
+        Loads the file into the table in one statement, with unique and foreign key checks off; returns the rows loaded.
+        """
+        statements = [
+            'set unique_checks = 0;',
+            'set foreign_key_checks = 0;',
+            "load data infile '{}' into table `{}`;".format(tsv.replace('\\', '\\\\').replace("'", "\\'"), table),
+            'select row_count();',
+            'commit;',
+        ]
+        return int(self.query('\n'.join(statements))[0][0])
+
+
+    def loadTable (self, tsv):
+        """
+        Loads a table, deferring its indexes, then removes the TSV unless keeping it.
+        """
+        table = os.path.basename(tsv)[:-len('.tsv')]
+        size = os.path.getsize(tsv)
+        myisam = self.engine(table) == 'MyISAM'
+
+        # Turn off the indexes
+        started = time.time()
+        if myisam:
+            self.flushTable(table)
+            self.myisamchk(table, ['--keys-used=0'])
+        else:
+            indexes = self.secondaryIndexes(table)
+            if indexes:
+                self.query('alter table `{}` {};'.format(table, ', '.join('drop index `{}`'.format(name) for name in indexes)))
+
+        # Load
+        rows = self.loadData(table, tsv)
+        loaded = time.time()
+
+        # Rebuild the indexes as soon as this table has loaded
+        if myisam:
+
+            # The quick option modifies only the index not the data
+            keyBuffer, sortBuffer, readWriteBuffer = self.buffers(size)
+            self.myisamchk(table, ['--myisam_sort_buffer_size={:d}'.format(sortBuffer), '--key_buffer_size={:d}'.format(keyBuffer), '--read_buffer_size={:d}'.format(readWriteBuffer), '--write_buffer_size={:d}'.format(readWriteBuffer), '--recover', '--quick'])
+            self.flushTable(table)
+        elif indexes:
+            self.query('alter table `{}` {};'.format(table, ', '.join('add ' + definition for definition in indexes.values())))
+
+        with self.lock:
+            self.profile.append({'table': table, 'rows': rows, 'bytes': size, 'loadSeconds': round(loaded - started, 1), 'indexSeconds': round(time.time() - loaded, 1)})
+
+        if not self.keep:
+            os.unlink(tsv)
+
+
+    def load (self, tsvs):
+        """
+        Loads the files, largest first across the workers.
+        """
+        tsvs = sorted(tsvs, key = os.path.getsize, reverse = True)
+        with ThreadPoolExecutor(max_workers = self.workers) as executor:
+            for result in [executor.submit(self.loadTable, tsv) for tsv in tsvs]:
+                result.result()
+
+
+    def writeProfile (self, path):
+        """
+        Writes the load profile as JSON.
+        """
+        with open(path, 'w') as f:
+            json.dump({'database': self.database, 'workers': self.workers, 'tables': self.profile}, f, indent = 1)
+
+
+    def report (self):
+        """
+        Prints the load profile, slowest first.
+        """
+        for entry in sorted(self.profile, key = lambda entry: entry['loadSeconds'] + entry['indexSeconds'], reverse = True):
+            print('#\t{:<40} {:12,d} rows {:10.1f}MB  load {:8.1f}s  indexes {:8.1f}s'.format(entry['table'], entry['rows'], entry['bytes'] / 1e6, entry['loadSeconds'], entry['indexSeconds']))
+
+
+# Main
+if __name__ == '__main__':
+
+    # Read args supplied to script
+    parser = argparse.ArgumentParser(description = 'Bulk loads TSV files into a database, deferring the indexes.')
+    parser.add_argument('--defaults-extra-file', dest = 'defaultsExtraFile', help = 'MySQL super user credentials')
+    parser.add_argument('--workers', type = int, default = os.cpu_count(), help = 'Number of tables loaded at once')
+    parser.add_argument('--mysql-folder', dest = 'mysqlFolder', default = '/var/lib/mysql/', help = 'MySQL data folder, for myisamchk')
+    parser.add_argument('--profile', dest = 'profileFile', help = 'JSON file to which the load profile is written')
+    parser.add_argument('--keep', action = 'store_true', help = 'Keep the TSV files after loading them')
+    parser.add_argument('-q', dest = 'quiet', action = 'store_true', help = 'Do not report the load profile')
+    parser.add_argument('database')
+    parser.add_argument('tsvs', nargs = '+')
+    args = parser.parse_args()
+
+    loader = bulkLoader(args.database)
+    loader.defaultsExtraFile = args.defaultsExtraFile
+    loader.workers = args.workers
+    loader.mysqlFolder = args.mysqlFolder
+    loader.keep = args.keep
+
+    loader.load(args.tsvs)
+    if args.profileFile:
+        loader.writeProfile(args.profileFile)
+    if not args.quiet:
+        loader.report()
+
+
+# End of file
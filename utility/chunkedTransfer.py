@@ -0,0 +1,298 @@
+# Resumable, chunked and parallel transfer of large files, such as the dumps written by dump-recent.sh, over ssh.
+#
+# The publishing host writes a chunk manifest next to the file, giving its size, md5 and a BLAKE2 hash of each
+# fixed size chunk. The fetching host reads the manifest and then fetches the chunks as byte ranges over several
+# ssh connections at once, verifying each chunk as it arrives and writing it into place in a partial file.
+# The chunks that have been verified are recorded, so after a dropped connection a re-run fetches only those missing.
+# Once complete the file is moved into place and the legacy .md5 is written from the manifest, so the whole file need
+# not be read again to check it.
+#
+# Synopsis
+#	chunkedTransfer.py --manifest [--chunk-mb n] [--md5 openssl|md5sum|none] file
+#	chunkedTransfer.py [--port p] [--channels n] [--md5 openssl|md5sum|none] server remoteFile localFolder
+#
+# Result
+#	When fetching, exits with status 3 if there is no manifest for the remote file, so the caller can fall back to a plain copy,
+#	with 1 if the transfer is incomplete, and with 2 if the arguments are not valid.
+#
+# Example
+# cyclestreets@backup:$
+# python3 utility/chunkedTransfer.py --md5 openssl www.cyclestreets.net /websites/www/backups/www_cyclestreets.sql.gz /websites/www/backups
+
+# Dependencies
+import sys, os, json, time, hashlib, threading, subprocess, argparse
+from concurrent.futures import ThreadPoolExecutor
+
+# Suffixes of the manifest and of the partial file and its record of verified chunks
+manifestSuffix = '.chunks'
+partialSuffix = '.part'
+progressSuffix = '.part.done'
+
+# Exit status when the remote file has no manifest
+noManifest = 3
+
+def chunkHash (data):
+    """
+    Returns the hash of a chunk, as used in the manifest.
+    """
+    return hashlib.blake2b(data, digest_size = 16).hexdigest()
+
+
+def legacyMd5 (path, md5, md5Format):
+    """
+    Returns the contents of a legacy .md5 file, in the format written by either openssl dgst -md5 or md5sum.
+    """
+    if md5Format == 'openssl':
+        return 'MD5({})= {}\n'.format(path, md5)
+    return '{}  {}\n'.format(md5, os.path.basename(path))
+
+
+def writeAtomically (path, contents):
+    """
+    Writes a small file, replacing it atomically.
+    """
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as f:
+        f.write(contents)
+    os.replace(temporary, path)
+
+
+class manifestWriter ():
+    """
+    Builds a manifest from a file's contents as they are written or read, so the file need not be read again.
+    """
+
+    def __init__(self, chunkBytes = 64 * 1024 * 1024):
+        self.chunkBytes = chunkBytes
+        self.md5 = hashlib.md5()
+        self.chunks = []
+        self.size = 0
+
+        # Bytes of the chunk in progress
+        self.pending = bytearray()
+
+
+    def update (self, data):
+        """
+        Adds the next data of the file.
+        """
+        self.md5.update(data)
+        self.size += len(data)
+        self.pending += data
+        while len(self.pending) >= self.chunkBytes:
+            self.chunks.append(chunkHash(bytes(self.pending[:self.chunkBytes])))
+            del self.pending[:self.chunkBytes]
+
+
+    def write (self, path, md5Format = 'none'):
+        """
+        Writes the manifest for the completed file at path, and optionally its legacy .md5.
+        """
+        if self.pending:
+            self.chunks.append(chunkHash(bytes(self.pending)))
+            self.pending = bytearray()
+
+        manifest = {
+            'size': self.size,
+            'mtime': int(os.stat(path).st_mtime),
+            'chunkBytes': self.chunkBytes,
+            'hash': 'blake2b-128',
+            'md5': self.md5.hexdigest(),
+            'chunks': self.chunks,
+        }
+
+        # The manifest is written first, as fetchers take a fresh .md5 to mean the file is ready
+        writeAtomically(path + manifestSuffix, json.dumps(manifest))
+        if md5Format != 'none':
+            writeAtomically(path + '.md5', legacyMd5(path, manifest['md5'], md5Format))
+        return manifest
+
+
+def writeManifest (path, chunkBytes = 64 * 1024 * 1024, md5Format = 'none'):
+    """
+    Writes the manifest for a file, and optionally its legacy .md5, reading the file once.
+    """
+    writer = manifestWriter(chunkBytes)
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunkBytes)
+            if not chunk:
+                break
+            writer.update(chunk)
+    return writer.write(path, md5Format)
+
+
+class chunkedTransfer ():
+    """
+    Fetches a file from a remote host as verified chunks over parallel ssh connections.
+    """
+
+    def __init__(self, server, remoteFile, localFolder):
+
+        # Source
+        self.server = server
+        self.remoteFile = remoteFile
+
+        # Destination
+        self.localFile = os.path.join(localFolder, os.path.basename(remoteFile))
+
+        # Options
+        self.sshPort = None
+        self.channels = 4
+        self.retries = 3
+
+        # Manifest of the remote file
+        self.manifest = None
+
+        # Chunks verified so far, guarded by the lock as they are recorded from several threads
+        self.done = set()
+        self.lock = threading.Lock()
+
+
+    def ssh (self, command):
+        """
+        Runs a command on the remote host, returning its output as bytes.
+        """
+        ssh = ['ssh', '-o', 'BatchMode=yes']
+        if self.sshPort:
+            ssh.append('-p' + self.sshPort)
+        return subprocess.run(ssh + [self.server, command], check = True, capture_output = True).stdout
+
+
+    def remoteManifest (self):
+        """
+        Returns the manifest published with the remote file, or None if there is none.
+        """
+        try:
+            return json.loads(self.ssh('cat ' + self.remoteFile + manifestSuffix))
+        except (subprocess.CalledProcessError, ValueError):
+            return None
+
+
+    def readProgress (self, manifest):
+        """
+        Reads the chunks verified by an earlier run, provided it was fetching the same version of the file.
+        """
+        try:
+            with open(self.localFile + progressSuffix) as f:
+                progress = json.load(f)
+        except (OSError, ValueError):
+            return
+        if progress.get('md5') == manifest['md5'] and os.path.exists(self.localFile + partialSuffix):
+            self.done = set(progress['done'])
+
+
+    def writeProgress (self, manifest):
+        """
+        Records the chunks verified so far; called with the lock held.
+        """
+        writeAtomically(self.localFile + progressSuffix, json.dumps({'md5': manifest['md5'], 'done': sorted(self.done)}))
+
+
+    def fetchChunk (self, manifest, descriptor, index):
+        """
+        Fetches, verifies and writes one chunk.
+        """
+        chunkBytes = manifest['chunkBytes']
+        offset = index * chunkBytes
+        length = min(chunkBytes, manifest['size'] - offset)
+        command = 'dd if={} bs=1M skip={:d} count={:d} iflag=skip_bytes,count_bytes status=none'.format(self.remoteFile, offset, length)
+
+        for attempt in range(self.retries):
+            try:
+                data = self.ssh(command)
+            except subprocess.CalledProcessError:
+                time.sleep(2 ** attempt)
+                continue
+
+            if len(data) == length and chunkHash(data) == manifest['chunks'][index]:
+                os.pwrite(descriptor, data, offset)
+                with self.lock:
+                    self.done.add(index)
+                    self.writeProgress(manifest)
+                return True
+
+        return False
+
+
+    def fetch (self):
+        """
+        Fetches the file, resuming an earlier attempt. Returns True when it is complete, None if there is no manifest.
+        """
+        manifest = self.manifest = self.remoteManifest()
+        if manifest is None:
+            return None
+
+        # Already fetched
+        try:
+            with open(self.localFile + manifestSuffix) as f:
+                if json.load(f) == manifest and os.path.getsize(self.localFile) == manifest['size']:
+                    return True
+        except (OSError, ValueError):
+            pass
+
+        self.readProgress(manifest)
+        missing = [index for index in range(len(manifest['chunks'])) if index not in self.done]
+
+        partial = self.localFile + partialSuffix
+        descriptor = os.open(partial, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(descriptor, manifest['size'])
+            with ThreadPoolExecutor(max_workers = self.channels) as executor:
+                fetched = list(executor.map(lambda index: self.fetchChunk(manifest, descriptor, index), missing))
+            os.fsync(descriptor)
+        finally:
+            os.close(descriptor)
+
+        # Leave the partial file and progress for the next attempt
+        if not all(fetched):
+            return False
+
+        # Move into place, preserving the modification time as scp -p and rsync -t do
+        os.replace(partial, self.localFile)
+        os.utime(self.localFile, (manifest['mtime'], manifest['mtime']))
+        writeAtomically(self.localFile + manifestSuffix, json.dumps(manifest))
+        try:
+            os.unlink(self.localFile + progressSuffix)
+        except FileNotFoundError:
+            pass
+        return True
+
+
+# Main
+if __name__ == '__main__':
+
+    # Read args supplied to script
+    parser = argparse.ArgumentParser(description = 'Resumable, chunked and parallel transfer of large files over ssh.')
+    parser.add_argument('--manifest', action = 'store_true', help = 'Write the manifest for a local file, rather than fetch')
+    parser.add_argument('--chunk-mb', dest = 'chunkMb', type = int, default = 64, help = 'Size of the chunks in the manifest')
+    parser.add_argument('--md5', choices = ('openssl', 'md5sum', 'none'), default = 'none', help = 'Also write a legacy .md5 in this format')
+    parser.add_argument('--port', help = 'Port for ssh connections')
+    parser.add_argument('--channels', type = int, default = 4, help = 'Number of chunks fetched at once')
+    parser.add_argument('files', nargs = '+', help = 'file, or: server remoteFile localFolder')
+    args = parser.parse_args()
+
+    if args.manifest:
+        if len(args.files) != 1:
+            parser.error('--manifest takes one file')
+        writeManifest(args.files[0], args.chunkMb * 1024 * 1024, args.md5)
+        sys.exit(0)
+
+    if len(args.files) != 3:
+        parser.error('fetching needs: server remoteFile localFolder')
+
+    transfer = chunkedTransfer(*args.files)
+    transfer.sshPort = args.port
+    transfer.channels = args.channels
+
+    result = transfer.fetch()
+    if result is None:
+        sys.exit(noManifest)
+    if not result:
+        print('#\tIncomplete transfer of {} from {}, re-run to resume'.format(args.files[1], args.files[0]), file = sys.stderr)
+        sys.exit(1)
+    if args.md5 != 'none':
+        writeAtomically(transfer.localFile + '.md5', legacyMd5(transfer.localFile, transfer.manifest['md5'], args.md5))
+
+
+# End of file
@@ -122,19 +122,43 @@ then
     exit 1
 fi
 
-#	Download the md5, preserving timing data
-#	The -p tries to set the mode of the file, which will require the right permissions
-scp -p ${server}:${md5} ${folder}
-#	Log
-echo "$(date --iso-8601=seconds)	Fetched ${md5}" >> $log
-
+#	Download the main file as verified chunks over parallel connections, when the server publishes a chunk manifest.
+#	This resumes an interrupted download and writes the md5 from the manifest, so the dump need not be re-read to check it.
+chunkedTransfer=$(dirname $0)/chunkedTransfer.py
+python3 ${chunkedTransfer} --md5 openssl ${server} ${dump} ${folder}
+chunked=$?
+
+#	Abandon a download that failed part way, which re-running resumes, or that could not be started; 3 means there is no manifest
+if [ $chunked != 0 -a $chunked != 3 ]
+then
+    logAndEmail "The chunked download of ${dump} did not complete, stopping."
+    exit 1
+fi
 
-#	Download the main file
-# scp -p ${server}:${dump} ${folder}
-#	Use rsync instead...
-rsync -t ${server}:${dump} ${folder}
 #	Log
-echo "$(date --iso-8601=seconds)	Fetched ${dump}" >> $log
+if [ $chunked = 0 ]
+then
+    echo "$(date --iso-8601=seconds)	Fetched ${dump} in chunks" >> $log
+else
+
+    #	Download the md5, preserving timing data
+    #	The -p tries to set the mode of the file, which will require the right permissions
+    scp -p ${server}:${md5} ${folder}
+    #	Log
+    echo "$(date --iso-8601=seconds)	Fetched ${md5}" >> $log
+
+
+    #	Download the main file
+    # scp -p ${server}:${dump} ${folder}
+    #	Use rsync instead...
+    rsync -t ${server}:${dump} ${folder}
+    #	Log
+    echo "$(date --iso-8601=seconds)	Fetched ${dump}" >> $log
+fi
+
+#	Download the parts manifest, if there is one, used to restore the dump in parallel; a stale one is removed first
+rm -f ${dump}.parts
+scp -p ${server}:${dump}.parts ${folder} > /dev/null 2>&1
 
 #	The dump must be readable
 if [ ! -r ${dump} ]
@@ -150,8 +174,8 @@ then
     exit 1
 fi
 
-#	Check the md5 matches
-if [ "$(openssl dgst -md5 ${dump})" != "$(cat ${md5})" ]
+#	Check the md5 matches, unless every chunk has already been verified
+if [ $chunked != 0 -a "$(openssl dgst -md5 ${dump})" != "$(cat ${md5})" ]
 then
     logAndEmail "The md5 checksum for dump: ${dump} does not match, stopping."
     exit 1
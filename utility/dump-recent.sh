@@ -11,6 +11,11 @@
 # The defaults-extra-file is a positional argument which must come first.
 superMysql="mysql --defaults-extra-file=${mySuperCredFile} -hlocalhost"
 
+# Dumps tables in parallel into one compressed file, writing the md5 (in the format of openssl dgst -md5) as it goes,
+# with manifests of the chunks for resumable downloads and of the parts for parallel restores.
+# The plan of what to dump is read from standard input as tab-separated lines of: database tables where
+parallelDump="python3 ${SCRIPTDIRECTORY}/../utility/parallelDump.py --defaults-extra-file ${mySuperCredFile}"
+
 # The minimum itinerary id can be used as the handle for a batch of routes.
 # Mysql options: N skips column names, s avoids the ascii-art, e introduces the query.
 minItineraryId=$(${superMysql} cyclestreets -Nse "select min(id) from map_itinerary")
@@ -22,6 +27,20 @@ if [ "${minItineraryId}" = "NULL" ]; then
     echo "$(date --iso-8601=seconds)	No new routes, so skipping repartition." >> ${setupLogFile}
 
 else
+    if [ -n "${onlineArchiveMover}" ]; then
+
+	#	Move the latest routes to the archive in small chunks, keeping the journey planner live; progress and rows per second are in the json file
+	echo "$(date --iso-8601=seconds)	Archive batch: ${minItineraryId}, keeping the site open to routing." >> ${setupLogFile}
+	if ! moved=$(python3 ${SCRIPTDIRECTORY}/../utility/archiveMover.py --defaults-extra-file ${mySuperCredFile} --progress ${websitesLogsFolder}/archiveMover.json 2>> ${setupLogFile})
+	then
+	    echo "$(date --iso-8601=seconds)	The archive mover failed, so abandoning the dump of batch: ${minItineraryId}." >> ${setupLogFile}
+	    exit 1
+	fi
+	read movedItineraryId minErrorId <<< "${moved}"
+	echo "$(date --iso-8601=seconds)	Archived batch: ${minItineraryId}." >> ${setupLogFile}
+
+    else
+
     #	Repartition latest routes
     echo "$(date --iso-8601=seconds)	Repartition batch: ${minItineraryId}. Now closing site to routing." >> ${setupLogFile}
 
@@ -41,61 +60,53 @@ else
     #	Notify re-opened
     echo "$(date --iso-8601=seconds)	Re-opened site to routing." >> ${setupLogFile}
 
+    # End of archiving
+    fi
+
     #	Archive the IJS tables
     dump=${websitesBackupsFolder}/recentroutes/${dumpPrefix}_routes_${minItineraryId}.sql.gz
     
     #	Skip disable keys because re-enabling them takes a long time on the archive
-    dumpOptions="--defaults-extra-file=${mySuperCredFile} -hlocalhost --no-create-db --no-create-info --insert-ignore --skip-triggers --skip-disable-keys --hex-blob"
+    dumpOptions="--no-create-db --no-create-info --insert-ignore --skip-triggers --skip-disable-keys --hex-blob"
 
-    # Dump itinerary
-    mysqldump ${dumpOptions} csArchive map_itinerary_archive --where="id>=${minItineraryId}" | gzip > ${dump}
-
-    # Append the other tables (different where)
-    mysqldump ${dumpOptions} csArchive map_waypoint_archive map_street_archive map_jny_poi_archive --where="itineraryId>=${minItineraryId}" | gzip >> ${dump}
-
-    # Append the journey archive table avoiding rows with invalid geometry
-    mysqldump ${dumpOptions} csArchive map_journey_archive --where="itineraryId>=${minItineraryId} and st_isvalid(routePoints) = 1" | gzip >> ${dump}
+    # Plan: the itinerary, waypoint, street and poi archive tables, then the journey archive avoiding rows with invalid geometry
+    plan="csArchive\tmap_itinerary_archive\tid>=${minItineraryId}"
+    plan+="\ncsArchive\tmap_waypoint_archive map_street_archive map_jny_poi_archive\titineraryId>=${minItineraryId}"
+    plan+="\ncsArchive\tmap_journey_archive\titineraryId>=${minItineraryId} and st_isvalid(routePoints) = 1"
 
     # Append the error table
     if [ "${minErrorId}" != "NULL" ]; then
-	mysqldump ${dumpOptions} csArchive map_error_archive --where="id>=${minErrorId}" | gzip >> ${dump}
+	plan+="\ncsArchive\tmap_error_archive\tid>=${minErrorId}"
     fi
 
+    # Dump, with the large itinerary and journey archives in ranges of their itinerary ids
+    echo -e "${plan}" | ${parallelDump} --options="${dumpOptions}" --split map_itinerary_archive=id --split map_journey_archive=itineraryId ${dump}
+
     #	Notify dumped
     echo "$(date --iso-8601=seconds)	Dump file created." >> ${setupLogFile}
-
-    #	Create md5 hash
-    openssl dgst -md5 ${dump} > ${dump}.md5
 fi
 
-#	Backup the CycleStreets database
-#	Option -R dumps stored procedures & functions
+#	Backup the CycleStreets database, one table per part
+#	Option -R dumps stored procedures & functions, in a part of their own
+#	The tables are read locked until every part is dumped, so the parts are consistent with one another as a single mysqldump would be
 dump=${websitesBackupsFolder}/${dumpPrefix}_cyclestreets.sql.gz
-mysqldump --defaults-extra-file=${mySuperCredFile} --hex-blob -hlocalhost -R cyclestreets | gzip > ${dump}
-#	Create md5 hash
-openssl dgst -md5 ${dump} > ${dump}.md5
+echo -e "cyclestreets\t*" | ${parallelDump} --options="--hex-blob -R" --consistent ${dump}
 
 # 	Schema Structure (no data)
 #	This allows the schema to be viewed at the page: http://www.cyclestreets.net/schema/sql/
 #	Option -R dumps stored procedures & functions
 dump=${websitesBackupsFolder}/${dumpPrefix}_schema_cyclestreets.sql.gz
-mysqldump --defaults-extra-file=${mySuperCredFile} --hex-blob -hlocalhost -R --no-data cyclestreets | gzip > ${dump}
-#	Create md5 hash
-openssl dgst -md5 ${dump} > ${dump}.md5
+echo "cyclestreets" | ${parallelDump} --options="--hex-blob -R --no-data" ${dump}
 
 # 	Locations
 dump=${websitesBackupsFolder}/${dumpPrefix}_location_cyclestreets.sql.gz
-mysqldump --defaults-extra-file=${mySuperCredFile} --hex-blob -hlocalhost cyclestreets map_location | gzip > ${dump}
-#	Create md5 hash
-openssl dgst -md5 ${dump} > ${dump}.md5
+echo -e "cyclestreets\tmap_location" | ${parallelDump} --options="--hex-blob" ${dump}
 
 
 ##	Batch routing db
 #	Only three key tables which contain client data need backing up
 dump=${websitesBackupsFolder}/${dumpPrefix}_csBatch_jobs_servers_threads.sql.gz
-mysqldump --defaults-extra-file=${mySuperCredFile} --hex-blob -hlocalhost csBatch map_batch_jobs map_batch_servers map_batch_threads | gzip > ${dump}
-#	Hash
-openssl dgst -md5 ${dump} > ${dump}.md5
+echo -e "csBatch\tmap_batch_jobs map_batch_servers map_batch_threads" | ${parallelDump} --options="--hex-blob" ${dump}
 
 
 # End of file
@@ -0,0 +1,293 @@
+# Incremental sync of the CycleStreets database from the live server to a fallback, using high-water marks.
+#
+# Rather than reloading the whole database from the nightly dump, only the rows added or changed since the last sync
+# are shipped. For each table the high-water marks are its auto-increment id (as dump-recent.sh uses for map_itinerary
+# and map_error) and any timestamp column that MySQL sets on update. Rows beyond the marks are dumped on the live
+# server as REPLACE statements, compressed, and applied to the fallback, so applying a batch twice does no harm.
+# Rows below the lowest id remaining on the live server, such as routes moved to the archive by repartitionIJS(),
+# are removed. Tables having neither kind of mark are small configuration tables and are copied whole.
+#
+# The marks are only valid while the schema is unchanged, so a fingerprint of the schema is kept with them; when it
+# differs, or there are no marks yet, this exits with status 3 to ask for a full reload, after which --baseline records
+# the marks of the restored database. Other rows deleted on the live server are only removed by a full reload, so one
+# is also asked for once the marks are older than --full-reload-days (seven by default), which bounds how long such
+# deletions, and any change missed by the marks, can persist on the fallback.
+#
+# fallback-deployment/daily-update.sh runs this when fallbackIncrementalSync is set, and can then be run from cron several
+# times a day; it restores the fallback's own settings in map_config, which is copied whole, after each sync.
+#
+# Synopsis
+#	incrementalSync.py [--remote-credentials file] [--credentials file] [--remote-database db] [--batch-rows n] [--full-reload-days n] server database stateFile
+#	incrementalSync.py --baseline [--credentials file] server database stateFile
+#
+# Example
+# cyclestreets@fallback:$
+# python3 utility/incrementalSync.py --credentials ~/.mySuperUserCredentials.cnf --remote-credentials /home/cyclestreets/.mySuperUserCredentials.cnf www.cyclestreets.net cyclestreets /websites/www/backups/incrementalSync.json
+
+# Dependencies
+import sys, os, json, time, shlex, hashlib, subprocess, argparse
+
+# Exit status when a full reload is needed
+fullReloadNeeded = 3
+
+class incrementalSync ():
+    """
+    Ships the rows added or changed since the last sync.
+    """
+
+    def __init__(self, server, database, stateFile):
+
+        # Live server and the fallback database
+        self.server = server
+        self.database = database
+        self.stateFile = stateFile
+
+        # Options
+        self.remoteDatabase = 'cyclestreets'
+        self.remoteCredentials = None
+        self.credentials = None
+        self.batchRows = 200000
+        self.fullReloadDays = 7
+
+        # Bytes shipped per table
+        self.shipped = {}
+
+
+    def mysql (self, credentials, program = 'mysql'):
+        """
+        Returns the start of a mysql command; the defaults-extra-file is a positional argument which must come first.
+        """
+        command = [program]
+        if credentials:
+            command.append('--defaults-extra-file=' + credentials)
+        return command + ['-hlocalhost']
+
+
+    def remoteQuery (self, sql):
+        """
+        Returns the rows of a query on the live server; the query is sent on standard input to avoid quoting it.
+        """
+        command = ' '.join(shlex.quote(part) for part in self.mysql(self.remoteCredentials) + ['-N', self.remoteDatabase])
+        output = subprocess.run(['ssh', self.server, command], input = sql, check = True, capture_output = True, text = True).stdout
+        return [line.split('\t') for line in output.splitlines()]
+
+
+    def localQuery (self, sql):
+        """
+        Returns the rows of a query on the fallback database.
+        """
+        output = subprocess.run(self.mysql(self.credentials) + ['-N', self.database], input = sql, check = True, capture_output = True, text = True).stdout
+        return [line.split('\t') for line in output.splitlines()]
+
+
+    def schema (self, query, database):
+        """
+        Returns a fingerprint of the schema and, per base table, its id and on-update timestamp columns.
+        """
+        rows = query("select c.table_name, c.column_name, c.column_type, c.column_key, c.extra from information_schema.columns c"
+            " join information_schema.tables t on t.table_schema = c.table_schema and t.table_name = c.table_name"
+            " where c.table_schema = '{}' and t.table_type = 'BASE TABLE' order by c.table_name, c.ordinal_position".format(database))
+
+        fingerprint = hashlib.md5()
+        tables = {}
+        for table, column, columnType, key, extra in rows:
+            fingerprint.update('{}\t{}\t{}\t{}\t{}\n'.format(table, column, columnType, key, extra).encode('utf8'))
+            marks = tables.setdefault(table, {'id': None, 'updated': None})
+            if key == 'PRI' and 'auto_increment' in extra:
+                marks['id'] = column
+            elif 'on update' in extra.lower():
+                marks['updated'] = column
+        return fingerprint.hexdigest(), tables
+
+
+    def marks (self, query, table, columns):
+        """
+        Returns the current marks of a table: the lowest and highest id and the latest update, as strings or None.
+        """
+        fields = []
+        if columns['id']:
+            fields += ['min(`{0}`)'.format(columns['id']), 'max(`{0}`)'.format(columns['id'])]
+        if columns['updated']:
+            fields.append('max(`{}`)'.format(columns['updated']))
+        row = query('select {} from `{}`;'.format(', '.join(fields), table))[0]
+        values = [None if value == 'NULL' else value for value in row]
+        return {
+            'minimumId': values[0] if columns['id'] else None,
+            'id': values[1] if columns['id'] else None,
+            'updated': values[-1] if columns['updated'] else None,
+        }
+
+
+    def ship (self, table, where = None, replaceTable = False):
+        """
+        Dumps rows of a table on the live server and applies them to the fallback.
+        """
+        options = ['--hex-blob', '--skip-triggers', '--no-create-db']
+        if replaceTable:
+            options += ['--add-drop-table']
+        else:
+            options += ['--no-create-info', '--replace', '--skip-disable-keys']
+        if where:
+            options.append('--where=' + where)
+        dump = ' '.join(shlex.quote(part) for part in self.mysql(self.remoteCredentials, 'mysqldump') + options + [self.remoteDatabase, table])
+
+        # With pipefail a dump that fails part way fails the transfer, rather than gzip's success hiding it
+        transfer = subprocess.Popen(['ssh', self.server, 'bash -o pipefail -c ' + shlex.quote(dump + ' | gzip')], stdout = subprocess.PIPE)
+        decompress = subprocess.Popen(['gunzip'], stdin = subprocess.PIPE, stdout = subprocess.PIPE)
+        apply = subprocess.Popen(self.mysql(self.credentials) + [self.database], stdin = decompress.stdout)
+        decompress.stdout.close()
+
+        # Count the compressed bytes shipped
+        shipped = 0
+        try:
+            while True:
+                block = transfer.stdout.read(1024 * 1024)
+                if not block:
+                    break
+                shipped += len(block)
+                decompress.stdin.write(block)
+        finally:
+            decompress.stdin.close()
+        if transfer.wait() or decompress.wait() or apply.wait():
+            raise RuntimeError('Failed to sync {}'.format(table))
+        self.shipped[table] = self.shipped.get(table, 0) + shipped
+
+
+    def syncTable (self, table, columns, previous):
+        """
+        Ships the rows of one table beyond its previous marks, returning the new marks.
+        """
+        # No marks: copy the whole table
+        if not columns['id'] and not columns['updated']:
+            self.ship(table, replaceTable = True)
+            return previous
+
+        current = self.marks(self.remoteQuery, table, columns)
+
+        # Changed rows, by their update time; rows changed in the same second as the mark are shipped again, harmlessly
+        if columns['updated'] and current['updated']:
+            if previous['updated']:
+                condition = '`{}` >= \'{}\''.format(columns['updated'], previous['updated'])
+
+                # Newer rows are shipped by id below
+                if columns['id'] and previous['id']:
+                    condition += ' and `{}` <= {}'.format(columns['id'], previous['id'])
+                self.ship(table, condition)
+            elif not columns['id']:
+                self.ship(table)
+
+        # New rows, by id in batches, skipping any no longer on the live server
+        if columns['id'] and current['id']:
+            start = max(int(previous['id'] or 0), int(current['minimumId']) - 1)
+            end = int(current['id'])
+            while start < end:
+                stop = min(end, start + self.batchRows)
+                self.ship(table, '`{0}` > {1:d} and `{0}` <= {2:d}'.format(columns['id'], start, stop))
+                start = stop
+
+        # Rows no longer on the live server, eg moved to the archive
+        if columns['id'] and previous['id']:
+            if current['minimumId'] is None:
+                self.localQuery('delete from `{}` where `{}` <= {};'.format(table, columns['id'], previous['id']))
+            else:
+                self.localQuery('delete from `{}` where `{}` < {};'.format(table, columns['id'], current['minimumId']))
+
+        return current
+
+
+    def readState (self):
+        """
+        Returns the saved marks, or None.
+        """
+        try:
+            with open(self.stateFile) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+
+    def writeState (self, state):
+        """
+        Saves the marks, replacing the file atomically.
+        """
+        temporary = self.stateFile + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(state, f, indent = 1)
+        os.replace(temporary, self.stateFile)
+
+
+    def baseline (self):
+        """
+        Records the marks of the fallback database, as just restored from a full dump.
+        """
+        fingerprint, tables = self.schema(self.localQuery, self.database)
+        state = {'fingerprint': fingerprint, 'baselined': time.time(), 'tables': {}}
+        for table, columns in tables.items():
+            if columns['id'] or columns['updated']:
+                state['tables'][table] = self.marks(self.localQuery, table, columns)
+        self.writeState(state)
+
+
+    def sync (self):
+        """
+        Ships the changes since the last sync. Returns False if a full reload is needed instead.
+        """
+        state = self.readState()
+        if not state:
+            return False
+
+        # Periodically reload in full, to remove rows deleted on the live server
+        if time.time() - state.get('baselined', 0) > self.fullReloadDays * 24 * 60 * 60:
+            return False
+
+        # The marks only apply to the same schema, on both servers
+        fingerprint, tables = self.schema(self.remoteQuery, self.remoteDatabase)
+        if fingerprint != state['fingerprint'] or self.schema(self.localQuery, self.database)[0] != fingerprint:
+            return False
+
+        for table, columns in sorted(tables.items()):
+            empty = {'minimumId': None, 'id': None, 'updated': None}
+            state['tables'][table] = self.syncTable(table, columns, state['tables'].get(table, empty))
+
+            # Save progress as each table is done, so an interrupted sync does not repeat it
+            self.writeState(state)
+        return True
+
+
+# Main
+if __name__ == '__main__':
+
+    # Read args supplied to script
+    parser = argparse.ArgumentParser(description = 'Incremental sync of the CycleStreets database to a fallback.')
+    parser.add_argument('--baseline', action = 'store_true', help = 'Record the marks of the database after a full reload')
+    parser.add_argument('--credentials', help = 'MySQL credentials on this server')
+    parser.add_argument('--remote-credentials', dest = 'remoteCredentials', help = 'MySQL credentials on the live server')
+    parser.add_argument('--remote-database', dest = 'remoteDatabase', default = 'cyclestreets', help = 'Database on the live server')
+    parser.add_argument('--batch-rows', dest = 'batchRows', type = int, default = 200000, help = 'Rows of ids shipped per batch')
+    parser.add_argument('--full-reload-days', dest = 'fullReloadDays', type = float, default = 7, help = 'Age in days of the marks after which a full reload is needed')
+    parser.add_argument('server')
+    parser.add_argument('database')
+    parser.add_argument('stateFile')
+    args = parser.parse_args()
+
+    syncer = incrementalSync(args.server, args.database, args.stateFile)
+    syncer.credentials = args.credentials
+    syncer.remoteCredentials = args.remoteCredentials
+    syncer.remoteDatabase = args.remoteDatabase
+    syncer.batchRows = args.batchRows
+    syncer.fullReloadDays = args.fullReloadDays
+
+    if args.baseline:
+        syncer.baseline()
+        sys.exit(0)
+
+    started = time.time()
+    if not syncer.sync():
+        print('{}\tA full reload is needed'.format(time.strftime('%Y-%m-%dT%H:%M:%S')))
+        sys.exit(fullReloadNeeded)
+
+    # Report
+    print('{}\tSynced {:d} tables, {:.1f}MB compressed, in {:.0f}s'.format(time.strftime('%Y-%m-%dT%H:%M:%S'), len(syncer.shipped), sum(syncer.shipped.values()) / 1e6, time.time() - started))
+
+
+# End of file
@@ -25,6 +25,7 @@ rm -f ${usageLink}
 cp ${ScriptHome}/live-deployment/munin-cyclestreets.py ${usageScript}
 sed -i "s|%apiV2Url|${apiV2Url}|g" ${usageScript}
 sed -i "s|%apiKey|${testsApiKey}|g" ${usageScript}
+sed -i "s|%ScriptHome|${ScriptHome}|g" ${usageScript}
 ln -s ${usageScript} ${usageLink}
 
 ## Photomap Usage plugin
@@ -34,6 +35,7 @@ rm -f ${usageLink}
 cp ${ScriptHome}/live-deployment/munin-photomap.py ${usageScript}
 sed -i "s|%apiV2Url|${apiV2Url}|g" ${usageScript}
 sed -i "s|%apiKey|${testsApiKey}|g" ${usageScript}
+sed -i "s|%ScriptHome|${ScriptHome}|g" ${usageScript}
 ln -s ${usageScript} ${usageLink}
 
 ## CycleStreets Journey Linger plugin
@@ -49,6 +51,44 @@ sed -i "s|%ScriptHome|${ScriptHome}|g" ${lingerScript}
 sed -i "s|%journeysLog|${websitesLogsFolder}/${journeysLog}|g" ${lingerScript}
 ln -s ${lingerScript} ${lingerLink}
 
+## CycleStreets API Linger multigraph plugin, per endpoint
+apiLingerLink=${pLinks}apilinger
+apiLingerScript=${pScripts}apilinger
+rm -f ${apiLingerLink}
+cp ${ScriptHome}/live-deployment/munin-apilinger.py ${apiLingerScript}
+sed -i "s|%ScriptHome|${ScriptHome}|g" ${apiLingerScript}
+sed -i "s|%journeysLog|${websitesLogsFolder}/${journeysLog}|g" ${apiLingerScript}
+ln -s ${apiLingerScript} ${apiLingerLink}
+
+## Resident collector, which the plugins above use when it is running
+collectorService=/etc/systemd/system/cyclestreets-munin-collector.service
+collectorEnvironment=/etc/default/cyclestreets-munin-collector
+collectorPluginConf=/etc/munin/plugin-conf.d/cyclestreets-collector
+if [ -n "${muninCollector}" ]; then
+	cp ${ScriptHome}/live-deployment/cyclestreets-munin-collector.service ${collectorService}
+	sed -i "s|%ScriptHome|${ScriptHome}|g" ${collectorService}
+	sed -i "s|%username|${username}|g" ${collectorService}
+	sed -i "s|%journeysLog|${websitesLogsFolder}/${journeysLog}|g" ${collectorService}
+	sed -i "s|%apiV2Url|${apiV2Url}|g" ${collectorService}
+	sed -i "s|%environmentFile|${collectorEnvironment}|g" ${collectorService}
+	chown root:root ${collectorService}
+
+	# The API key is read by systemd from a file only root can read, rather than given on the command line
+	install -m 600 -o root -g root /dev/null ${collectorEnvironment}
+	echo "CYCLESTREETS_API_KEY=${testsApiKey}" > ${collectorEnvironment}
+
+	# The socket is open to the munin group, so the plugins that use it run in that group
+	printf '[journeylinger]\ngroup munin\n\n[apilinger]\ngroup munin\n' > ${collectorPluginConf}
+
+	systemctl daemon-reload
+	systemctl enable cyclestreets-munin-collector.service
+	systemctl restart cyclestreets-munin-collector.service
+elif [ -f ${collectorService} ]; then
+	systemctl disable --now cyclestreets-munin-collector.service
+	rm -f ${collectorService} ${collectorEnvironment} ${collectorPluginConf}
+	systemctl daemon-reload
+fi
+
 
 # Some specific Plugins
 if [ -f /etc/munin/plugins/dnsresponsetime ]; then
@@ -0,0 +1,222 @@
+# A bounded-memory streaming quantile sketch for linger times.
+#
+# Values are counted in logarithmically sized buckets (the DDSketch scheme) so that any quantile can be
+# read back with a relative error no worse than the configured accuracy, whatever the number of values added.
+# The memory used depends on the spread of the values, not on how many there are, and sketches built
+# separately (eg on successive munin polls or on different servers) can be merged exactly.
+#
+# Synopsis
+#	lingerSketch.py sketchFile [sketchFile ...]
+#
+# Result
+#	The sketches are merged and these statistics, in milliseconds, are printed each on a new line:
+#	count, mean, p50, p90, p95, p99, p99.9 and the slowest.
+#
+# Example
+# user@veebee:$
+# python3 utility/lingerSketch.py /tmp/veebee.sketch /tmp/fallback.sketch
+
+# Dependencies
+import sys, os, math, json
+
+class lingerSketch ():
+    """
+    Streaming quantile estimator with a relative error bound.
+    """
+
+    # Quantiles reported by default
+    standardQuantiles = (0.5, 0.9, 0.95, 0.99, 0.999)
+
+    def __init__(self, relativeAccuracy = 0.01, maximumBuckets = 2048):
+
+        # Relative accuracy of quantiles, eg 0.01 for 1%
+        self.relativeAccuracy = relativeAccuracy
+
+        # Ratio between the boundaries of successive buckets
+        self.gamma = (1 + relativeAccuracy) / (1 - relativeAccuracy)
+        self.logGamma = math.log(self.gamma)
+
+        # Memory bound; when exceeded the lowest buckets are combined, which only affects accuracy at the fast end
+        self.maximumBuckets = maximumBuckets
+
+        # Counts indexed by bucket
+        self.buckets = {}
+
+        # Values too small to have a logarithmic bucket
+        self.zeroCount = 0
+
+        # Exact summary values
+        self.count = 0
+        self.sum = 0
+        self.minimum = None
+        self.maximum = None
+
+
+    def add (self, value):
+        """
+        Adds a non-negative value to the sketch.
+        """
+        self.count += 1
+        self.sum += value
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+
+        if value <= 0:
+            self.zeroCount += 1
+            return
+
+        index = math.ceil(math.log(value) / self.logGamma)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+        if len(self.buckets) > self.maximumBuckets:
+            self.collapse()
+
+
+    def collapse (self):
+        """
+        Combines the lowest buckets so that the number of buckets is back within the limit.
+        """
+        indexes = sorted(self.buckets)
+        excess = len(indexes) - self.maximumBuckets
+        if excess <= 0:
+            return
+
+        # Fold the lowest buckets into the first one that remains
+        target = indexes[excess]
+        for index in indexes[:excess]:
+            self.buckets[target] += self.buckets.pop(index)
+
+
+    def merge (self, other):
+        """
+        Adds the contents of another sketch, which must have the same accuracy.
+        """
+        if other.relativeAccuracy != self.relativeAccuracy:
+            raise ValueError('Cannot merge sketches of different accuracy: {} and {}'.format(self.relativeAccuracy, other.relativeAccuracy))
+
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zeroCount += other.zeroCount
+        self.count += other.count
+        self.sum += other.sum
+        if other.minimum is not None and (self.minimum is None or other.minimum < self.minimum):
+            self.minimum = other.minimum
+        if other.maximum is not None and (self.maximum is None or other.maximum > self.maximum):
+            self.maximum = other.maximum
+
+        self.collapse()
+
+
+    def mean (self):
+        """
+        Returns the exact mean, or zero when empty.
+        """
+        return self.sum / self.count if self.count else 0
+
+
+    def quantile (self, q):
+        """
+        Returns an estimate of the value at quantile q (0 to 1), or zero when empty.
+        """
+        if not self.count:
+            return 0
+
+        # Rank of the wanted value, counting from zero
+        rank = q * (self.count - 1)
+
+        if rank < self.zeroCount:
+            return 0
+
+        cumulative = self.zeroCount
+        for index in sorted(self.buckets):
+            cumulative += self.buckets[index]
+            if cumulative > rank:
+
+                # Midpoint of the bucket in the relative sense, clamped to the exact range seen
+                estimate = 2 * math.pow(self.gamma, index) / (self.gamma + 1)
+                return min(max(estimate, self.minimum), self.maximum)
+
+        return self.maximum
+
+
+    def quantiles (self, qs = standardQuantiles):
+        """
+        Returns a dict of quantile estimates.
+        """
+        return {q: self.quantile(q) for q in qs}
+
+
+    def toDict (self):
+        """
+        Returns a representation of the sketch suitable for json.
+        """
+        return {
+            'relativeAccuracy': self.relativeAccuracy,
+            'maximumBuckets': self.maximumBuckets,
+            'buckets': {str(index): count for index, count in self.buckets.items()},
+            'zeroCount': self.zeroCount,
+            'count': self.count,
+            'sum': self.sum,
+            'minimum': self.minimum,
+            'maximum': self.maximum,
+        }
+
+
+    @classmethod
+    def fromDict (cls, data):
+        """
+        Recreates a sketch from its json representation.
+        """
+        sketch = cls(data['relativeAccuracy'], data['maximumBuckets'])
+        sketch.buckets = {int(index): count for index, count in data['buckets'].items()}
+        sketch.zeroCount = data['zeroCount']
+        sketch.count = data['count']
+        sketch.sum = data['sum']
+        sketch.minimum = data['minimum']
+        sketch.maximum = data['maximum']
+        return sketch
+
+
+    def save (self, path):
+        """
+        Writes the sketch to a file, replacing it atomically.
+        """
+        temporary = path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(self.toDict(), f)
+        os.replace(temporary, path)
+
+
+    @classmethod
+    def load (cls, path):
+        """
+        Reads a sketch from a file.
+        """
+        with open(path) as f:
+            return cls.fromDict(json.load(f))
+
+
+# Main
+if __name__ == '__main__':
+
+    # Check arguments
+    if len(sys.argv) < 2:
+        print('Usage: {} sketchFile [sketchFile ...]'.format(sys.argv[0]), file = sys.stderr)
+        sys.exit(1)
+
+    # Merge all the sketches supplied
+    merged = lingerSketch.load(sys.argv[1])
+    for path in sys.argv[2:]:
+        merged.merge(lingerSketch.load(path))
+
+    # Values are stored in microseconds
+    print('count {:d}'.format(merged.count))
+    print('mean {:d}'.format(math.ceil(merged.mean() / 1000)))
+    for q, value in merged.quantiles().items():
+        print('p{:g} {:d}'.format(q * 100, math.ceil(value / 1000)))
+    print('slowest {:d}'.format(math.ceil((merged.maximum or 0) / 1000)))
+
+
+# End of file
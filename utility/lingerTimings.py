@@ -0,0 +1,111 @@
+# Exact linger statistics over a compact buffer of timings.
+#
+# Where exact rather than estimated percentiles are wanted (eg for historical reports), the timings are kept in an
+# array('q') of 8 bytes each, rather than a list of boxed ints, and summarised with vectorised NumPy operations:
+# the mean, and percentiles by partitioning rather than a full sort.
+# Without NumPy the same results are calculated in pure Python.
+#
+# This offers the same interface as lingerSketch, so either can be used by accessLogLingerStats.
+
+# Dependencies
+from array import array
+
+# NumPy is optional
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class lingerTimings ():
+    """
+    Exact statistics of timings held in a compact buffer.
+    """
+
+    # Quantiles reported by default
+    standardQuantiles = (0.5, 0.9, 0.95, 0.99, 0.999)
+
+    def __init__(self):
+
+        # Timings, as signed 64 bit integers
+        self.timings = array('q')
+
+
+    def add (self, value):
+        """
+        Adds a value.
+        """
+        self.timings.append(value)
+
+
+    def merge (self, other):
+        """
+        Adds the values of another set of timings.
+        """
+        self.timings.extend(other.timings)
+
+
+    @property
+    def count (self):
+        return len(self.timings)
+
+
+    @property
+    def sum (self):
+        if numpy is not None:
+            return int(self.values().sum())
+        return sum(self.timings)
+
+
+    @property
+    def maximum (self):
+        if not self.timings:
+            return None
+        if numpy is not None:
+            return int(self.values().max())
+        return max(self.timings)
+
+
+    def values (self):
+        """
+        Returns a NumPy view of the buffer, without copying it.
+        """
+        return numpy.frombuffer(self.timings, dtype = numpy.int64)
+
+
+    def mean (self):
+        """
+        Returns the mean, or zero when empty.
+        """
+        if not self.timings:
+            return 0
+        if numpy is not None:
+            return float(self.values().mean())
+        return sum(self.timings) / len(self.timings)
+
+
+    def quantiles (self, qs = standardQuantiles):
+        """
+        Returns a dict of the values at each quantile; the value at quantile q is the one at index q * (count - 1) in ascending order.
+        """
+        if not self.timings:
+            return {q: 0 for q in qs}
+
+        indexes = [int(q * (len(self.timings) - 1)) for q in qs]
+
+        # One partial partition finds all the wanted ranks in linear time
+        if numpy is not None:
+            partitioned = numpy.partition(self.values(), sorted(set(indexes)))
+            return {q: int(partitioned[index]) for q, index in zip(qs, indexes)}
+
+        ascending = sorted(self.timings)
+        return {q: ascending[index] for q, index in zip(qs, indexes)}
+
+
+    def quantile (self, q):
+        """
+        Returns the value at quantile q (0 to 1), or zero when empty.
+        """
+        return self.quantiles((q, ))[q]
+
+
+# End of file
@@ -0,0 +1,256 @@
+# A resident collector of CycleStreets monitoring data for the munin plugins.
+#
+# Rather than each munin plugin starting an interpreter, spawning tail and opening a fresh HTTPS connection
+# every five minutes, this process follows the access log continuously (see accessLogEndpointStats),
+# keeps rolling aggregates in memory, and polls the v2 status API over one kept-alive connection.
+# The results are served over a Unix socket, so the plugins only need to connect and print. The socket is only open to
+# the owner and to the group the munin plugins run as.
+# The plugins fall back to doing the work themselves when the collector is not running.
+#
+# Synopsis
+#	muninCollector.py [--socket path] [--socket-group group] [--sample seconds] [--window seconds] [--status seconds] logFile apiV2Url [apiKey]
+#
+# The API key, when not given, is read from the environment variable CYCLESTREETS_API_KEY, so that it need not be visible
+# in the process list.
+#
+# Protocol
+#	The client sends one line naming what it wants, optionally followed by a window in seconds, and reads the reply until the connection closes:
+#	* journeylinger [seconds]	Values for munin-journeylinger.py
+#	* apilinger [seconds]		Values for munin-apilinger.py
+#	* status			The latest json response of the status API
+#
+# Example
+# user@veebee:$
+# python3 utility/muninCollector.py /websites/www/logs/veebee-access.log https://api.cyclestreets.net/v2/ abc123
+# echo journeylinger | nc -U /run/cyclestreets-collector/collector.sock
+
+# Dependencies
+import sys, os, grp, time, threading, socket, socketserver, collections, argparse, http.client, urllib.parse
+from accessLogLingerStats import accessLogLingerStats
+from accessLogEndpointStats import accessLogEndpointStats
+from lingerSketch import lingerSketch
+
+# Where the collector listens by default
+defaultSocketPath = '/run/cyclestreets-collector/collector.sock'
+
+# Group allowed to connect to the socket, as which munin runs its plugins
+defaultSocketGroup = 'munin'
+
+# Endpoints that together make up the journey linger, which counts both api versions
+journeyEndpoints = ('journey_v1', 'journey_v2')
+
+def askCollector (request, socketPath = defaultSocketPath, timeout = 5):
+    """
+    Returns the collector's reply to a request, as text, or None if the collector is not available.
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(timeout)
+            client.connect(socketPath)
+            client.sendall(request.encode('utf8') + b'\n')
+            reply = b''
+            while True:
+                data = client.recv(65536)
+                if not data:
+                    break
+                reply += data
+    except OSError:
+        return None
+
+    # An empty reply means the collector had nothing to give
+    return reply.decode('utf8') or None
+
+
+class muninCollector ():
+    """
+    Follows the access log and the status API, keeping results for the munin plugins.
+    """
+
+    def __init__(self, logfile, apiV2Url, apiKey, socketPath = defaultSocketPath):
+
+        # Log follower; its state file lives beside the socket
+        self.endpointStats = accessLogEndpointStats(logfile, os.path.join(os.path.dirname(socketPath), 'collector.state'))
+        self.logfile = logfile
+
+        # Status API
+        self.statusUrl = urllib.parse.urlsplit(apiV2Url + 'status?key=' + apiKey + '&fields=usage')
+        self.connection = None
+
+        # Socket, and the group allowed to use it
+        self.socketPath = socketPath
+        self.socketGroup = defaultSocketGroup
+
+        # Seconds between reads of the log, between status polls, and the default window reported
+        self.sampleSeconds = 15
+        self.statusSeconds = 60
+        self.windowSeconds = 300
+
+        # Samples, oldest first, as (time, sketches by endpoint, status counts by endpoint)
+        self.samples = collections.deque()
+
+        # Latest status API response, as bytes
+        self.status = None
+
+        # Guards samples and status which are written by the collecting threads and read by the server
+        self.lock = threading.Lock()
+
+
+    def collectLog (self):
+        """
+        Reads the lines added to the log since the last sample and stores their aggregates.
+        """
+        stats = self.endpointStats
+        stats.scan(stats.newLines())
+
+        now = time.time()
+        with self.lock:
+            self.samples.append((now, stats.sketches, stats.statusCounts))
+
+            # Keep no more than an hour
+            while self.samples and self.samples[0][0] < now - 3600:
+                self.samples.popleft()
+
+
+    def collectStatus (self):
+        """
+        Fetches the status API over a kept-alive connection, reconnecting if it has dropped.
+        """
+        if self.connection is None:
+            connectionClass = http.client.HTTPSConnection if self.statusUrl.scheme == 'https' else http.client.HTTPConnection
+            self.connection = connectionClass(self.statusUrl.netloc, timeout = 30)
+
+        try:
+            self.connection.request('GET', self.statusUrl.path + '?' + self.statusUrl.query)
+            response = self.connection.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException):
+            # Start afresh next time; the previous response is kept meanwhile
+            self.connection.close()
+            self.connection = None
+            return
+
+        if response.status == 200:
+            with self.lock:
+                self.status = body
+
+
+    def repeat (self, function, seconds):
+        """
+        Calls the function every so many seconds, for ever.
+        """
+        while True:
+            started = time.time()
+            try:
+                function()
+            except Exception as e:
+                print('#\t{} failed: {}'.format(function.__name__, e), file = sys.stderr)
+            time.sleep(max(0, seconds - (time.time() - started)))
+
+
+    def merged (self, seconds):
+        """
+        Returns the sketches and status counts by endpoint merged over the most recent samples.
+        """
+        sketches = {name: lingerSketch(self.endpointStats.relativeAccuracy) for name, pattern in self.endpointStats.endpoints}
+        statusCounts = {name: collections.Counter() for name, pattern in self.endpointStats.endpoints}
+
+        since = time.time() - seconds
+        with self.lock:
+            samples = [sample for sample in self.samples if sample[0] > since]
+
+        for sampled, sampleSketches, sampleStatusCounts in samples:
+            for name in sketches:
+                sketches[name].merge(sampleSketches[name])
+                statusCounts[name].update(sampleStatusCounts[name])
+
+        return sketches, statusCounts
+
+
+    def reply (self, request):
+        """
+        Returns the reply, as bytes, to a request line.
+        """
+        words = request.split()
+        if not words:
+            return b''
+        name = words[0]
+        seconds = int(words[1]) if len(words) > 1 and words[1].isdigit() else self.windowSeconds
+
+        if name == 'status':
+            with self.lock:
+                return self.status or b''
+
+        if name == 'journeylinger':
+            sketches, statusCounts = self.merged(seconds)
+            alls = accessLogLingerStats(self.logfile)
+            alls.sketch = lingerSketch(alls.relativeAccuracy)
+            for endpoint in journeyEndpoints:
+                alls.sketch.merge(sketches[endpoint])
+            alls.calculateStatistics()
+            return alls.formatResults().encode('utf8')
+
+        if name == 'apilinger':
+            sketches, statusCounts = self.merged(seconds)
+            aes = accessLogEndpointStats(self.logfile, None, self.endpointStats.endpoints)
+            aes.sketches = sketches
+            aes.statusCounts = {endpoint: dict(counts) for endpoint, counts in statusCounts.items()}
+            return aes.formatResults().encode('utf8')
+
+        return b''
+
+
+    def serve (self):
+        """
+        Starts the collecting threads and serves replies on the Unix socket until stopped.
+        """
+        collector = self
+
+        class handler (socketserver.StreamRequestHandler):
+            def handle (self):
+                request = self.rfile.readline(1024).decode('utf8', 'replace')
+                self.wfile.write(collector.reply(request))
+
+        # Collect in the background
+        for function, seconds in ((self.collectLog, self.sampleSeconds), (self.collectStatus, self.statusSeconds)):
+            threading.Thread(target = self.repeat, args = (function, seconds), daemon = True).start()
+
+        # Replace any socket left by a previous run
+        if os.path.exists(self.socketPath):
+            os.unlink(self.socketPath)
+
+        with socketserver.ThreadingUnixStreamServer(self.socketPath, handler) as server:
+
+            # The plugins run as another user, in the munin group
+            os.chown(self.socketPath, -1, grp.getgrnam(self.socketGroup).gr_gid)
+            os.chmod(self.socketPath, 0o660)
+            server.serve_forever()
+
+
+# Main
+if __name__ == '__main__':
+
+    # Read args supplied to script
+    parser = argparse.ArgumentParser(description = 'Collects CycleStreets monitoring data for the munin plugins.')
+    parser.add_argument('--socket', default = defaultSocketPath, help = 'Unix socket to listen on')
+    parser.add_argument('--socket-group', dest = 'socketGroup', default = defaultSocketGroup, help = 'Group allowed to connect to the socket')
+    parser.add_argument('--sample', type = int, default = 15, help = 'Seconds between reads of the log')
+    parser.add_argument('--window', type = int, default = 300, help = 'Default window in seconds for the results')
+    parser.add_argument('--status', type = int, default = 60, help = 'Seconds between polls of the status API')
+    parser.add_argument('logFile')
+    parser.add_argument('apiV2Url')
+    parser.add_argument('apiKey', nargs = '?', default = os.environ.get('CYCLESTREETS_API_KEY'))
+    args = parser.parse_args()
+    if not args.apiKey:
+        parser.error('the API key must be given, or set in CYCLESTREETS_API_KEY')
+
+    collector = muninCollector(args.logFile, args.apiV2Url, args.apiKey, args.socket)
+    collector.socketGroup = args.socketGroup
+    collector.sampleSeconds = args.sample
+    collector.windowSeconds = args.window
+    collector.statusSeconds = args.status
+
+    # Run until stopped
+    collector.serve()
+
+
+# End of file
@@ -0,0 +1,280 @@
+# Parallel, compressed logical dumps of MySQL tables.
+#
+# Each table, or each range of primary key values of a large table, is dumped by its own mysqldump process and
+# compressed by its own pigz (or gzip) process, several at once. The compressed parts are then joined in order into
+# the one dump file; as a file of concatenated gzip members this is an ordinary .sql.gz that gunzip and existing
+# restores read as before. The md5 and the chunk manifest used by chunkedTransfer are computed as the file is
+# written, so it is not read again to checksum it.
+#
+# Each part is consistent in itself, but the parts are dumped by separate connections at different times, so by default
+# they are not consistent with one another as a single mysqldump of the database is. With --consistent, one connection
+# holds a read lock on every table being dumped in parts until all the parts are dumped, as a single mysqldump would,
+# so writes to those tables wait for the dump.
+#
+# Routines are dumped only in a part of their own, so the mysqldump options -R and --routines are not passed to the
+# parts of single tables.
+#
+# A parts manifest, dumpFile.parts, gives the byte offset and length of each part within the file, so that a
+# restore (see parallelRestore.py) can decompress and load the parts in parallel too; parts marked after, such as
+# views and routines, depend on the others.
+#
+# The plan of what to dump is read from standard input, one part per line, as tab-separated:
+#	database	tables	where
+# where tables is empty for the whole database in one part, * for each table of the database as a part,
+# or a space-separated list of tables; the where condition is optional.
+#
+# Synopsis
+#	parallelDump.py [--defaults-extra-file file] [--options mysqldumpOptions] [--consistent] [--workers n] [--split table=column] [--ranges n] dumpFile < plan
+#
+# Example
+# cyclestreets@veebee:$
+# echo -e "cyclestreets\t*" | python3 utility/parallelDump.py --defaults-extra-file ~/.mySuperUserCredentials.cnf --options="--hex-blob -R" --consistent /websites/www/backups/www_cyclestreets.sql.gz
+
+# Dependencies
+import sys, os, json, shlex, shutil, subprocess, argparse
+from concurrent.futures import ThreadPoolExecutor
+from chunkedTransfer import manifestWriter
+
+# Suffix of the parts manifest
+partsSuffix = '.parts'
+
+# Options of mysqldump which dump routines
+routineOptions = ('-R', '--routines')
+
+class parallelDump ():
+    """
+    Dumps tables in parallel into one compressed file, with manifests for checking, transfer and parallel restore.
+    """
+
+    def __init__(self, dumpFile):
+
+        # Output
+        self.dumpFile = dumpFile
+
+        # Options
+        self.defaultsExtraFile = None
+        self.options = []
+        self.workers = min(4, os.cpu_count() or 1)
+        self.consistent = False
+
+        # Large tables split into ranges of a column, as table: column
+        self.splits = {}
+        self.ranges = 4
+
+        # Parts to dump, in the order they are joined, as dicts of database, tables, where and options
+        self.parts = []
+
+        # Views of the database last listed
+        self.views = []
+
+
+    def command (self, program):
+        """
+        Returns the start of a mysql or mysqldump command; the defaults-extra-file is a positional argument which must come first.
+        """
+        command = [program]
+        if self.defaultsExtraFile:
+            command.append('--defaults-extra-file=' + self.defaultsExtraFile)
+        return command + ['-hlocalhost']
+
+
+    def query (self, database, sql):
+        """
+        Returns the rows of a query as lists of strings.
+        """
+        output = subprocess.run(self.command('mysql') + [database, '-Nse', sql], check = True, capture_output = True, text = True).stdout
+        return [line.split('\t') for line in output.splitlines()]
+
+
+    def tables (self, database):
+        """
+        Returns the tables of a database, followed by its views which may depend on them.
+        """
+        rows = self.query(database, 'show full tables')
+        self.views = [name for name, kind in rows if kind == 'VIEW']
+        return [name for name, kind in rows if kind != 'VIEW'] + self.views
+
+
+    def rangeConditions (self, database, table, column, where):
+        """
+        Returns where conditions splitting the table into ranges of the column having similar spans.
+        """
+        minimum, maximum = self.query(database, 'select min({0}), max({0}) from {1}{2}'.format(column, table, ' where ' + where if where else ''))[0]
+        if minimum == 'NULL' or self.ranges < 2:
+            return [where]
+
+        minimum, maximum = int(minimum), int(maximum)
+        starts = sorted(set(minimum + (maximum - minimum + 1) * index // self.ranges for index in range(self.ranges)))
+        conditions = []
+        for start, end in zip(starts, starts[1:] + [None]):
+            condition = '{} >= {:d}'.format(column, start) if end is None else '{0} >= {1:d} and {0} < {2:d}'.format(column, start, end)
+            conditions.append('({}) and {}'.format(where, condition) if where else condition)
+        return conditions
+
+
+    def plan (self, database, tables = '', where = ''):
+        """
+        Adds the parts for a line of the plan.
+        """
+        # Whole database as one part
+        if not tables:
+            self.parts.append({'database': database, 'tables': [], 'where': where, 'options': [], 'after': True})
+            return
+
+        names, views = (self.tables(database), self.views) if tables == '*' else (tables.split(), [])
+        for table in names:
+            if table in self.splits:
+                conditions = self.rangeConditions(database, table, self.splits[table], where)
+                for index, condition in enumerate(conditions):
+
+                    # Create the table only with the first range
+                    self.parts.append({'database': database, 'tables': [table], 'where': condition, 'options': ['--no-create-info'] if index else []})
+            else:
+
+                # Views depend on tables, so are marked to be restored after them
+                self.parts.append({'database': database, 'tables': [table], 'where': where, 'options': [], 'after': table in views})
+
+        # Routines are only dumped with whole databases, so have a part of their own after the tables
+        if tables == '*' and set(routineOptions) & set(self.options):
+            self.parts.append({'database': database, 'tables': [], 'where': '', 'options': ['--no-create-info', '--no-data', '--skip-triggers'], 'after': True})
+
+
+    def compressor (self):
+        """
+        Returns the compression command, multi-threaded if pigz is available with the threads shared between the workers.
+        """
+        if shutil.which('pigz'):
+            return ['pigz', '-c', '-p', str(max(1, (os.cpu_count() or 1) // self.workers))]
+        return ['gzip', '-c']
+
+
+    def partFile (self, index):
+        """
+        Returns the name of the temporary file of a part.
+        """
+        return '{}.part{:04d}'.format(self.dumpFile, index)
+
+
+    def dumpPart (self, index):
+        """
+        Dumps and compresses one part into its temporary file.
+        """
+        part = self.parts[index]
+        options = [option for option in self.options if option not in routineOptions] if part['tables'] else self.options
+        command = self.command('mysqldump') + options + part['options']
+        if part['where']:
+            command.append('--where=' + part['where'])
+        command += [part['database']] + part['tables']
+
+        with open(self.partFile(index), 'wb') as output:
+            dump = subprocess.Popen(command, stdout = subprocess.PIPE)
+            compress = subprocess.Popen(self.compressor(), stdin = dump.stdout, stdout = output)
+            dump.stdout.close()
+            compress.wait()
+            dump.wait()
+        if dump.returncode or compress.returncode:
+            raise RuntimeError('Failed to dump part {:d}: {}'.format(index, ' '.join(command[2:])))
+
+
+    def lock (self):
+        """
+        Starts a connection holding a read lock on every table dumped in parts, returning it once the lock is held.
+        """
+        tables = sorted(set('`{}`.`{}` read'.format(part['database'], table) for part in self.parts for table in part['tables']))
+        if not tables:
+            return None
+        session = subprocess.Popen(self.command('mysql') + ['-N', '-B'], stdin = subprocess.PIPE, stdout = subprocess.PIPE, text = True)
+        session.stdin.write('lock tables {};\nselect 1;\n'.format(', '.join(tables)))
+        session.stdin.flush()
+        if session.stdout.readline().strip() != '1':
+            session.wait()
+            raise RuntimeError('Failed to lock the tables for a consistent dump')
+        return session
+
+
+    def unlock (self, session):
+        """
+        Releases the read lock, ending its connection.
+        """
+        session.stdin.write('unlock tables;\n')
+        session.stdin.close()
+        session.wait()
+
+
+    def dump (self, md5Format = 'openssl'):
+        """
+        Dumps the parts in parallel and joins them, writing the manifests and md5.
+        """
+        try:
+            session = self.lock() if self.consistent else None
+            try:
+                with ThreadPoolExecutor(max_workers = self.workers) as executor:
+                    list(executor.map(self.dumpPart, range(len(self.parts))))
+            finally:
+                if session:
+                    self.unlock(session)
+
+            # Join in order, checksumming as the file is written
+            writer = manifestWriter()
+            offset = 0
+            temporary = self.dumpFile + '.tmp'
+            with open(temporary, 'wb') as output:
+                for index, part in enumerate(self.parts):
+                    with open(self.partFile(index), 'rb') as f:
+                        while True:
+                            block = f.read(8 * 1024 * 1024)
+                            if not block:
+                                break
+                            writer.update(block)
+                            output.write(block)
+                    part['offset'] = offset
+                    part['length'] = writer.size - offset
+                    offset = writer.size
+                    os.unlink(self.partFile(index))
+            os.replace(temporary, self.dumpFile)
+
+        finally:
+            for index in range(len(self.parts)):
+                if os.path.exists(self.partFile(index)):
+                    os.unlink(self.partFile(index))
+
+        # The parts manifest, then the chunk manifest and md5 which signal the dump is ready
+        with open(self.dumpFile + partsSuffix, 'w') as f:
+            json.dump({'md5': writer.md5.hexdigest(), 'parts': self.parts}, f)
+        writer.write(self.dumpFile, md5Format)
+
+
+# Main
+if __name__ == '__main__':
+
+    # Read args supplied to script
+    parser = argparse.ArgumentParser(description = 'Dumps MySQL tables in parallel into one compressed file.')
+    parser.add_argument('--defaults-extra-file', dest = 'defaultsExtraFile', help = 'MySQL credentials')
+    parser.add_argument('--options', default = '', help = 'Options for mysqldump')
+    parser.add_argument('--consistent', action = 'store_true', help = 'Hold a read lock on the tables until every part is dumped, so the parts are consistent with one another')
+    parser.add_argument('--workers', type = int, default = min(4, os.cpu_count() or 1), help = 'Number of parts dumped at once')
+    parser.add_argument('--split', action = 'append', default = [], help = 'Dump table=column in ranges of that column')
+    parser.add_argument('--ranges', type = int, default = 4, help = 'Number of ranges for split tables')
+    parser.add_argument('--md5', choices = ('openssl', 'md5sum', 'none'), default = 'openssl', help = 'Format of the .md5 written')
+    parser.add_argument('dumpFile')
+    args = parser.parse_args()
+
+    dumper = parallelDump(args.dumpFile)
+    dumper.defaultsExtraFile = args.defaultsExtraFile
+    dumper.options = shlex.split(args.options)
+    dumper.consistent = args.consistent
+    dumper.workers = args.workers
+    dumper.splits = dict(split.split('=', 1) for split in args.split)
+    dumper.ranges = args.ranges
+
+    # Read the plan
+    for line in sys.stdin:
+        if not line.strip() or line.startswith('#'):
+            continue
+        fields = line.rstrip('\n').split('\t')
+        dumper.plan(*fields[:3])
+
+    dumper.dump(args.md5)
+
+
+# End of file
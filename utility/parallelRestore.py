@@ -0,0 +1,205 @@
+# Parallel restore of dumps written by parallelDump.py, and of batches of recent routes.
+#
+# The parts manifest of a dump (dumpFile.parts) gives where each table's part lies within the file, so the parts of
+# different tables are decompressed and loaded at once by a pool of workers. The parts of one table are loaded in
+# turn, and parts that depend on the others, such as views and routines, are loaded once they have finished.
+# Each part is loaded in one transaction with unique and foreign key checks off, for bulk loading.
+# A dump without a valid manifest is loaded as a single part, as before.
+#
+# Batches of recent routes, named as prefix_routes_minItineraryId.sql.gz, each hold the routes from their id up to the
+# next batch's, so their ranges do not overlap and they are loaded in parallel too. If any batch is not named that way
+# the batches are loaded table by table in the order given.
+#
+# The throughput of each table is reported.
+#
+# Synopsis
+#	parallelRestore.py [--defaults-extra-file file] [--workers n] [--batches] database dumpFile [dumpFile ...]
+#
+# Example
+# cyclestreets@fallback:$
+# python3 utility/parallelRestore.py --defaults-extra-file ~/.mySuperUserCredentials.cnf cyclestreets /websites/www/backups/www_cyclestreets.sql.gz
+
+# Dependencies
+import sys, os, re, json, time, zlib, threading, subprocess, argparse
+from concurrent.futures import ThreadPoolExecutor
+from parallelDump import partsSuffix
+
+# Batch of recent routes
+batchName = re.compile(r'_routes_([0-9]+)\.sql\.gz$')
+
+# Statements around each part for bulk loading; the dumps themselves disable keys where that is wanted
+bulkPrefix = b'SET autocommit=0;\nSET unique_checks=0;\nSET foreign_key_checks=0;\n'
+bulkSuffix = b'\nCOMMIT;\n'
+
+class parallelRestore ():
+    """
+    Restores dumps into a database, loading independent tables at once.
+    """
+
+    def __init__(self, database):
+
+        # Database restored into
+        self.database = database
+
+        # Options
+        self.defaultsExtraFile = None
+        self.workers = min(4, os.cpu_count() or 1)
+
+        # Per table: [uncompressed bytes, seconds], guarded by the lock as they are updated from several threads
+        self.throughput = {}
+        self.lock = threading.Lock()
+
+
+    def readParts (self, dumpFile):
+        """
+        Returns the parts of a dump from its manifest, provided it describes this version of the file, otherwise the whole file as one part.
+        """
+        size = os.path.getsize(dumpFile)
+        whole = [{'tables': [], 'offset': 0, 'length': size, 'after': False}]
+        try:
+            with open(dumpFile + partsSuffix) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return whole
+
+        # The md5 of the dump as downloaded must be the one the manifest was written with
+        try:
+            with open(dumpFile + '.md5') as f:
+                if manifest['md5'] not in f.read():
+                    return whole
+        except OSError:
+            pass
+
+        parts = manifest['parts']
+        if not parts or parts[-1]['offset'] + parts[-1]['length'] != size:
+            return whole
+        return parts
+
+
+    def stream (self, dumpFile, offset, length):
+        """
+        Yields the decompressed contents of a range of the file, which may hold several gzip members.
+        """
+        with open(dumpFile, 'rb') as f:
+            f.seek(offset)
+            remaining = length
+            decompressor = zlib.decompressobj(wbits = 47)
+            while remaining > 0:
+                block = f.read(min(remaining, 4 * 1024 * 1024))
+                if not block:
+                    break
+                remaining -= len(block)
+
+                # A new member starts where the last ended
+                while block:
+                    yield decompressor.decompress(block)
+                    if not decompressor.eof:
+                        break
+                    block = decompressor.unused_data
+                    decompressor = zlib.decompressobj(wbits = 47)
+
+
+    def loadPart (self, dumpFile, part):
+        """
+        Loads one part of a dump.
+        """
+        label = ' '.join(part['tables']) or os.path.basename(dumpFile)
+        started = time.time()
+        command = ['mysql']
+        if self.defaultsExtraFile:
+            command.append('--defaults-extra-file=' + self.defaultsExtraFile)
+        mysql = subprocess.Popen(command + ['-hlocalhost', self.database], stdin = subprocess.PIPE)
+
+        loaded = 0
+        try:
+            mysql.stdin.write(bulkPrefix)
+            for data in self.stream(dumpFile, part['offset'], part['length']):
+                mysql.stdin.write(data)
+                loaded += len(data)
+            mysql.stdin.write(bulkSuffix)
+        finally:
+            mysql.stdin.close()
+        if mysql.wait():
+            raise RuntimeError('Failed to restore {} from {}'.format(label, dumpFile))
+
+        with self.lock:
+            total = self.throughput.setdefault(label, [0, 0])
+            total[0] += loaded
+            total[1] += time.time() - started
+
+
+    def loadChain (self, chain):
+        """
+        Loads a list of (dumpFile, part) in turn.
+        """
+        for dumpFile, part in chain:
+            self.loadPart(dumpFile, part)
+
+
+    def chains (self, dumpFiles, independent):
+        """
+        Returns the lists of parts that can be loaded at once, and the parts to load after them.
+        Parts of the same table are chained unless the dumps are independent.
+        """
+        chains = {}
+        after = []
+        for index, dumpFile in enumerate(dumpFiles):
+            for part in self.readParts(dumpFile):
+                if part.get('after'):
+                    after.append((dumpFile, part))
+                    continue
+                key = (index if independent else None, tuple(part['tables']))
+                chains.setdefault(key, []).append((dumpFile, part))
+        return list(chains.values()), after
+
+
+    def restore (self, dumpFiles, batches = False):
+        """
+        Restores the dumps.
+        """
+        # Batches are independent when each is named by its first id
+        independent = False
+        if batches:
+            ids = [batchName.search(dumpFile) for dumpFile in dumpFiles]
+            independent = all(ids) and len(set(match.group(1) for match in ids)) == len(ids)
+
+        chains, after = self.chains(dumpFiles, independent)
+
+        # Largest first, so the longest loads are not left until last
+        chains.sort(key = lambda chain: sum(part['length'] for dumpFile, part in chain), reverse = True)
+        with ThreadPoolExecutor(max_workers = self.workers) as executor:
+            for result in [executor.submit(self.loadChain, chain) for chain in chains]:
+                result.result()
+
+        self.loadChain(after)
+
+
+    def report (self):
+        """
+        Prints the throughput of each table.
+        """
+        for label, (loaded, seconds) in sorted(self.throughput.items(), key = lambda item: item[1][1], reverse = True):
+            print('{}\t{:.1f}MB in {:.1f}s\t{:.1f}MB/s'.format(label, loaded / 1e6, seconds, loaded / 1e6 / seconds if seconds else 0))
+
+
+# Main
+if __name__ == '__main__':
+
+    # Read args supplied to script
+    parser = argparse.ArgumentParser(description = 'Restores dumps, loading independent tables in parallel.')
+    parser.add_argument('--defaults-extra-file', dest = 'defaultsExtraFile', help = 'MySQL credentials')
+    parser.add_argument('--workers', type = int, default = min(4, os.cpu_count() or 1), help = 'Number of tables loaded at once')
+    parser.add_argument('--batches', action = 'store_true', help = 'The dumps are batches of recent routes')
+    parser.add_argument('database')
+    parser.add_argument('dumpFiles', nargs = '+')
+    args = parser.parse_args()
+
+    restorer = parallelRestore(args.database)
+    restorer.defaultsExtraFile = args.defaultsExtraFile
+    restorer.workers = args.workers
+
+    restorer.restore(args.dumpFiles, args.batches)
+    restorer.report()
+
+
+# End of file
@@ -15,12 +15,46 @@ sudo ${SCRIPTDIRECTORY}/../utility/chownPhotomapWwwdata.sh ${websitesContentFold
 # The defaults-extra-file is a positional argument which must come first.
 superMysql="mysql --defaults-extra-file=${mySuperCredFile} -hlocalhost"
 
+# Restores dumps, loading independent tables in parallel using the parts manifest written with each dump, and reports their throughput
+parallelRestore="python3 ${SCRIPTDIRECTORY}/../utility/parallelRestore.py --defaults-extra-file ${mySuperCredFile}"
+
+# Optionally sync only the rows added or changed since the last update, which falls back to a full reload after a schema change, and weekly
+fullReload=true
+if [ -n "${incrementalSync}" ]; then
+
+    # Incremental sync engine, whose high-water marks are kept with the backups
+    syncer="python3 ${SCRIPTDIRECTORY}/../utility/incrementalSync.py --credentials ${mySuperCredFile} --remote-credentials ${mySuperCredFile} ${server} ${csFallbackDb} ${folder}/incrementalSync.json"
+
+    # Tolerate errors to examine the status
+    set +e
+    ${syncer} >> ${setupLogFile}
+    synced=$?
+    set -e
+
+    if [ $synced = 0 ]; then
+	fullReload=
+    elif [ $synced = 3 ]; then
+	# Fetch the full dump that was skipped by sync-recent.sh
+	$download $administratorEmail $server $folder ${dumpPrefix}_cyclestreets.sql.gz
+    else
+	echo "$(date --iso-8601=seconds)	Incremental sync of ${csFallbackDb} db failed" >> ${setupLogFile}
+	exit 1
+    fi
+fi
+
 # Replace the database
-echo "$(date --iso-8601=seconds)	Replacing ${csFallbackDb} db" >> ${setupLogFile}
-${superMysql} -e "drop database if exists ${csFallbackDb};";
-${superMysql} -e "create database ${csFallbackDb};";
-gunzip < /websites/www/backups/${dumpPrefix}_cyclestreets.sql.gz | ${superMysql} ${csFallbackDb}
-echo "$(date --iso-8601=seconds)	Replaced ${csFallbackDb} db" >> ${setupLogFile}
+if [ -n "${fullReload}" ]; then
+    echo "$(date --iso-8601=seconds)	Replacing ${csFallbackDb} db" >> ${setupLogFile}
+    ${superMysql} -e "drop database if exists ${csFallbackDb};";
+    ${superMysql} -e "create database ${csFallbackDb};";
+    ${parallelRestore} ${csFallbackDb} /websites/www/backups/${dumpPrefix}_cyclestreets.sql.gz >> ${setupLogFile}
+    echo "$(date --iso-8601=seconds)	Replaced ${csFallbackDb} db" >> ${setupLogFile}
+
+    # Record the high-water marks of the restored database for the next incremental sync
+    if [ -n "${incrementalSync}" ]; then
+	${syncer} --baseline
+    fi
+fi
 
 #	Stop duplicated cronning from the backup machine
 ${superMysql} ${csFallbackDb} -e "update map_config set pseudoCron = null;";
@@ -33,17 +67,41 @@ if [ "$restoreRecentRoutes" = true ]; then
 
     #	Find all route files with the named pattern that have been modified within the last 24 hours.
     files=$(ssh ${server} "find ${folder}/recentroutes -maxdepth 1 -name '${recentRoutes}' -type f -mtime 0 -print")
-    for f in $files
-    do
-	#	Get only the name component
-	fileName=$(basename $f)
 
-	#   Load them directly into the archive
-	gunzip < ${websitesBackupsFolder}/recentroutes/$fileName | ${superMysql} csArchive
-	echo "$(date --iso-8601=seconds)	Restored to archive: $fileName" >> ${setupLogFile}
+    #	With an incremental sync this can run several times a day, so the batches restored are recorded, by name, size and
+    #	modification time as kept by the rsync in sync-recent.sh, and skipped later unless they have been published again
+    restoredBatches=${websitesBackupsFolder}/recentroutes/restored.txt
+    if [ -n "${incrementalSync}" ]; then
+	touch ${restoredBatches}
+    fi
 
-	# !! Consider deleting the file now that it has been used
-	#    but review how that would work with the rsync in sync-recent.sh
+    #	The local copies, in order
+    batches=
+    for f in $(echo $files | tr ' ' '\n' | sort -V)
+    do
+	batch=${websitesBackupsFolder}/recentroutes/$(basename $f)
+	if [ -z "${incrementalSync}" ] || ! grep -qxF "$(stat -c '%n %s %Y' ${batch})" ${restoredBatches}; then
+	    batches+=" ${batch}"
+	fi
     done
+
+    #   Load them directly into the archive; batches that do not overlap are loaded in parallel
+    if [ -n "${batches}" ]; then
+	${parallelRestore} --batches csArchive ${batches} >> ${setupLogFile}
+	echo "$(date --iso-8601=seconds)	Restored to archive:${batches}" >> ${setupLogFile}
+
+	if [ -n "${incrementalSync}" ]; then
+	    for f in ${batches}
+	    do
+		stat -c '%n %s %Y' ${f} >> ${restoredBatches}
+	    done
+
+	    #	Keep the list to a week of batches
+	    tail -n 100 ${restoredBatches} > ${restoredBatches}.tmp && mv ${restoredBatches}.tmp ${restoredBatches}
+	fi
+    fi
+
+    # !! Consider deleting the files now that they have been used
+    #    but review how that would work with the rsync in sync-recent.sh
 fi
 #	End of file
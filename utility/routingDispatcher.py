@@ -0,0 +1,248 @@
+# Local dispatcher in front of a pool of routing workers serving one edition.
+#
+# Listens on the edition's port, where a single cyclestreets@<port> routing service would otherwise listen, and passes
+# each XML-RPC request to one of the edition's routing workers (cyclestreets@<workerPort>, see routingPool.py). The worker
+# chosen is the healthy one with the fewest requests in progress, so a worker held up by a long journey is passed over.
+# A request refused by a worker, as it is restarting, is tried on another; one lost after it may have reached a worker is
+# not repeated, but answered with an error.
+#
+# Each worker is checked every few seconds with a get_routing_edition call. The dispatcher writes the edition port's
+# status log, as the routing service does, saying serving while any worker is healthy, so the existing scripts that
+# wait on that log work unchanged.
+#
+# Workers can be drained, so they are sent no new requests, and resumed, by GET requests from this host to:
+#	/pool/status	/pool/drain/<workerPort>	/pool/resume/<workerPort>
+#
+# Synopsis
+#	routingDispatcher.py [--workers n] [--status-file file] [--timeout seconds] editionPort
+#
+# Example
+# cyclestreets@veebee:$
+# python3 utility/routingDispatcher.py --workers 4 --status-file /websites/www/logs/pythonAstarPort9000_status.log 9000
+
+# Dependencies
+import sys, os, json, time, socket, threading, http.client, argparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Call used to check a worker
+getRoutingEditionXML = b'<?xml version="1.0" encoding="utf-8"?><methodCall><methodName>get_routing_edition</methodName></methodCall>'
+
+# Addresses allowed to control the pool
+controlClients = ('127.0.0.1', '::1')
+
+def workerPorts (editionPort, workers):
+    """
+    Returns the ports of the workers of the edition on a port: worker i of port p listens on 40000 + (p - 8990) * 100 + i.
+    """
+    return [40000 + (editionPort - 8990) * 100 + index for index in range(workers)]
+
+
+class routingDispatcher ():
+    """
+    Spreads routing requests over a pool of workers by their queue depth and health.
+    """
+
+    def __init__(self, editionPort, ports):
+
+        # Where requests arrive, and the workers they are passed to
+        self.editionPort = editionPort
+        self.backends = {port: {'inFlight': 0, 'served': 0, 'healthy': False, 'draining': False, 'failures': 0, 'edition': None} for port in ports}
+        self.lock = threading.Lock()
+
+        # Options
+        self.statusFile = None
+        self.timeout = 300
+        self.checkSeconds = 5
+
+        # Status last written
+        self.status = None
+
+
+    def choose (self, tried):
+        """
+        Returns the port of the healthy worker with fewest requests in progress and marks it busy, or None.
+        When none is known to be healthy the others are tried, as they may have started since they were last checked.
+        """
+        with self.lock:
+            available = [port for port, backend in self.backends.items() if not backend['draining'] and port not in tried]
+            candidates = [port for port in available if self.backends[port]['healthy']] or available
+            if not candidates:
+                return None
+            port = min(candidates, key = lambda port: (self.backends[port]['inFlight'], self.backends[port]['served']))
+            self.backends[port]['inFlight'] += 1
+            return port
+
+
+    def release (self, port, delivered):
+        """
+        Marks a request to a worker finished, and the worker unhealthy if it could not be delivered.
+        """
+        with self.lock:
+            backend = self.backends[port]
+            backend['inFlight'] -= 1
+            if delivered:
+                backend['served'] += 1
+                backend['healthy'] = True
+            else:
+                backend['healthy'] = False
+                backend['failures'] += 1
+
+
+    def forward (self, body, contentType):
+        """
+        Passes a request to a worker, trying others if it cannot be delivered. Returns the status, content type and response.
+        """
+        tried = []
+        while True:
+            port = self.choose(tried)
+            if port is None:
+                return 503, 'text/plain', b'No routing worker is available\n'
+            tried.append(port)
+
+            connection = http.client.HTTPConnection('localhost', port, timeout = self.timeout)
+            try:
+                connection.request('POST', '/', body, {'Content-Type': contentType})
+                response = connection.getresponse()
+                data = response.read()
+            except socket.timeout:
+
+                # The worker may still be planning the journey, so it is not repeated on another
+                self.release(port, True)
+                return 504, 'text/plain', b'The routing worker timed out\n'
+            except ConnectionRefusedError:
+
+                # Nothing was sent, as the worker is not listening, so it is safe to try another
+                self.release(port, False)
+                continue
+            except OSError:
+
+                # The worker may have received the request, so it is not repeated on another
+                self.release(port, False)
+                return 502, 'text/plain', b'The routing worker failed\n'
+            finally:
+                connection.close()
+
+            self.release(port, True)
+            return response.status, response.getheader('Content-Type', 'text/xml'), data
+
+
+    def check (self, port):
+        """
+        Checks a worker, recording whether it is healthy and the edition it serves.
+        """
+        connection = http.client.HTTPConnection('localhost', port, timeout = 5)
+        try:
+            connection.request('POST', '/', getRoutingEditionXML, {'Content-Type': 'text/xml'})
+            response = connection.getresponse()
+            data = response.read()
+            healthy = response.status == 200
+        except OSError:
+            healthy, data = False, b''
+        finally:
+            connection.close()
+
+        with self.lock:
+            backend = self.backends[port]
+            backend['healthy'] = healthy
+            if healthy:
+                start = data.find(b'<string>')
+                backend['edition'] = data[start + 8:data.find(b'</string>', start)].decode('utf8', 'replace') if start != -1 else None
+            else:
+                backend['failures'] += 1
+
+
+    def writeStatus (self):
+        """
+        Writes the status log of the edition port, when it has changed.
+        """
+        with self.lock:
+            healthy = sum(1 for backend in self.backends.values() if backend['healthy'])
+        status = 'serving' if healthy else 'starting'
+        if status == self.status or not self.statusFile:
+            return
+        with open(self.statusFile, 'w') as f:
+            f.write(status + '\n')
+        self.status = status
+
+
+    def monitor (self):
+        """
+        Checks the workers periodically.
+        """
+        while True:
+            for port in list(self.backends):
+                self.check(port)
+            self.writeStatus()
+            time.sleep(self.checkSeconds)
+
+
+    def control (self, path):
+        """
+        Handles a control request, returning the result as a dict, or None if the path is not recognised.
+        """
+        parts = path.strip('/').split('/')
+        if parts[0] != 'pool':
+            return None
+        with self.lock:
+            if len(parts) == 3 and parts[1] in ('drain', 'resume') and parts[2].isdigit() and int(parts[2]) in self.backends:
+                self.backends[int(parts[2])]['draining'] = parts[1] == 'drain'
+            elif parts[1:] != ['status']:
+                return None
+            return {'editionPort': self.editionPort, 'workers': {str(port): dict(backend) for port, backend in self.backends.items()}}
+
+
+    def serve (self):
+        """
+        Serves requests until stopped.
+        """
+        dispatcher = self
+
+        class handler (BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST (self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                self.respond(*dispatcher.forward(body, self.headers.get('Content-Type', 'text/xml')))
+
+            def do_GET (self):
+                result = dispatcher.control(self.path) if self.client_address[0] in controlClients else None
+                if result is None:
+                    self.respond(404, 'text/plain', b'Not found\n')
+                else:
+                    self.respond(200, 'application/json', json.dumps(result).encode('utf8'))
+
+            def respond (self, status, contentType, data):
+                self.send_response(status)
+                self.send_header('Content-Type', contentType)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message (self, format, *args):
+                pass
+
+        threading.Thread(target = self.monitor, daemon = True).start()
+        server = ThreadingHTTPServer(('', self.editionPort), handler)
+        server.daemon_threads = True
+        server.serve_forever()
+
+
+# Main
+if __name__ == '__main__':
+
+    # Read args supplied to script
+    parser = argparse.ArgumentParser(description = 'Dispatches routing requests over a pool of workers.')
+    parser.add_argument('--workers', type = int, default = max(1, (os.cpu_count() or 2) // 2), help = 'Number of routing workers of the edition')
+    parser.add_argument('--status-file', dest = 'statusFile', help = 'Status log of the edition port')
+    parser.add_argument('--timeout', type = int, default = 300, help = 'Seconds allowed for a worker to respond')
+    parser.add_argument('editionPort', type = int)
+    args = parser.parse_args()
+
+    dispatcher = routingDispatcher(args.editionPort, workerPorts(args.editionPort, args.workers))
+    dispatcher.statusFile = args.statusFile
+    dispatcher.timeout = args.timeout
+
+    dispatcher.serve()
+
+
+# End of file
@@ -0,0 +1,432 @@
+# Streaming, parallel installer for a routing edition tarball.
+#
+# Used by live-deployment/install-routing-data.sh and install-pois-data.sh when parallelRoutingInstall is set, in place
+# of their serial scp, md5sum -c, tar xf and mysqlimport stages. The routingYYMMDD.tar.zst tarball is streamed from the import
+# host over ssh, checksummed as it arrives and decompressed as a stream. Each TSV of the routing database is
+# written straight to where MySQL can read it and handed to a pool of workers, one table each, which disable
+# the indexes, load the data and rebuild the indexes (see bulkLoader.py), while the stream carries on with the next member.
+# Every other member is unpacked into the routing folder as tar would.
+#
+# With --database the tables are loaded into that existing database instead, as POI editions are loaded into the external
+# database under names which their installPoiTables.sql then renames into place.
+#
+# Each table's rows, and the md5 of its TSV as it arrives, are checked against table/manifest.txt (lines of: table, rows,
+# md5, tab separated) when the edition has one. The manifest is optional, and is written by the import, which is outside
+# this repository; without it the only check is of each table's loaded rows against the lines of its TSV, not counting
+# the newlines within values which MySQL writes escaped by a backslash.
+# If the checksum does not match the md5 published alongside the tarball, or a table does not match, the install fails;
+# a new routing database is dropped, as are the tables loaded or created in an existing database.
+# Timings of each stage and the load profile of each table are reported at the end.
+#
+# Synopsis
+#	routingEditionInstaller.py [options] importHostname importMachineEditions edition routingFolder
+#
+# Example
+# cyclestreets@veebee:$
+# python3 utility/routingEditionInstaller.py --defaults-extra-file ~/.mySuperUserCredentials.cnf --secure-file-priv /var/lib/mysql-files/ imports.cyclestreets.net /websites/www/import/output routing241010 /websites/www/content/data/routing
+
+# Dependencies
+import sys, os, time, hashlib, tarfile, threading, subprocess, argparse
+from concurrent.futures import ThreadPoolExecutor
+from bulkLoader import bulkLoader
+
+def escapedNewlines (block, backslashes = 0):
+    """
+    Returns the number of newlines in a block which are escaped, as MySQL writes those within values, given the number of backslashes ending the block before.
+    """
+    escaped = 0
+    if block[:1] == b'\n' and backslashes % 2:
+        escaped += 1
+    index = block.find(b'\\\n')
+    while index != -1:
+
+        # The newline is escaped if an odd number of backslashes precede it, as a backslash is itself escaped by one
+        start = index
+        while start > 0 and block[start - 1] == 0x5c:
+            start -= 1
+        run = index + 1 - start + (backslashes if start == 0 else 0)
+        if run % 2:
+            escaped += 1
+        index = block.find(b'\\\n', index + 2)
+    return escaped
+
+
+class routingEditionInstaller ():
+    """
+    Streams a routing edition tarball from the import host and loads its routing database tables in parallel.
+    """
+
+    def __init__(self, importHostname, importMachineEditions, edition, routingFolder):
+
+        # Source
+        self.importHostname = importHostname
+        self.importMachineEditions = importMachineEditions
+        self.edition = edition
+        self.tarball = edition + '.tar.zst'
+
+        # Destination
+        self.routingFolder = routingFolder
+
+        # Options, as the shell script uses them
+        self.sshPort = None
+        self.username = os.environ.get('USER', 'cyclestreets')
+        self.defaultsExtraFile = None
+        self.secureFilePriv = ''
+        self.skipRoutingDb = False
+        self.database = None
+
+        # Loader of the routing database tables, whose options such as workers are set by the caller
+        self.loader = bulkLoader(edition)
+
+        # Per table, the lines and md5 of its TSV as written, and the manifest if the edition has one
+        self.tsvs = {}
+        self.manifest = None
+
+        # Tables of an existing database before the table definitions were loaded
+        self.existingTables = None
+
+        # Timings in seconds, as (stage, seconds) in the order they finished
+        self.timings = []
+        self.timingsLock = threading.Lock()
+
+
+    def ssh (self):
+        """
+        Returns the start of an ssh command to the import host, or nothing when that is this host.
+        """
+        if self.importHostname == 'localhost':
+            return []
+        command = ['ssh']
+        if self.sshPort:
+            command.append('-p' + self.sshPort)
+        return command + [self.username + '@' + self.importHostname]
+
+
+    def mysql (self, database = None):
+        """
+        Returns the start of a mysql command using the super user credentials.
+        """
+        command = ['mysql']
+        if self.defaultsExtraFile:
+            command.append('--defaults-extra-file=' + self.defaultsExtraFile)
+        command.append('-hlocalhost')
+        if database:
+            command.append(database)
+        return command
+
+
+    def record (self, stage, started):
+        """
+        Records the time since a stage started.
+        """
+        with self.timingsLock:
+            self.timings.append((stage, time.time() - started))
+
+
+    def expectedMd5 (self):
+        """
+        Returns the md5 published with the tarball, which is in md5sum format.
+        """
+        path = self.importMachineEditions + '/' + self.tarball + '.md5'
+        published = subprocess.run(self.ssh() + ['cat', path], check = True, capture_output = True, text = True).stdout
+        return published.split()[0]
+
+
+    def tableFolder (self):
+        """
+        Returns the folder from which MySQL can read the routing database tables.
+        """
+        if self.secureFilePriv:
+            return os.path.join(self.secureFilePriv, self.edition, 'table')
+        return os.path.join(self.routingFolder, self.edition, 'table')
+
+
+    def createDatabase (self, definitions):
+        """
+        Creates the routing database, unless loading into an existing one, and its tables.
+        """
+        started = time.time()
+        self.created = True
+        if self.database:
+            self.existingTables = set(self.tables())
+        else:
+            subprocess.run(self.mysql() + ['-e', 'create database {};'.format(self.edition)], check = True)
+        with open(definitions, 'rb') as f:
+            subprocess.run(self.mysql(self.loader.database), stdin = f, check = True)
+        self.record('Table definitions', started)
+
+
+    def tables (self):
+        """
+        Returns the tables of the database loaded into.
+        """
+        return subprocess.run(self.mysql(self.loader.database) + ['-N', '-B', '-e', 'show tables;'], check = True, capture_output = True, text = True).stdout.split()
+
+
+    def pump (self, source, destination, digest):
+        """
+        Copies the compressed stream into the decompressor, checksumming it on the way.
+        """
+        try:
+            while True:
+                block = source.read(1024 * 1024)
+                if not block:
+                    break
+                digest.update(block)
+                destination.write(block)
+        except OSError:
+            # The decompressor has gone, which the install sees from its exit status
+            pass
+        finally:
+            try:
+                destination.close()
+            except OSError:
+                pass
+
+
+    def writeTsv (self, source, tsv):
+        """
+        Writes a TSV from the stream, recording its lines and md5.
+        """
+        digest = hashlib.md5()
+        lines = 0
+        last = b'\n'
+        backslashes = 0
+        with open(tsv, 'wb') as destination:
+            while True:
+                block = source.read(1024 * 1024)
+                if not block:
+                    break
+                digest.update(block)
+                lines += block.count(b'\n') - escapedNewlines(block, backslashes)
+                last = block[-1:]
+                trailing = len(block) - len(block.rstrip(b'\\'))
+                backslashes = backslashes + trailing if trailing == len(block) else trailing
+                destination.write(block)
+        os.chmod(tsv, 0o644)
+
+        # A last line without a newline is still a row
+        if last != b'\n':
+            lines += 1
+        self.tsvs[os.path.basename(tsv)[:-len('.tsv')]] = {'lines': lines, 'md5': digest.hexdigest()}
+
+
+    def readManifest (self, path):
+        """
+        Reads the manifest of the tables, as lines of table, rows and md5.
+        """
+        self.manifest = {}
+        with open(path) as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) == 3:
+                    self.manifest[fields[0]] = {'rows': int(fields[1]), 'md5': fields[2]}
+
+
+    def validate (self):
+        """
+        Returns the problems found checking the loaded tables against their TSVs and the manifest.
+        """
+        problems = []
+        if self.skipRoutingDb:
+            return problems
+        loaded = {entry['table']: entry['rows'] for entry in self.loader.profile}
+        for table, tsv in sorted(self.tsvs.items()):
+
+            # The manifest's count of rows is preferred to the lines
+            if self.manifest and table in self.manifest:
+                continue
+            if loaded.get(table) != tsv['lines']:
+                problems.append('{} loaded {} rows from {:d} lines'.format(table, loaded.get(table), tsv['lines']))
+
+        if self.manifest is not None:
+            for table, expected in sorted(self.manifest.items()):
+                tsv = self.tsvs.get(table)
+                if tsv is None:
+                    problems.append('{} is in the manifest but not the tarball'.format(table))
+                    continue
+                if tsv['md5'] != expected['md5']:
+                    problems.append('{} has md5 {}, the manifest {}'.format(table, tsv['md5'], expected['md5']))
+                if loaded.get(table) != expected['rows']:
+                    problems.append('{} loaded {} rows, the manifest {:d}'.format(table, loaded.get(table), expected['rows']))
+            problems += ['{} is not in the manifest'.format(table) for table in sorted(set(self.tsvs) - set(self.manifest))]
+        return problems
+
+
+    def abandon (self):
+        """
+        Drops a new routing database, or the tables loaded or created in an existing database.
+        """
+        if not self.database:
+            subprocess.run(self.mysql() + ['-e', 'drop database if exists {};'.format(self.edition)])
+            return
+
+        # Tables that had been left by an earlier attempt are dropped if this one loaded them
+        tables = [table for table in self.tables() if table in self.tsvs or (self.existingTables is not None and table not in self.existingTables)]
+        if tables:
+            subprocess.run(self.mysql(self.database) + ['-e', 'drop table if exists {};'.format(', '.join('`{}`'.format(table) for table in tables))])
+
+
+    def install (self):
+        """
+        Streams the tarball, unpacking and loading it. Returns True on success.
+        """
+        self.created = False
+        try:
+            return self.stream()
+        except Exception as e:
+            print('#\tInstall of {} failed: {}'.format(self.edition, e), file = sys.stderr)
+            if self.created:
+                self.abandon()
+            return False
+
+
+    def stream (self):
+        """
+        Streams the tarball through the unpacking and the loads, then checks the result. Returns True on success.
+        """
+        started = time.time()
+        expected = self.expectedMd5()
+
+        # Compressed stream from the import host, through a checksumming pump, into zstd
+        transfer = subprocess.Popen(self.ssh() + ['cat', self.importMachineEditions + '/' + self.tarball], stdout = subprocess.PIPE)
+        decompress = subprocess.Popen(['zstd', '-dc'], stdin = subprocess.PIPE, stdout = subprocess.PIPE)
+        digest = hashlib.md5()
+        pump = threading.Thread(target = self.pump, args = (transfer.stdout, decompress.stdin, digest))
+        pump.start()
+
+        tableFolder = self.tableFolder()
+        os.makedirs(tableFolder, exist_ok = True)
+        definitionsLoaded = False
+        waiting = []
+        loads = []
+
+        self.loader.defaultsExtraFile = self.defaultsExtraFile
+        with ThreadPoolExecutor(max_workers = self.loader.workers) as executor:
+            try:
+                with tarfile.open(fileobj = decompress.stdout, mode = 'r|') as tar:
+                    for member in tar:
+
+                        # Members are named edition/folder/file
+                        parts = member.name.split('/')
+                        isTable = len(parts) == 3 and parts[1] == 'table' and member.isfile()
+
+                        if isTable and parts[2].endswith('.tsv') and not self.skipRoutingDb:
+
+                            # Write where MySQL can read it, then queue its load
+                            tsv = os.path.join(tableFolder, parts[2])
+                            with tar.extractfile(member) as source:
+                                self.writeTsv(source, tsv)
+
+                            # Tables can only load once they have been defined
+                            if definitionsLoaded:
+                                loads.append(executor.submit(self.loader.loadTable, tsv))
+                            else:
+                                waiting.append(tsv)
+                            continue
+
+                        # Anything else is unpacked as tar would, though never outside the routing folder
+                        tar.extract(member, self.routingFolder, filter = 'data')
+
+                        if isTable and parts[2] == 'tableDefinitions.sql' and not self.skipRoutingDb:
+                            self.createDatabase(os.path.join(self.routingFolder, member.name))
+                            definitionsLoaded = True
+                            loads += [executor.submit(self.loader.loadTable, tsv) for tsv in waiting]
+                            waiting = []
+
+                        if isTable and parts[2] == 'manifest.txt':
+                            self.readManifest(os.path.join(self.routingFolder, member.name))
+
+            except BaseException:
+                # Stop the stream so the pump is not left blocked on a decompressor no longer read, and any queued loads
+                executor.shutdown(wait = False, cancel_futures = True)
+                transfer.kill()
+                decompress.kill()
+                raise
+
+            finally:
+                pump.join()
+                transfer.wait()
+                decompress.wait()
+                self.record('Transfer and unpack', started)
+
+            # Raise any load failure
+            for load in loads:
+                load.result()
+
+        # Tables that never had definitions
+        if waiting:
+            print('#\tNo table definitions were found for: {}'.format(', '.join(waiting)), file = sys.stderr)
+            return False
+
+        # The whole stream has been checked now
+        if transfer.returncode or decompress.returncode or digest.hexdigest() != expected:
+            print('#\tFailed md5 check of {} from {}'.format(self.tarball, self.importHostname), file = sys.stderr)
+            if self.created:
+                self.abandon()
+            return False
+
+        # Every table must have loaded in full
+        problems = self.validate()
+        if problems:
+            for problem in problems:
+                print('#\tTable check failed: {}'.format(problem), file = sys.stderr)
+            self.abandon()
+            return False
+
+        # Clean up
+        if not os.listdir(tableFolder):
+            os.rmdir(tableFolder)
+        if not self.skipRoutingDb:
+            self.loader.writeProfile(os.path.join(self.routingFolder, self.edition, 'loadProfile.{}.json'.format(self.edition)))
+
+        self.record('Total', started)
+        return True
+
+
+    def report (self):
+        """
+        Prints the timings.
+        """
+        for stage, seconds in self.timings:
+            print('#\t{:<48} {:8.1f}s'.format(stage, seconds))
+        self.loader.report()
+
+
+# Main
+if __name__ == '__main__':
+
+    # Read args supplied to script
+    parser = argparse.ArgumentParser(description = 'Streams and installs a routing edition.')
+    parser.add_argument('--ssh-port', dest = 'sshPort', help = 'Port for ssh connections to the import host')
+    parser.add_argument('--username', default = os.environ.get('USER', 'cyclestreets'), help = 'User on the import host')
+    parser.add_argument('--defaults-extra-file', dest = 'defaultsExtraFile', help = 'MySQL super user credentials')
+    parser.add_argument('--secure-file-priv', dest = 'secureFilePriv', default = '', help = 'Folder from which MySQL may read files, if restricted')
+    parser.add_argument('--skip-routing-db', dest = 'skipRoutingDb', action = 'store_true', help = 'Unpack only, without installing the routing database')
+    parser.add_argument('--workers', type = int, default = os.cpu_count(), help = 'Number of tables loaded at once')
+    parser.add_argument('--database', help = 'Existing database into which the tables are loaded, rather than a new routing database')
+    parser.add_argument('-q', dest = 'quiet', action = 'store_true', help = 'Do not report timings')
+    parser.add_argument('importHostname')
+    parser.add_argument('importMachineEditions')
+    parser.add_argument('edition')
+    parser.add_argument('routingFolder')
+    args = parser.parse_args()
+
+    installer = routingEditionInstaller(args.importHostname, args.importMachineEditions, args.edition, args.routingFolder)
+    installer.sshPort = args.sshPort
+    installer.username = args.username
+    installer.defaultsExtraFile = args.defaultsExtraFile
+    installer.secureFilePriv = args.secureFilePriv
+    installer.skipRoutingDb = args.skipRoutingDb
+    installer.loader.workers = args.workers
+    if args.database:
+        installer.database = args.database
+        installer.loader.database = args.database
+
+    success = installer.install()
+    if not args.quiet:
+        installer.report()
+    sys.exit(0 if success else 1)
+
+
+# End of file
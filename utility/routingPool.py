@@ -0,0 +1,212 @@
+# Supervisor of a pool of routing workers serving one edition behind a local dispatcher.
+#
+# Rather than one cyclestreets@<port> routing service per edition, several workers are run on ports of their own
+# (see workerPorts in routingDispatcher.py), each configured with the edition linked at routingengine/.config.<port>.json,
+# and the cyclestreets-dispatcher@<port> service spreads the requests to the edition's port over them.
+#
+# A restart is rolling: each worker in turn is drained at the dispatcher, left to finish the requests it has in
+# progress, linked to the edition's current configuration, restarted and resumed once it is serving again, so no
+# request is dropped and the others carry on serving throughout. If the dispatcher is not running, the pool is started.
+# A worker that does not drain, or does not become healthy again, in time stops the restart with an error rather than
+# being restarted with requests in progress.
+#
+# The units for port 9000 are enabled at boot, in place of cyclestreets@9000, by install-website/run.sh when routingWorkers
+# is set; a pool on any other port is started by this script and does not survive a reboot.
+#
+# Synopsis
+#	routingPool.py [--workers n] [--content-folder folder] [--logs-folder folder] start|restart|stop|status editionPort
+#
+# Example
+# cyclestreets@veebee:$
+# python3 utility/routingPool.py --workers 4 restart 9000
+
+# Dependencies
+import sys, os, json, time, subprocess, urllib.request, argparse
+from routingDispatcher import workerPorts
+
+class routingPool ():
+    """
+    Starts, stops and restarts the routing workers of an edition one at a time.
+    """
+
+    def __init__(self, editionPort):
+
+        # Edition port, where the dispatcher listens
+        self.editionPort = editionPort
+
+        # Options
+        self.workers = max(1, (os.cpu_count() or 2) // 2)
+        self.contentFolder = '/websites/www/content'
+        self.logsFolder = '/websites/www/logs'
+
+        # Seconds allowed for a worker to finish its requests, and to start
+        self.drainSeconds = 300
+        self.startSeconds = 3600
+
+
+    def ports (self):
+        return workerPorts(self.editionPort, self.workers)
+
+
+    def configFile (self, port):
+        """
+        Returns the routing engine configuration of the service on a port.
+        """
+        return os.path.join(self.contentFolder, 'routingengine', '.config.{:d}.json'.format(port))
+
+
+    def link (self, port):
+        """
+        Links a worker's configuration to the edition configured for the edition port.
+        """
+        target = os.path.realpath(self.configFile(self.editionPort))
+        if not os.path.exists(target):
+            raise RuntimeError('The routing configuration {} is absent'.format(self.configFile(self.editionPort)))
+        config = self.configFile(port)
+        if os.path.lexists(config):
+            os.unlink(config)
+        os.symlink(target, config)
+
+
+    def systemctl (self, action, unit, check = True):
+        """
+        Runs a systemctl command, as allowed by passwordless sudo.
+        """
+        return subprocess.run(['sudo', '/bin/systemctl', action, unit], check = check).returncode
+
+
+    def control (self, path):
+        """
+        Sends a control request to the dispatcher, returning its result, or None if it is not running.
+        """
+        try:
+            with urllib.request.urlopen('http://localhost:{:d}/pool/{}'.format(self.editionPort, path), timeout = 10) as response:
+                return json.load(response)
+        except (OSError, ValueError):
+            return None
+
+
+    def waitServing (self, port):
+        """
+        Waits until a worker's status log says it is serving.
+        """
+        statusLog = os.path.join(self.logsFolder, 'pythonAstarPort{:d}_status.log'.format(port))
+        waited = 0
+        sleep = 1
+        while waited < self.startSeconds:
+            try:
+                with open(statusLog) as f:
+                    if 'serving' in f.read():
+                        return
+            except OSError:
+                pass
+            time.sleep(sleep)
+            waited += sleep
+            sleep = min(sleep + 1, 30)
+        raise RuntimeError('The routing worker on port {:d} did not start within {:d}s'.format(port, self.startSeconds))
+
+
+    def waitDispatcher (self, port, condition, description):
+        """
+        Waits until the dispatcher reports a condition of a worker, such as being idle or healthy.
+        """
+        waited = 0
+        while waited < self.drainSeconds:
+            status = self.control('status')
+            if status is None:
+                raise RuntimeError('The dispatcher on port {:d} stopped while waiting for routing worker {:d} to be {}'.format(self.editionPort, port, description))
+            if condition(status['workers'][str(port)]):
+                return
+            time.sleep(1)
+            waited += 1
+        raise RuntimeError('The routing worker on port {:d} was not {} within {:d}s'.format(port, description, self.drainSeconds))
+
+
+    def start (self):
+        """
+        Starts the workers and the dispatcher, in place of a single routing service on the edition port.
+        """
+        self.systemctl('stop', 'cyclestreets@{:d}'.format(self.editionPort), check = False)
+        for port in self.ports():
+            self.link(port)
+            self.systemctl('restart', 'cyclestreets@{:d}'.format(port))
+        self.systemctl('restart', 'cyclestreets-dispatcher@{:d}'.format(self.editionPort))
+        self.waitServing(self.ports()[0])
+
+
+    def restart (self):
+        """
+        Restarts the workers one at a time, without dropping requests.
+        """
+        if self.control('status') is None:
+            print('#\tThe dispatcher on port {:d} is not running, so the pool is being started'.format(self.editionPort))
+            self.start()
+            return
+
+        for port in self.ports():
+            print('#\t{}\tRestarting routing worker {:d}'.format(time.strftime('%H:%M:%S'), port))
+            self.control('drain/{:d}'.format(port))
+            try:
+                self.waitDispatcher(port, lambda worker: worker['inFlight'] == 0, 'drained')
+            except RuntimeError:
+                # Leave the worker serving its edition as before
+                self.control('resume/{:d}'.format(port))
+                raise
+
+            # The status log shows the worker has started again once it is replaced
+            statusLog = os.path.join(self.logsFolder, 'pythonAstarPort{:d}_status.log'.format(port))
+            if os.path.exists(statusLog):
+                os.unlink(statusLog)
+            self.link(port)
+            self.systemctl('restart', 'cyclestreets@{:d}'.format(port))
+            self.waitServing(port)
+
+            self.control('resume/{:d}'.format(port))
+            self.waitDispatcher(port, lambda worker: worker['healthy'], 'healthy')
+
+
+    def stop (self):
+        """
+        Stops the dispatcher and the workers.
+        """
+        self.systemctl('stop', 'cyclestreets-dispatcher@{:d}'.format(self.editionPort), check = False)
+        for port in self.ports():
+            self.systemctl('stop', 'cyclestreets@{:d}'.format(port), check = False)
+
+
+    def status (self):
+        """
+        Prints the state of each worker as the dispatcher sees it.
+        """
+        status = self.control('status')
+        if status is None:
+            print('#\tThe dispatcher on port {:d} is not running'.format(self.editionPort))
+            return False
+        for port, worker in sorted(status['workers'].items()):
+            print('#\t{}\t{}\t{}\tin progress: {:d}\tserved: {:d}\t{}'.format(port, 'healthy' if worker['healthy'] else 'unhealthy', 'draining' if worker['draining'] else 'active', worker['inFlight'], worker['served'], worker['edition']))
+        return True
+
+
+# Main
+if __name__ == '__main__':
+
+    # Read args supplied to script
+    parser = argparse.ArgumentParser(description = 'Supervises a pool of routing workers behind a dispatcher.')
+    parser.add_argument('--workers', type = int, default = max(1, (os.cpu_count() or 2) // 2), help = 'Number of routing workers of the edition')
+    parser.add_argument('--content-folder', dest = 'contentFolder', default = '/websites/www/content', help = 'Website content folder')
+    parser.add_argument('--logs-folder', dest = 'logsFolder', default = '/websites/www/logs', help = 'Website logs folder')
+    parser.add_argument('action', choices = ('start', 'restart', 'stop', 'status'))
+    parser.add_argument('editionPort', type = int)
+    args = parser.parse_args()
+
+    pool = routingPool(args.editionPort)
+    pool.workers = args.workers
+    pool.contentFolder = args.contentFolder
+    pool.logsFolder = args.logsFolder
+
+    if args.action == 'status':
+        sys.exit(0 if pool.status() else 1)
+    getattr(pool, args.action)()
+
+
+# End of file
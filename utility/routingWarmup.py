@@ -0,0 +1,266 @@
+# Warm-up and readiness check of a newly started routing service, before traffic is moved over to it.
+#
+# A freshly started routing service has a cold graph and cold MySQL buffers, so the first journeys it plans are slow.
+# This takes a representative sample of recent journey requests from the access log, spread evenly over the last hour,
+# and replays them directly against the routing service at a controlled concurrency. The first pass warms the service;
+# the second is timed and its latency percentiles reported.
+#
+# The timed percentiles are compared with those saved by the warm-up of the edition being replaced, given by
+# --previous-edition, or else of the edition most recently warmed other than this --edition; when there are none, with the
+# response times logged for the sampled requests. If the new edition is slower than that beyond the threshold, or too
+# many replayed journeys fail, this exits with status 1 so that the switch can be abandoned. The percentiles are saved
+# under this edition whether or not it passes, so that one slow edition does not leave later ones compared with an ever
+# older baseline.
+#
+# The journey is planned by an XML-RPC call whose method, which must be given by --method, is passed the parameters of the
+# journey API request. If every failed journey is an XML-RPC fault, the service most likely does not know that method,
+# which is reported, and the check fails as for any other failures.
+#
+# Synopsis
+#	routingWarmup.py [--sample n] [--concurrency n] [--window minutes] [--threshold ratio] [--baseline file] [--edition name] [--previous-edition name] --method name logFile routingUrl
+#
+# Result
+#	Exits with status 0 when the new edition may be switched to, otherwise 1.
+#
+# Example
+# cyclestreets@veebee:$
+# python3 utility/routingWarmup.py --baseline /websites/www/logs/routingWarmup9000.json --edition routing241010 --previous-edition routing240910 /websites/www/logs/veebee-access.log http://localhost:9000/
+
+# Dependencies
+import sys, os, json, time, threading, argparse, xmlrpc.client
+import urllib.parse
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from accessLogLingerStats import accessLogLingerStats
+from lingerTimings import lingerTimings
+
+# Request parameters not passed on to the routing service
+ignoredParameters = ('key', 'callback', 'reporterrors')
+
+# Percentiles reported and compared
+reportedQuantiles = (0.5, 0.9, 0.99)
+
+# Number of editions whose percentiles are kept in the baseline file
+keptEditions = 10
+
+class routingWarmup ():
+    """
+    Replays recent journeys against a routing service and compares its latency with the edition it replaces.
+    """
+
+    def __init__(self, logfile, routingUrl):
+
+        # Source of the journeys and the service replayed against
+        self.logfile = logfile
+        self.routingUrl = routingUrl
+
+        # Options
+        self.sampleSize = 200
+        self.concurrency = 4
+        self.windowMinutes = 60
+        self.threshold = 1.5
+        self.maximumErrorRate = 0.05
+        self.baselineFile = None
+        self.edition = ''
+        self.previousEdition = None
+        self.method = None
+
+        # Sampled journeys, as (parameters, logged milliseconds)
+        self.journeys = []
+
+        # Results of the timed pass, with the faults among the errors and the last fault's message
+        self.timings = lingerTimings()
+        self.errors = 0
+        self.faults = 0
+        self.fault = None
+        self.lock = threading.Lock()
+
+        # Proxy for each thread, as the connection is not shared
+        self.local = threading.local()
+
+
+    def sample (self):
+        """
+        Samples successful journey requests from the access log, evenly spread over the window.
+        """
+        als = accessLogLingerStats(self.logfile)
+        needle = als.apiCall.encode('utf8')
+        end = datetime.now()
+        start = end - timedelta(minutes = self.windowMinutes)
+
+        # Distinct journeys, in the order logged
+        journeys = {}
+        for line in als.linesBetween(start, end):
+            if needle not in line:
+                continue
+            match = als.lineFormat.search(line)
+            if not match or match.group('status') != b'200':
+                continue
+
+            # The request is as: GET /v2/journey.plan?itinerarypoints=...&plan=fastest HTTP/1.1
+            fields = match.group('request').decode('utf8', 'replace').split(' ')
+            if len(fields) < 2:
+                continue
+            query = urllib.parse.urlsplit(fields[1]).query
+            parameters = {name: value for name, value in urllib.parse.parse_qsl(query) if name not in ignoredParameters}
+            if 'itinerarypoints' not in parameters:
+                continue
+            key = tuple(sorted(parameters.items()))
+            if key not in journeys:
+                journeys[key] = (parameters, int(match.group('micro')) / 1000)
+
+        found = list(journeys.values())
+        step = max(1, len(found) / self.sampleSize)
+        self.journeys = [found[int(index * step)] for index in range(min(self.sampleSize, len(found)))]
+        return len(self.journeys)
+
+
+    def plan (self, parameters):
+        """
+        Plans one journey, returning the milliseconds taken, the fault if the service returned one, or None if it failed otherwise.
+        """
+        if not hasattr(self.local, 'proxy'):
+            self.local.proxy = xmlrpc.client.ServerProxy(self.routingUrl)
+        started = time.time()
+        try:
+            getattr(self.local.proxy, self.method)(parameters)
+        except xmlrpc.client.Fault as fault:
+            return fault
+        except (xmlrpc.client.Error, OSError):
+            self.local.__dict__.pop('proxy', None)
+            return None
+        return (time.time() - started) * 1000
+
+
+    def replay (self, timed):
+        """
+        Replays the sample at the set concurrency, recording the timings if this pass is timed.
+        """
+        with ThreadPoolExecutor(max_workers = self.concurrency) as executor:
+            for milliseconds in executor.map(self.plan, [parameters for parameters, logged in self.journeys]):
+                if not timed:
+                    continue
+                with self.lock:
+                    if isinstance(milliseconds, xmlrpc.client.Fault):
+                        self.errors += 1
+                        self.faults += 1
+                        self.fault = milliseconds.faultString
+                    elif milliseconds is None:
+                        self.errors += 1
+                    else:
+                        self.timings.add(int(milliseconds))
+
+
+    def readEditions (self):
+        """
+        Returns the saved warm-ups of each edition, as dicts of when, journeys and percentiles keyed by edition.
+        """
+        try:
+            with open(self.baselineFile) as f:
+                return json.load(f)['editions']
+        except (OSError, ValueError, KeyError, TypeError):
+            return {}
+
+
+    def baseline (self):
+        """
+        Returns the percentiles to compare with, keyed by quantile as a string, and where they came from.
+        """
+        if self.baselineFile:
+            editions = self.readEditions()
+            if self.previousEdition in editions:
+                return editions[self.previousEdition]['percentiles'], self.previousEdition
+            others = [(entry['when'], edition) for edition, entry in editions.items() if not self.edition or edition != self.edition]
+            if others:
+                edition = max(others)[1]
+                return editions[edition]['percentiles'], edition or 'previous warm-up'
+
+        logged = lingerTimings()
+        for parameters, milliseconds in self.journeys:
+            logged.add(int(milliseconds))
+        return {str(q): value for q, value in logged.quantiles(reportedQuantiles).items()}, 'access log'
+
+
+    def saveBaseline (self, percentiles):
+        """
+        Saves the percentiles of this warm-up under its edition, keeping those of the most recent editions.
+        """
+        editions = self.readEditions()
+        editions[self.edition] = {'when': time.strftime('%Y-%m-%dT%H:%M:%S'), 'journeys': self.timings.count, 'percentiles': percentiles}
+        editions = dict(sorted(editions.items(), key = lambda item: item[1]['when'])[-keptEditions:])
+        temporary = self.baselineFile + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump({'editions': editions}, f)
+        os.replace(temporary, self.baselineFile)
+
+
+    def check (self):
+        """
+        Warms the service and checks it is fast enough. Returns True when it may be switched to.
+        """
+        if not self.sample():
+            print('#\tNo recent journeys in {}, so the warm-up is skipped'.format(self.logfile))
+            return True
+
+        started = time.time()
+        self.replay(timed = False)
+        print('#\tWarmed with {:d} journeys in {:.0f}s, concurrency {:d}'.format(len(self.journeys), time.time() - started, self.concurrency))
+        self.replay(timed = True)
+
+        # Failures
+        errorRate = self.errors / len(self.journeys)
+        if errorRate > self.maximumErrorRate:
+            print('#\t{:d} of {:d} replayed journeys failed'.format(self.errors, len(self.journeys)))
+            if self.faults == self.errors:
+                print('#\tEvery failure was a fault, so the method {} is probably unknown to the service: {}'.format(self.method, self.fault))
+            return False
+
+        # Compare
+        percentiles = {str(q): value for q, value in self.timings.quantiles(reportedQuantiles).items()}
+        baseline, source = self.baseline()
+        passed = True
+        for q in reportedQuantiles:
+            name = str(q)
+            ratio = percentiles[name] / baseline[name] if baseline.get(name) else 0
+            print('#\tp{:g}: {:d}ms, {} {:d}ms, ratio {:.2f}'.format(q * 100, percentiles[name], source, int(baseline.get(name, 0)), ratio))
+
+            # The percentiles most journeys see decide; the slowest are noisy
+            if q <= 0.9 and ratio > self.threshold:
+                passed = False
+
+        if self.baselineFile:
+            self.saveBaseline(percentiles)
+        return passed
+
+
+# Main
+if __name__ == '__main__':
+
+    # Read args supplied to script
+    parser = argparse.ArgumentParser(description = 'Warms a routing service with recent journeys and checks its latency.')
+    parser.add_argument('--sample', type = int, default = 200, help = 'Number of journeys replayed')
+    parser.add_argument('--concurrency', type = int, default = 4, help = 'Number of journeys planned at once')
+    parser.add_argument('--window', type = int, default = 60, help = 'Minutes of the access log sampled')
+    parser.add_argument('--threshold', type = float, default = 1.5, help = 'Ratio to the baseline percentiles above which the switch is blocked')
+    parser.add_argument('--baseline', dest = 'baselineFile', help = 'JSON file of the percentiles of the warm-ups of recent editions, to which those of this one are saved')
+    parser.add_argument('--edition', default = '', help = 'Edition being warmed, under which the percentiles are saved')
+    parser.add_argument('--previous-edition', dest = 'previousEdition', help = 'Edition being replaced, compared with rather than the one most recently warmed')
+    parser.add_argument('--method', required = True, help = 'Routing service method planning a journey')
+    parser.add_argument('logfile')
+    parser.add_argument('routingUrl')
+    args = parser.parse_args()
+
+    warmup = routingWarmup(args.logfile, args.routingUrl)
+    warmup.sampleSize = args.sample
+    warmup.concurrency = args.concurrency
+    warmup.windowMinutes = args.window
+    warmup.threshold = args.threshold
+    warmup.baselineFile = args.baselineFile
+    warmup.edition = args.edition
+    warmup.previousEdition = args.previousEdition
+    warmup.method = args.method
+
+    sys.exit(0 if warmup.check() else 1)
+
+
+# End of file
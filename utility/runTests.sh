@@ -1,8 +1,13 @@
 #!/bin/bash
 # Description
 #	Utility to run CycleStreets tests
+#	The suites are run concurrently by testRunner.py, which times them and compares them with the previous run.
 # Synopsis
 #	Expects summaryFile variable to be setup already.
+#	Optionally testBaselineFile names where the timings are kept, testEdition the edition under test which they are saved as,
+#	and failTestRegressions fails on performance regressions.
+# Result
+#	Sets testsStatus to 0 when there are no regressions, otherwise 1.
 
 ## Switch to main folder
 if [ -z "${websitesContentFolder}" ]; then
@@ -16,19 +21,15 @@ if [ -z "${summaryFile}" ]; then
 fi
 echo -e "#\tTests Summary" > ${summaryFile}
 
-# Run tests relevant to the new build, appending to summary
-echo -e "# $(date)\tStarting nearest point tests" >> ${summaryFile}
-php runtests.php "call=nearestpoint" >> ${summaryFile}
-
-echo -e "# $(date)\tStarting journey API 1 tests" >> ${summaryFile}
-php runtests.php "call=journey&apiVersion=1" >> ${summaryFile}
-
-echo -e "# $(date)\tStarting journey API 2 tests" >> ${summaryFile}
-php runtests.php "call=journey&apiVersion=2" >> ${summaryFile}
+# Timings of recent editions, with which this run is compared
+if [ -z "${testBaselineFile}" ]; then
+    testBaselineFile=${websitesLogsFolder:-${websitesContentFolder}}/testTimings.json
+fi
 
-# Compare new coverage with when the elevation.values auto tests were created
-echo -e "# $(date)\tStarting elevation auto generated tests" >> ${summaryFile}
-php runtests.php "call=elevation.values&name=Elevation auto generated test:" >> ${summaryFile}
+# Run tests relevant to the new build, appending to summary
+echo -e "# $(date)\tStarting tests" >> ${summaryFile}
+testsStatus=0
+python3 "$(dirname "${BASH_SOURCE[0]}")/testRunner.py" --baseline "${testBaselineFile}" ${testEdition:+--edition ${testEdition}} ${failTestRegressions:+--fail-on-regression} "${websitesContentFolder}" ${summaryFile} || testsStatus=$?
 
 # Finished
 echo -e "# $(date)\tCompleted tests" >> ${summaryFile}
@@ -0,0 +1,201 @@
+# Finds the most recent line of an Apache access log that contains a string, typically a request's unique_id.
+#
+# The log is searched backwards from its end in large memory-mapped blocks, stopping at the first hit, so a
+# recent request is found quickly however large the log has grown. If it is not found the search carries on into
+# the rotated logs: logFile.1 and then the gzipped logFile.2.gz, logFile.3.gz ... which are read as streams.
+#
+# Optionally an index of unique_id to byte offset can be kept up to date by running with --build-index
+# (eg every minute from cron); it is built with the incremental reader of accessLogLingerStats and makes
+# lookups of indexed requests effectively immediate. There is one index file per log inode, so old ones are
+# removed as the logs rotate.
+#
+# Synopsis
+#	searchAccessLog.py [--index indexBase] [--rotations n] logFile searchString
+#	searchAccessLog.py --build-index indexBase logFile
+#
+# Result
+#	The matching line, or nothing with exit status 1 if there is none.
+#
+# Example
+# user@veebee:$
+# python3 utility/searchAccessLog.py /websites/www/logs/api-access.log ZK9Fb38AAAEAAFzX3pUAAAAC
+
+# Dependencies
+import sys, os, re, gzip, mmap, dbm, glob, argparse
+from accessLogLingerStats import accessLogLingerStats
+
+# Size of the blocks searched
+blockBytes = 16 * 1024 * 1024
+
+def lineAround (buffer, index):
+    """
+    Returns the whole line containing the byte at index.
+    """
+    start = buffer.rfind(b'\n', 0, index) + 1
+    end = buffer.find(b'\n', index)
+    if end == -1:
+        end = len(buffer)
+    return bytes(buffer[start:end])
+
+
+def searchBackwards (path, needle):
+    """
+    Returns the last line in a plain file containing the needle, or None.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as buffer:
+            end = len(buffer)
+            while end > 0:
+                start = max(0, end - blockBytes)
+
+                # Overlap the blocks by the length of the needle, less one, so a match spanning the boundary is found
+                index = buffer.rfind(needle, start, min(len(buffer), end + len(needle) - 1))
+                if index != -1:
+                    return lineAround(buffer, index)
+                end = start
+    return None
+
+
+def searchGzipped (path, needle):
+    """
+    Returns the last line in a gzipped file containing the needle, or None.
+    A compressed stream cannot be read backwards, so it is read forwards keeping the latest match.
+    """
+    found = None
+    carry = b''
+    with gzip.open(path, 'rb') as f:
+        while True:
+            block = f.read(blockBytes)
+            if not block:
+                break
+
+            # Search only complete lines; the incomplete end is carried into the next block
+            buffer = carry + block
+            cut = buffer.rfind(b'\n') + 1
+            buffer, carry = buffer[:cut], buffer[cut:]
+            index = buffer.rfind(needle)
+            if index != -1:
+                found = lineAround(buffer, index)
+    if carry and needle in carry:
+        found = carry
+    return found
+
+
+def rotatedLogs (logfile, rotations):
+    """
+    Returns the log and its rotated versions, newest first, that exist.
+    """
+    paths = [logfile, logfile + '.1'] + ['{}.{:d}.gz'.format(logfile, number) for number in range(2, rotations + 1)]
+    return [path for path in paths if os.path.exists(path)]
+
+
+def indexFile (indexBase, inode):
+    """
+    Returns the name of the index for the log file having the inode.
+    """
+    return '{}.{:d}'.format(indexBase, inode)
+
+
+def lookupIndex (indexBase, logfile, needle):
+    """
+    Returns the line for a unique_id from the index, or None if it is not indexed.
+    """
+    for path in (logfile, logfile + '.1'):
+        # A log without an index, or one that cannot be read, is left to the scan; dbm.error is a tuple of exception classes
+        try:
+            inode = os.stat(path).st_ino
+            with dbm.open(indexFile(indexBase, inode), 'r') as index:
+                offset = index.get(needle)
+            if offset is None:
+                continue
+
+            # Check the line really is the one wanted, in case the file has been truncated and rewritten
+            with open(path, 'rb') as f:
+                f.seek(int(offset))
+                line = f.readline().rstrip(b'\n')
+        except (OSError, ValueError, *dbm.error):
+            continue
+        if needle in line:
+            return line
+    return None
+
+
+def search (logfile, needle, rotations = 7, indexBase = None):
+    """
+    Returns the most recent line containing the needle across the log and its rotations, or None.
+    """
+    if indexBase:
+        line = lookupIndex(indexBase, logfile, needle)
+        if line:
+            return line
+
+    for path in rotatedLogs(logfile, rotations):
+        line = searchGzipped(path, needle) if path.endswith('.gz') else searchBackwards(path, needle)
+        if line:
+            return line
+    return None
+
+
+def buildIndex (indexBase, logfile):
+    """
+    Adds the unique_ids of the lines logged since the last run to the index.
+    """
+    alls = accessLogLingerStats(logfile, indexBase + '.state')
+    lineFormat = alls.lineFormat
+
+    indexes = {}
+    try:
+        for line in alls.newLines():
+            match = lineFormat.search(line)
+            if not match or not match.group('uniqueid'):
+                continue
+
+            # Lines after a rotation come from the rotated file first, then the new one
+            if alls.readInode not in indexes:
+                indexes[alls.readInode] = dbm.open(indexFile(indexBase, alls.readInode), 'c')
+            indexes[alls.readInode][match.group('uniqueid')] = str(alls.lineOffset)
+    finally:
+        for index in indexes.values():
+            index.close()
+
+    # Remove indexes of logs that have rotated beyond the first rotation
+    current = set()
+    for path in (logfile, logfile + '.1'):
+        try:
+            current.add(os.stat(path).st_ino)
+        except OSError:
+            pass
+    for path in glob.glob(glob.escape(indexBase) + '.*'):
+        suffix = path[len(indexBase) + 1:].split('.')[0]
+        if suffix.isdigit() and int(suffix) not in current:
+            os.unlink(path)
+
+
+# Main
+if __name__ == '__main__':
+
+    # Read args supplied to script
+    parser = argparse.ArgumentParser(description = 'Finds the most recent access log line containing a string.')
+    parser.add_argument('--index', help = 'Base name of the unique_id index files, if used')
+    parser.add_argument('--build-index', dest = 'buildIndex', help = 'Update the index having this base name, rather than search')
+    parser.add_argument('--rotations', type = int, default = 7, help = 'Number of rotated logs to search')
+    parser.add_argument('logFile')
+    parser.add_argument('searchString', nargs = '?')
+    args = parser.parse_args()
+
+    if args.buildIndex:
+        buildIndex(args.buildIndex, args.logFile)
+        sys.exit(0)
+
+    if not args.searchString:
+        parser.error('the searchString is required')
+
+    line = search(args.logFile, args.searchString.encode('utf8'), args.rotations, args.index)
+    if line is None:
+        sys.exit(1)
+    sys.stdout.buffer.write(line + b'\n')
+
+
+# End of file
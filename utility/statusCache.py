@@ -0,0 +1,118 @@
+# Shared, cached fetch of the CycleStreets v2 status API for the munin plugins.
+#
+# The cyclestreets and photomap munin plugins both want the same status response, which is costly for the
+# live database to produce. The response is cached on disk for a short time, and a lock ensures that plugin
+# runs which coincide share one request rather than making one each. A refresh is a conditional request
+# when the server supplied an ETag or Last-Modified, and if it fails or times out a recent cached response is
+# used instead, so a slow status endpoint does not stall munin-node.
+#
+# Synopsis
+#	statusCache.py apiV2Url apiKey [cacheFile]
+#
+# Result
+#	The json status response.
+
+# Dependencies
+import sys, os, time, json, fcntl, tempfile, urllib.request, urllib.error
+
+# Defaults
+defaultTtlSeconds = 60
+defaultTimeoutSeconds = 10
+defaultMaxStaleSeconds = 3600
+
+def defaultCacheFile ():
+    """
+    Returns the cache file, in the munin plugin state folder where available.
+    """
+    folder = os.environ.get('MUNIN_PLUGSTATE') or tempfile.gettempdir()
+    return os.path.join(folder, 'cyclestreets-status.json')
+
+
+def readCache (cacheFile):
+    """
+    Returns the cached entry, as a dict with keys fetched, etag, lastModified and body, or None.
+    """
+    try:
+        with open(cacheFile) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def writeCache (cacheFile, entry):
+    """
+    Writes the cache entry, replacing the file atomically.
+    """
+    temporary = cacheFile + '.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(entry, f)
+    os.replace(temporary, cacheFile)
+
+
+def fetchStatus (apiV2Url, apiKey, cacheFile = None, ttlSeconds = defaultTtlSeconds, timeoutSeconds = defaultTimeoutSeconds, maxStaleSeconds = defaultMaxStaleSeconds):
+    """
+    Returns the decoded status API response with usage fields, from the cache if it is fresh enough.
+    """
+    if cacheFile is None:
+        cacheFile = defaultCacheFile()
+
+    # Fresh enough to use without waiting for any lock
+    entry = readCache(cacheFile)
+    if entry and time.time() - entry['fetched'] < ttlSeconds:
+        return json.loads(entry['body'])
+
+    with open(cacheFile + '.lock', 'w') as lock:
+
+        # Only one run refreshes; others wait here and then find the refreshed entry
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        entry = readCache(cacheFile)
+        if entry and time.time() - entry['fetched'] < ttlSeconds:
+            return json.loads(entry['body'])
+
+        # Needs server and api key as config
+        request = urllib.request.Request(apiV2Url + "status?key=" + apiKey + "&fields=usage")
+        if entry and entry.get('etag'):
+            request.add_header('If-None-Match', entry['etag'])
+        if entry and entry.get('lastModified'):
+            request.add_header('If-Modified-Since', entry['lastModified'])
+
+        try:
+            with urllib.request.urlopen(request, timeout = timeoutSeconds) as response:
+                entry = {
+                    'fetched': time.time(),
+                    'etag': response.headers.get('ETag'),
+                    'lastModified': response.headers.get('Last-Modified'),
+                    'body': response.read().decode('utf8'),
+                }
+
+        except urllib.error.HTTPError as e:
+
+            # Not modified: the cached body is still current
+            if e.code == 304 and entry:
+                entry['fetched'] = time.time()
+            elif entry and time.time() - entry['fetched'] < maxStaleSeconds:
+                return json.loads(entry['body'])
+            else:
+                raise
+
+        except OSError:
+
+            # Timeout or connection failure: serve stale if not too old
+            if entry and time.time() - entry['fetched'] < maxStaleSeconds:
+                return json.loads(entry['body'])
+            raise
+
+        writeCache(cacheFile, entry)
+        return json.loads(entry['body'])
+
+
+# Main
+if __name__ == '__main__':
+
+    # Read args supplied to script
+    data = fetchStatus(sys.argv[1], sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+    print(json.dumps(data))
+
+
+# End of file
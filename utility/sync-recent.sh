@@ -11,7 +11,10 @@ download=${SCRIPTDIRECTORY}/../utility/downloadDumpAndMd5.sh
 $download $administratorEmail $server $folder ${dumpPrefix}_schema_cyclestreets.sql.gz
 
 #	Download CycleStreets database
-$download $administratorEmail $server $folder ${dumpPrefix}_cyclestreets.sql.gz
+#	Not needed when the caller syncs the database incrementally; restore-recent.sh downloads it if a full reload is needed
+if [ -z "${incrementalSync}" ]; then
+    $download $administratorEmail $server $folder ${dumpPrefix}_cyclestreets.sql.gz
+fi
 
 #	Download Batch database key tables
 $download $administratorEmail $server $folder ${dumpPrefix}_csBatch_jobs_servers_threads.sql.gz
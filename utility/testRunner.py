@@ -0,0 +1,203 @@
+# Runs the CycleStreets test suites concurrently, timing each, and checks them against the previous run.
+#
+# The suites of runtests.php that runTests.sh ran in turn are run at once by a small pool of workers, as each spends most
+# of its time waiting on the routing service and the database. Their outputs are appended to the summary file in the
+# usual order, each followed by the time the suite took.
+#
+# The timings, and the number of output lines reporting a failure, are compared with those saved for the previous
+# edition: the one given by --previous-edition, or else the one most recently saved other than this --edition. A suite
+# is reported as a functional regression if it exits with an error or reports more failures than before, and as a
+# performance regression if it takes longer than the threshold ratio of its previous time. Performance regressions are
+# only warned about unless --fail-on-regression is given. The timings are always saved, under this edition, so that a
+# regression does not leave every later edition compared with an ever older one.
+#
+# Synopsis
+#	testRunner.py [--workers n] [--baseline file] [--edition name] [--previous-edition name] [--threshold ratio] [--fail-on-regression] contentFolder summaryFile
+#
+# Result
+#	Exits with status 1 when there are functional regressions, or performance regressions with --fail-on-regression.
+#
+# Example
+# cyclestreets@veebee:$
+# python3 utility/testRunner.py --baseline /websites/www/logs/testTimings.json --edition routing230601 /websites/www/content /websites/www/logs/install_test_results_routing230601.txt
+
+# Dependencies
+import sys, os, re, json, time, subprocess, argparse
+from concurrent.futures import ThreadPoolExecutor
+
+# Suites, as (description, runtests.php query)
+suites = [
+    ('nearest point tests', 'call=nearestpoint'),
+    ('journey API 1 tests', 'call=journey&apiVersion=1'),
+    ('journey API 2 tests', 'call=journey&apiVersion=2'),
+
+    # Compare new coverage with when the elevation.values auto tests were created
+    ('elevation auto generated tests', 'call=elevation.values&name=Elevation auto generated test:'),
+]
+
+# Output lines counted as reporting a failure
+failureLine = re.compile(r'fail', re.IGNORECASE)
+
+# Suites shorter than this are not checked for performance, as their timings are mostly noise
+minimumSeconds = 2
+
+# Number of editions whose results are kept in the baseline file
+keptEditions = 10
+
+class testRunner ():
+    """
+    Runs the test suites concurrently and compares them with the previous run.
+    """
+
+    def __init__(self, contentFolder, summaryFile):
+
+        # Where runtests.php is run, and the summary appended to
+        self.contentFolder = contentFolder
+        self.summaryFile = summaryFile
+
+        # Options
+        self.workers = len(suites)
+        self.baselineFile = None
+        self.edition = ''
+        self.previousEdition = None
+        self.threshold = 1.5
+        self.failOnRegression = False
+
+        # Results per suite query, as dicts of when started, output, status, seconds and failures
+        self.results = {}
+
+
+    def runSuite (self, query):
+        """
+        Runs one suite, recording its output and timing.
+        """
+        started = time.time()
+        process = subprocess.run(['php', 'runtests.php', query], cwd = self.contentFolder, capture_output = True, text = True)
+        self.results[query] = {
+            'started': time.strftime('%c', time.localtime(started)),
+            'output': process.stdout + process.stderr,
+            'status': process.returncode,
+            'seconds': round(time.time() - started, 1),
+            'failures': sum(1 for line in process.stdout.splitlines() if failureLine.search(line)),
+        }
+
+
+    def run (self):
+        """
+        Runs the suites and appends their outputs to the summary in the usual order.
+        """
+        with ThreadPoolExecutor(max_workers = self.workers) as executor:
+            list(executor.map(self.runSuite, [query for description, query in suites]))
+
+        with open(self.summaryFile, 'a') as f:
+            for description, query in suites:
+                result = self.results[query]
+                f.write('# {}\tStarting {}\n'.format(result['started'], description))
+                f.write(result['output'])
+                f.write('#\tTook {:.1f}s\n'.format(result['seconds']))
+
+
+    def readEditions (self):
+        """
+        Returns the saved results of each edition, as dicts of when and suites keyed by edition.
+        """
+        try:
+            with open(self.baselineFile) as f:
+                return json.load(f)['editions']
+        except (OSError, ValueError, KeyError, TypeError):
+            return {}
+
+
+    def readBaseline (self):
+        """
+        Returns the results of the previous edition, keyed by suite query, or an empty dict.
+        """
+        if not self.baselineFile:
+            return {}
+        editions = self.readEditions()
+        if self.previousEdition in editions:
+            return editions[self.previousEdition]['suites']
+        others = [entry for edition, entry in editions.items() if not self.edition or edition != self.edition]
+        return max(others, key = lambda entry: entry['when'])['suites'] if others else {}
+
+
+    def compare (self):
+        """
+        Returns the functional and performance regressions, as lists of messages.
+        """
+        baseline = self.readBaseline()
+        functional = []
+        performance = []
+        for description, query in suites:
+            result = self.results[query]
+            previous = baseline.get(query)
+            if result['status']:
+                functional.append('The {} exited with status {:d}'.format(description, result['status']))
+            elif previous and result['failures'] > previous['failures']:
+                functional.append('The {} reported {:d} failures, previously {:d}'.format(description, result['failures'], previous['failures']))
+
+            if previous and previous['seconds'] >= minimumSeconds and result['seconds'] > previous['seconds'] * self.threshold:
+                performance.append('The {} took {:.1f}s, previously {:.1f}s'.format(description, result['seconds'], previous['seconds']))
+        return functional, performance
+
+
+    def saveBaseline (self):
+        """
+        Saves the timings and failure counts of this run under its edition, keeping those of the most recent editions.
+        """
+        editions = self.readEditions()
+        editions[self.edition] = {'when': time.time(), 'suites': {query: {'seconds': result['seconds'], 'failures': result['failures']} for query, result in self.results.items()}}
+        editions = dict(sorted(editions.items(), key = lambda item: item[1]['when'])[-keptEditions:])
+        temporary = self.baselineFile + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump({'editions': editions}, f, indent = 1)
+        os.replace(temporary, self.baselineFile)
+
+
+    def check (self):
+        """
+        Runs the suites and reports regressions in the summary. Returns True when there are none that fail the run.
+        """
+        started = time.time()
+        self.run()
+        functional, performance = self.compare()
+
+        with open(self.summaryFile, 'a') as f:
+            f.write('#\tTests took {:.0f}s with {:d} workers\n'.format(time.time() - started, self.workers))
+            for message in functional:
+                f.write('#\tFunctional regression: {}\n'.format(message))
+            for message in performance:
+                f.write('#\tPerformance regression{}: {}\n'.format('' if self.failOnRegression else ' (warning)', message))
+
+        if self.baselineFile:
+            self.saveBaseline()
+        return not functional and not (performance and self.failOnRegression)
+
+
+# Main
+if __name__ == '__main__':
+
+    # Read args supplied to script
+    parser = argparse.ArgumentParser(description = 'Runs the CycleStreets test suites concurrently and checks for regressions.')
+    parser.add_argument('--workers', type = int, default = len(suites), help = 'Number of suites run at once')
+    parser.add_argument('--baseline', dest = 'baselineFile', help = 'JSON file of the timings of recent editions, to which those of this run are saved')
+    parser.add_argument('--edition', default = '', help = 'Edition under test, under which the timings are saved')
+    parser.add_argument('--previous-edition', dest = 'previousEdition', help = 'Edition compared with, rather than the one most recently saved')
+    parser.add_argument('--threshold', type = float, default = 1.5, help = 'Ratio to the previous time above which a suite has regressed')
+    parser.add_argument('--fail-on-regression', dest = 'failOnRegression', action = 'store_true', help = 'Fail on performance regressions, rather than warn')
+    parser.add_argument('contentFolder')
+    parser.add_argument('summaryFile')
+    args = parser.parse_args()
+
+    runner = testRunner(args.contentFolder, args.summaryFile)
+    runner.workers = args.workers
+    runner.baselineFile = args.baselineFile
+    runner.edition = args.edition
+    runner.previousEdition = args.previousEdition
+    runner.threshold = args.threshold
+    runner.failOnRegression = args.failOnRegression
+
+    sys.exit(0 if runner.check() else 1)
+
+
+# End of file